@@ -18,7 +18,7 @@
 ## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
 
 import enum
-from typing import NamedTuple
+from typing import Any, NamedTuple, Optional, Tuple
 
 
 class MicroscopeError(Exception):
@@ -154,6 +154,101 @@ class ROI(NamedTuple):
     height: int
 
 
+class FrameMetadata:
+    """Metadata for data acquired by a :class:`microscope.abc.DataDevice`.
+
+    Each data item, typically an image, sent by a data device has
+    one of these.  Fields that are not known or do not make sense for
+    the device are `None`.
+
+    Attributes:
+        sequence: number of the data item.  It increases by one for
+            each item fetched from the device so a gap means that
+            data was dropped after being fetched.  It is `None` for
+            errors.
+        timestamp: time, as given by :func:`time.time`, when the data
+            was fetched.
+        monotonic: time, as given by :func:`time.monotonic`, when the
+            data was fetched.  Use this to compute intervals between
+            data items.
+        hardware_frame: frame counter, as reported by the hardware.
+            A gap means that data was lost on the hardware or SDK.
+        hardware_timestamp: timestamp, as reported by the hardware.
+            Its units and reference are hardware dependent.
+        exposure_time: exposure time in seconds.
+        roi: the :class:`ROI` of the image.
+        binning: the :class:`Binning` of the image.
+        transform: the transform applied to the image, a tuple of
+            three booleans for left-right flip, up-down flip, and 90
+            degrees rotation.
+
+    """
+
+    __slots__ = (
+        "sequence",
+        "timestamp",
+        "monotonic",
+        "hardware_frame",
+        "hardware_timestamp",
+        "exposure_time",
+        "roi",
+        "binning",
+        "transform",
+    )
+
+    def __init__(
+        self,
+        sequence: Optional[int] = None,
+        timestamp: Optional[float] = None,
+        monotonic: Optional[float] = None,
+        hardware_frame: Optional[int] = None,
+        hardware_timestamp: Optional[float] = None,
+        exposure_time: Optional[float] = None,
+        roi: Optional[ROI] = None,
+        binning: Optional[Binning] = None,
+        transform: Optional[Tuple[bool, bool, bool]] = None,
+    ) -> None:
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.monotonic = monotonic
+        self.hardware_frame = hardware_frame
+        self.hardware_timestamp = hardware_timestamp
+        self.exposure_time = exposure_time
+        self.roi = roi
+        self.binning = binning
+        self.transform = transform
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, FrameMetadata):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name)
+            for name in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        fields = ", ".join(
+            "%s=%r" % (name, getattr(self, name))
+            for name in self.__slots__
+            if getattr(self, name) is not None
+        )
+        return "FrameMetadata(%s)" % fields
+
+
+class DeviceEvent(NamedTuple):
+    """A change on a :class:`microscope.abc.Device`.
+
+    Sent to the clients of
+    :meth:`microscope.abc.Device.subscribe_events`.  The name is the
+    name of a setting or, for changes of state, ``"enabled"``.  Light
+    sources also report ``"power"``.
+    """
+
+    name: str
+    value: Any
+    timestamp: float
+
+
 class TriggerType(enum.Enum):
     """Type of a trigger for a :class:`microscope.abc.TriggerTargetMixin`.
 
@@ -224,3 +319,29 @@ class ElectronicShutteringMode(enum.Enum):
 
     GLOBAL = 1
     ROLLING = 2
+
+
+class DropPolicy(enum.Enum):
+    """What a :class:`microscope.abc.DataDevice` buffer does when full.
+
+    Data devices buffer data before sending it to clients.  When a
+    client is slower than the device the buffer fills up and the drop
+    policy defines what happens to new data.
+
+    :const:`DropPolicy.BLOCK`
+        Wait for space on the buffer.  Nothing is dropped but the
+        device stops fetching new data while waiting, so data may be
+        lost on the hardware instead.
+    :const:`DropPolicy.DROP_OLDEST`
+        Drop the oldest data on the buffer to make space.
+    :const:`DropPolicy.DROP_NEWEST`
+        Drop the new data.
+    :const:`DropPolicy.KEEP_LATEST`
+        Keep only the most recent data, dropping everything else on
+        the buffer.  This is useful for live displays.
+    """
+
+    BLOCK = 1
+    DROP_OLDEST = 2
+    DROP_NEWEST = 3
+    KEEP_LATEST = 4
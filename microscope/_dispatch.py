@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Buffering and dispatch of data from data devices to clients.
+
+This module has the machinery used by :class:`microscope.abc.DataDevice`
+to move data from the thread that fetches it to the clients.  It is
+not meant to be used directly.
+
+"""
+
+import bisect
+import collections
+import logging
+import pickle
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+import microscope
+
+_logger = logging.getLogger(__name__)
+
+
+class RingClosedError(Exception):
+    """Raised when getting items from a closed :class:`DispatchRing`."""
+
+    pass
+
+
+# Bin edges, in seconds, for latency histograms: 10us to 10s.
+LATENCY_BINS = tuple(
+    m * 10.0**e for e in range(-5, 1) for m in (1.0, 2.0, 5.0)
+) + (10.0,)
+
+
+class Histogram:
+    """Histogram with fixed bins, cheap enough to always be on.
+
+    There is no lock so values must be added from a single thread at
+    a time.  Reading from other threads is fine, the worst that can
+    happen is that the counts are off by a value being added.
+
+    Args:
+        edges: upper edges of the bins, in increasing order.  There is
+            an extra bin for values above the last edge.
+
+    """
+
+    def __init__(self, edges: Sequence[float] = LATENCY_BINS) -> None:
+        self._edges = tuple(edges)
+        self._counts = [0] * (len(self._edges) + 1)
+        self._n = 0
+        self._sum = 0.0
+        self._max = 0.0
+
+    def add(self, value: float) -> None:
+        self._counts[bisect.bisect_left(self._edges, value)] += 1
+        self._n += 1
+        self._sum += value
+        if value > self._max:
+            self._max = value
+
+    def get_status(self) -> Dict[str, Any]:
+        """Return the histogram.
+
+        The returned dict has the bin ``"edges"``, the ``"counts"`` on
+        each bin (with one more element than ``"edges"`` for values
+        above the last edge), and the total ``"count"``, ``"mean"``,
+        and ``"max"`` of the values.
+
+        """
+        return {
+            "edges": list(self._edges),
+            "counts": list(self._counts),
+            "count": self._n,
+            "mean": self._sum / self._n if self._n else 0.0,
+            "max": self._max,
+        }
+
+
+def data_nbytes(data: Any) -> int:
+    """Size in bytes of data for the purpose of buffer limits.
+
+    Only numpy arrays are accounted for.  Anything else, such as
+    exceptions or values from a value logger, is small enough to be
+    considered free.
+    """
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    else:
+        return 0
+
+
+class DispatchRing:
+    """Buffer with limits on number of items and total size.
+
+    This behaves like a :class:`queue.Queue` but, in addition to a
+    limit on the number of items, it has a limit on the total size
+    of the items, and a policy for what to do when it is full.
+
+    A single item larger than `max_bytes` is still accepted if the
+    buffer is empty, otherwise it could never be dispatched.
+
+    Args:
+        max_length: maximum number of items.  If zero, there is no
+            limit.
+        max_bytes: maximum total size, in bytes, of the items.  If
+            zero, there is no limit.
+        policy: what to do when the buffer is full.
+
+    """
+
+    def __init__(
+        self,
+        max_length: int = 0,
+        max_bytes: int = 0,
+        policy: microscope.DropPolicy = microscope.DropPolicy.BLOCK,
+    ) -> None:
+        if max_length < 0 or max_bytes < 0:
+            raise ValueError("buffer limits must not be negative")
+        self._max_length = max_length
+        self._max_bytes = max_bytes
+        self._policy = microscope.DropPolicy(policy)
+        self._items = collections.deque()
+        self._nbytes = 0
+        self._dropped = 0
+        self._peak_length = 0
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        # Incremented by cancel_waiting() to wake up blocked puts.
+        self._cancel_count = 0
+        self._closed = False
+
+    @property
+    def policy(self) -> microscope.DropPolicy:
+        return self._policy
+
+    @property
+    def dropped(self) -> int:
+        """Number of items dropped since the buffer was created."""
+        return self._dropped
+
+    @property
+    def nbytes(self) -> int:
+        """Total size, in bytes, of the items in the buffer."""
+        return self._nbytes
+
+    @property
+    def peak_length(self) -> int:
+        """Maximum number of items in the buffer at any time."""
+        return self._peak_length
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _fits(self, nbytes: int) -> bool:
+        if not self._items:
+            return True
+        elif self._max_length and len(self._items) >= self._max_length:
+            return False
+        elif self._max_bytes and self._nbytes + nbytes > self._max_bytes:
+            return False
+        else:
+            return True
+
+    def _drop_oldest(self) -> None:
+        _, nbytes = self._items.popleft()
+        self._nbytes -= nbytes
+        self._dropped += 1
+
+    def put(self, item: Any, nbytes: int) -> bool:
+        """Put an item in the buffer.
+
+        Args:
+            item: the item to buffer.
+            nbytes: size of the item, typically from
+                :func:`data_nbytes`.
+
+        Returns:
+            `True` if the item was put in the buffer and `False` if it
+            was dropped instead, either because of the policy or
+            because a blocked put was cancelled.
+
+        """
+        with self._lock:
+            if self._closed:
+                self._dropped += 1
+                return False
+            if self._policy is microscope.DropPolicy.KEEP_LATEST:
+                while self._items:
+                    self._drop_oldest()
+            elif self._policy is microscope.DropPolicy.DROP_OLDEST:
+                while not self._fits(nbytes):
+                    self._drop_oldest()
+            elif self._policy is microscope.DropPolicy.DROP_NEWEST:
+                if not self._fits(nbytes):
+                    self._dropped += 1
+                    return False
+            else:  # DropPolicy.BLOCK
+                cancel_count = self._cancel_count
+                while not self._fits(nbytes):
+                    self._not_full.wait()
+                    if cancel_count != self._cancel_count or self._closed:
+                        self._dropped += 1
+                        return False
+            self._items.append((item, nbytes))
+            self._nbytes += nbytes
+            self._peak_length = max(self._peak_length, len(self._items))
+            self._not_empty.notify()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """Remove and return the oldest item in the buffer.
+
+        Raises:
+            queue.Empty: if `timeout` is not `None` and there is no
+                item available within that time.
+            RingClosedError: if the buffer is closed.
+
+        """
+        with self._lock:
+            if not self._not_empty.wait_for(
+                lambda: self._items or self._closed, timeout
+            ):
+                raise queue.Empty()
+            if not self._items:
+                raise RingClosedError()
+            item, nbytes = self._items.popleft()
+            self._nbytes -= nbytes
+            self._not_full.notify()
+            return item
+
+    def cancel_waiting(self) -> None:
+        """Wake up any blocked :meth:`put` and drop their items."""
+        with self._lock:
+            self._cancel_count += 1
+            self._not_full.notify_all()
+
+    def close(self, drain: bool = False) -> None:
+        """Stop accepting new items.
+
+        Any blocked :meth:`put` returns and, once there are no more
+        items, :meth:`get` raises :exc:`RingClosedError`.
+
+        Args:
+            drain: if `False`, the items in the buffer are dropped.
+                Otherwise they can still be taken with :meth:`get`.
+
+        """
+        with self._lock:
+            self._closed = True
+            if not drain:
+                self._items.clear()
+                self._nbytes = 0
+            self._not_full.notify_all()
+            self._not_empty.notify_all()
+
+
+def _unpickle(stream: bytes, *buffers) -> Any:
+    """Unpickle data pickled by :class:`SharedPickle`."""
+    if buffers:
+        return pickle.loads(stream, buffers=buffers)
+    else:
+        return pickle.loads(stream)
+
+
+class SharedPickle:
+    """Data pickled once and shared by all clients it is sent to.
+
+    Sending the same data to several clients over Pyro would pickle
+    it once per client.  When wrapped in a `SharedPickle`, the data
+    is pickled the first time and those bytes are reused for all
+    other clients.  On the receiving side it unpickles directly to
+    the original data so clients are unaware of it.
+
+    With pickle protocol 5, the data of arrays is not copied into the
+    pickle stream but kept as out-of-band buffers.  If the Pyro
+    serializer supports them, such as
+    :class:`microscope._transport.OutOfBandPickleSerializer`, they
+    are sent without any copy into a pickle stream.
+
+    """
+
+    __slots__ = ("data", "_pickled", "_buffers", "_lock")
+
+    def __init__(self, data: Any) -> None:
+        self.data = data
+        self._pickled = None
+        self._buffers: List[Any] = []
+        self._lock = threading.Lock()
+
+    def __reduce_ex__(self, protocol):
+        with self._lock:
+            if self._pickled is None:
+                if pickle.HIGHEST_PROTOCOL >= 5:
+                    self._pickled = pickle.dumps(
+                        self.data,
+                        protocol=5,
+                        buffer_callback=self._buffers.append,
+                    )
+                else:
+                    self._pickled = pickle.dumps(
+                        self.data, protocol=pickle.HIGHEST_PROTOCOL
+                    )
+        if protocol >= 5 or not self._buffers:
+            buffers = self._buffers
+        else:
+            buffers = [bytearray(buffer.raw()) for buffer in self._buffers]
+        return (_unpickle, (self._pickled, *buffers))
+
+
+class Subscriber:
+    """A client subscribed to data with its own buffer and thread.
+
+    Data put on the subscriber is delivered to the client on a
+    dedicated thread so that a slow client only affects itself.
+    When the client falls behind, its buffer fills and the drop
+    policy decides what is lost.
+
+    Args:
+        client: the client to send data to.
+        send: function called, on the subscriber thread, with the
+            client, the data, and its metadata.
+        max_length: maximum number of items on the buffer.
+        max_bytes: maximum size, in bytes, of the items on the buffer.
+        policy: what to do when the buffer is full.
+        encode: if `True`, data is wrapped in a :class:`SharedPickle`.
+            This is only useful for clients that are Pyro proxies.
+        transform: function to call on array data, on the subscriber
+            thread, before sending it.
+        min_interval: minimum time, in seconds, between data put on
+            the buffer.  Data that arrives earlier is skipped.
+
+    """
+
+    def __init__(
+        self,
+        client: Hashable,
+        send: Callable[[Any, Any, Any], None],
+        max_length: int = 0,
+        max_bytes: int = 0,
+        policy: microscope.DropPolicy = microscope.DropPolicy.DROP_OLDEST,
+        encode: bool = False,
+        transform: Optional[Callable[[np.ndarray], Any]] = None,
+        min_interval: float = 0.0,
+    ) -> None:
+        if encode and transform is not None:
+            raise ValueError("can't encode data that will be transformed")
+        self.client = client
+        self.encode = encode
+        self._send = send
+        self._transform = transform
+        self._min_interval = min_interval
+        self._last_put = -float("inf")
+        self._skipped = 0
+        self._ring = DispatchRing(max_length, max_bytes, policy)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def ring(self) -> DispatchRing:
+        return self._ring
+
+    @property
+    def skipped(self) -> int:
+        """Number of items skipped because of the minimum interval."""
+        return self._skipped
+
+    def put(self, data: Any, metadata: Any, nbytes: int) -> bool:
+        """Queue data for delivery to the client.
+
+        Returns:
+            `False` if the data was dropped or skipped.
+
+        """
+        if self._min_interval:
+            # Only called from the dispatch thread so no need to lock.
+            now = time.monotonic()
+            if now - self._last_put < self._min_interval:
+                self._skipped += 1
+                return False
+            self._last_put = now
+        return self._ring.put((data, metadata), nbytes)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                data, metadata = self._ring.get()
+            except RingClosedError:
+                return
+            try:
+                if self._transform is not None and isinstance(
+                    data, np.ndarray
+                ):
+                    data = self._transform(data)
+                self._send(self.client, data, metadata)
+            except Exception as err:
+                _logger.error(
+                    "failed to send data to %s", self.client, exc_info=err
+                )
+
+    def close(
+        self, drain: bool = False, timeout: Optional[float] = None
+    ) -> None:
+        """Stop delivering data and wait for the subscriber thread.
+
+        If called from the subscriber thread itself, it does not wait.
+
+        Args:
+            drain: if `True`, data still on the buffer is delivered
+                before the thread ends.  Otherwise, it is dropped.
+            timeout: maximum time, in seconds, to wait for the thread.
+
+        """
+        self._ring.close(drain)
+        if threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+
+
+class FrameCollector:
+    """Client that stacks a fixed number of frames into one array.
+
+    The array is allocated when the first frame arrives, with the
+    shape and type of that frame, and each frame is copied into it.
+    Frames after the last are ignored.
+
+    Args:
+        n_frames: number of frames to collect.
+
+    """
+
+    def __init__(self, n_frames: int) -> None:
+        if n_frames < 1:
+            raise ValueError(
+                "number of frames must be positive (was %d)" % n_frames
+            )
+        self._n_frames = n_frames
+        self._stack: Optional[np.ndarray] = None
+        self._count = 0
+        self._error: Optional[Exception] = None
+        self._condition = threading.Condition()
+
+    @property
+    def count(self) -> int:
+        """Number of frames collected so far."""
+        return self._count
+
+    def put(self, data: Any) -> None:
+        with self._condition:
+            if self._count >= self._n_frames or self._error is not None:
+                return
+            if isinstance(data, Exception):
+                self._error = data
+            elif self._stack is None:
+                self._stack = np.empty(
+                    (self._n_frames,) + data.shape, dtype=data.dtype
+                )
+            elif data.shape != self._stack.shape[1:]:
+                self._error = ValueError(
+                    "frame %d has shape %s but previous frames were %s"
+                    % (self._count, data.shape, self._stack.shape[1:])
+                )
+            if self._error is None:
+                self._stack[self._count] = data
+                self._count += 1
+            self._condition.notify_all()
+
+    def wait(self, count: int, timeout: Optional[float] = None) -> bool:
+        """Wait until at least `count` frames were collected.
+
+        Returns:
+            `False` if the timeout expired before, `True` otherwise.
+
+        Raises:
+            Exception: the error received instead of a frame, if any.
+
+        """
+        with self._condition:
+            collected = self._condition.wait_for(
+                lambda: self._count >= count or self._error is not None,
+                timeout,
+            )
+            if self._error is not None:
+                raise self._error
+            return collected
+
+    @property
+    def stack(self) -> Optional[np.ndarray]:
+        """The array of frames, or `None` if no frame was received."""
+        return self._stack
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Metrics of device server processes.
+
+Each :class:`microscope.device_server.DeviceServer` serves a
+:class:`DeviceServerMetrics`, next to its devices, with the Pyro
+object id :data:`METRICS_OBJ_ID`.  It reports the number and latency
+of the remote calls to each method, the occupancy of the Pyro thread
+pool, the memory and CPU time used by the process, and the counters
+of the data devices.
+
+:func:`to_prometheus` formats the metrics of several device servers
+in the Prometheus text format, and :func:`serve_http` serves them
+over HTTP.
+
+"""
+
+import functools
+import http.server
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional
+
+import Pyro4
+
+import microscope.abc
+from microscope._dispatch import Histogram
+
+_logger = logging.getLogger(__name__)
+
+
+METRICS_OBJ_ID = "DeviceServerMetrics"
+
+
+class RPCMetrics:
+    """Number and latency of remote calls by method.
+
+    Calls are recorded from the threads of the Pyro thread pool, so
+    unlike :class:`microscope._dispatch.Histogram`, this is thread
+    safe.
+
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._latency: Dict[str, Histogram] = {}
+        self._errors: Dict[str, int] = {}
+
+    def record(self, method: str, latency: float, failed: bool) -> None:
+        with self._lock:
+            if method not in self._latency:
+                self._latency[method] = Histogram()
+                self._errors[method] = 0
+            self._latency[method].add(latency)
+            if failed:
+                self._errors[method] += 1
+
+    def get_status(self) -> Dict[str, Dict[str, Any]]:
+        """Return the latency histogram, and number of errors, by method.
+
+        Methods are named ``"ClassName.method_name"``.  The histograms
+        are as returned by
+        :meth:`microscope._dispatch.Histogram.get_status` with an
+        extra ``"errors"`` key for the number of calls that raised.
+
+        """
+        with self._lock:
+            return {
+                method: dict(
+                    histogram.get_status(), errors=self._errors[method]
+                )
+                for method, histogram in self._latency.items()
+            }
+
+    def instrument(self) -> None:
+        """Record all calls made by the Pyro daemons of this process.
+
+        Pyro has no hook for this so this replaces the function that
+        Pyro uses to find the method to call.  Only use it on a
+        process dedicated to serve devices.  The latency is the time
+        spent in the method, not including (de)serialization.
+
+        """
+        get_attribute = Pyro4.util.getAttribute
+
+        def timed_get_attribute(obj, attr):
+            value = get_attribute(obj, attr)
+            if not callable(value):
+                return value
+            method = "%s.%s" % (type(obj).__name__, attr)
+
+            @functools.wraps(value)
+            def timed(*args, **kwargs):
+                failed = True
+                start = time.perf_counter()
+                try:
+                    result = value(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    self.record(method, time.perf_counter() - start, failed)
+
+            return timed
+
+        Pyro4.util.getAttribute = timed_get_attribute
+
+
+def _rss() -> Optional[int]:
+    """Current resident set size in bytes, `None` if not available."""
+    try:
+        with open("/proc/self/statm", "r") as fh:
+            pages = int(fh.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _max_rss() -> Optional[int]:
+    """Peak resident set size in bytes, `None` if not available."""
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, other Unices report kilobytes.
+    if os.uname().sysname == "Darwin":
+        return max_rss
+    else:
+        return max_rss * 1024
+
+
+@Pyro4.expose
+class DeviceServerMetrics:
+    """Metrics of a device server process.
+
+    Args:
+        name: name of the device server, the name of the device class
+            or the group.
+        devices: map of names to devices served.  It is read on each
+            call to :meth:`get_metrics` so devices added later are
+            also reported.
+        rpc: the calls to the devices.
+        pyro_daemon: the Pyro daemon serving the devices.
+
+    """
+
+    def __init__(
+        self,
+        name: str,
+        devices: Mapping[str, microscope.abc.Device],
+        rpc: RPCMetrics,
+        pyro_daemon: Pyro4.Daemon,
+    ) -> None:
+        self._name = name
+        self._devices = devices
+        self._rpc = rpc
+        self._pyro_daemon = pyro_daemon
+        self._start = time.monotonic()
+
+    def _get_thread_pool(self) -> Optional[Dict[str, int]]:
+        server = getattr(self._pyro_daemon, "transportServer", None)
+        pool = getattr(server, "pool", None)
+        if pool is None:
+            # Not using the "thread" server type.
+            return None
+        return {
+            "busy": len(pool.busy),
+            "workers": pool.num_workers(),
+            "max_workers": Pyro4.config.THREADPOOL_SIZE,
+        }
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return the metrics of the device server.
+
+        The returned dict has the keys:
+
+        ``"name"``, ``"pid"``
+            name of the device server and ID of its process.
+        ``"uptime"``
+            time, in seconds, since the devices were constructed.
+        ``"rpc"``
+            latency of the calls, by method (see
+            :meth:`RPCMetrics.get_status`).
+        ``"thread_pool"``
+            number of ``"busy"`` threads, including the one serving
+            this call, current ``"workers"``, and ``"max_workers"``
+            of the Pyro thread pool.
+        ``"rss"``, ``"max_rss"``
+            current and peak resident set size in bytes, or `None`
+            if not available on the system.
+        ``"cpu_time"``
+            CPU time, in seconds, used by the process.
+        ``"devices"``
+            map of the names of the data devices to their counters
+            (see :meth:`microscope.abc.DataDevice.get_stats`).
+
+        """
+        return {
+            "name": self._name,
+            "pid": os.getpid(),
+            "uptime": time.monotonic() - self._start,
+            "rpc": self._rpc.get_status(),
+            "thread_pool": self._get_thread_pool(),
+            "rss": _rss(),
+            "max_rss": _max_rss(),
+            "cpu_time": time.process_time(),
+            "devices": {
+                name: device.get_stats()
+                for name, device in list(self._devices.items())
+                if isinstance(device, microscope.abc.DataDevice)
+            },
+        }
+
+
+def _labels(**labels: Any) -> str:
+    escaped = []
+    for key, value in labels.items():
+        value = (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n")
+        )
+        escaped.append('%s="%s"' % (key, value))
+    return "{" + ",".join(escaped) + "}"
+
+
+class _PrometheusText:
+    """Lines of the Prometheus text format grouped by metric."""
+
+    def __init__(self) -> None:
+        self._samples: Dict[str, List[str]] = {}
+        self._types: Dict[str, str] = {}
+
+    def add(
+        self, name: str, kind: str, value: Any, suffix: str = "", **labels
+    ) -> None:
+        if value is None:
+            return
+        self._types.setdefault(name, kind)
+        self._samples.setdefault(name, []).append(
+            "%s%s%s %r" % (name, suffix, _labels(**labels), float(value))
+        )
+
+    def add_histogram(
+        self, name: str, status: Mapping[str, Any], **labels
+    ) -> None:
+        cumulative = 0
+        for edge, count in zip(status["edges"], status["counts"]):
+            cumulative += count
+            self.add(
+                name, "histogram", cumulative, "_bucket", le=edge, **labels
+            )
+        self.add(
+            name, "histogram", status["count"], "_bucket", le="+Inf", **labels
+        )
+        self.add(
+            name,
+            "histogram",
+            status["mean"] * status["count"],
+            "_sum",
+            **labels,
+        )
+        self.add(name, "histogram", status["count"], "_count", **labels)
+
+    def __str__(self) -> str:
+        lines = []
+        for name, samples in self._samples.items():
+            lines.append("# TYPE %s %s" % (name, self._types[name]))
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def to_prometheus(all_metrics: Iterable[Mapping[str, Any]]) -> str:
+    """Format metrics of device servers in Prometheus text format.
+
+    Args:
+        all_metrics: metrics of each device server, as returned by
+            :meth:`DeviceServerMetrics.get_metrics`.
+
+    """
+    text = _PrometheusText()
+    for metrics in all_metrics:
+        server = {"server": metrics["name"], "pid": metrics["pid"]}
+        text.add(
+            "microscope_uptime_seconds", "gauge", metrics["uptime"], **server
+        )
+        for method, status in metrics["rpc"].items():
+            text.add(
+                "microscope_rpc_calls_total",
+                "counter",
+                status["count"],
+                method=method,
+                **server,
+            )
+            text.add(
+                "microscope_rpc_errors_total",
+                "counter",
+                status["errors"],
+                method=method,
+                **server,
+            )
+            text.add_histogram(
+                "microscope_rpc_latency_seconds",
+                status,
+                method=method,
+                **server,
+            )
+        if metrics["thread_pool"] is not None:
+            for key, value in metrics["thread_pool"].items():
+                text.add(
+                    "microscope_pyro_threads_%s" % key,
+                    "gauge",
+                    value,
+                    **server,
+                )
+        text.add(
+            "microscope_process_resident_memory_bytes",
+            "gauge",
+            metrics["rss"],
+            **server,
+        )
+        text.add(
+            "microscope_process_max_resident_memory_bytes",
+            "gauge",
+            metrics["max_rss"],
+            **server,
+        )
+        text.add(
+            "microscope_process_cpu_seconds_total",
+            "counter",
+            metrics["cpu_time"],
+            **server,
+        )
+        for device, stats in metrics["devices"].items():
+            for key, value in stats.items():
+                name = "microscope_data_%s" % key
+                if isinstance(value, Mapping) and "edges" in value:
+                    text.add_histogram(
+                        name + "_seconds", value, device=device, **server
+                    )
+                elif isinstance(value, (int, float)):
+                    text.add(name, "untyped", value, device=device, **server)
+    return str(text)
+
+
+def serve_http(
+    port: int, get_text: Callable[[], str], host: str = "127.0.0.1"
+) -> http.server.HTTPServer:
+    """Serve text, such as metrics, on ``/metrics`` over HTTP.
+
+    The server runs on a daemon thread until its ``shutdown`` method
+    is called.
+
+    Args:
+        port: port to serve on.
+        get_text: function called on each request for the text to
+            serve.
+        host: address to serve on, local only by default.
+
+    """
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            try:
+                body = get_text().encode("utf-8")
+            except Exception as e:
+                _logger.error("Failed to get metrics", exc_info=e)
+                self.send_error(500)
+                return
+            self.send_response(200)
+            self.send_header(
+                "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+            )
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            _logger.debug(format, *args)
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Processing of data from data devices before dispatch.
+
+The data from a :class:`microscope.abc.DataDevice` goes through a
+:class:`Pipeline` of :class:`Stage` before being sent to clients.
+The pipeline can run on a pool of worker threads, in which case
+several data items are processed at the same time but are still
+delivered in the order they were acquired.
+
+Most of the processing is done by numpy which releases the GIL, so
+multiple threads do help.
+
+"""
+
+import concurrent.futures
+import logging
+import math
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+import microscope
+import microscope._dispatch
+
+_logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """A processing step with timing statistics.
+
+    Subclasses must implement :meth:`process`.  Stages may be called
+    from multiple threads at the same time so :meth:`process` must be
+    thread safe.
+
+    Args:
+        name: name of the stage, used to report its timings.
+
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._count = 0
+        self._total_time = 0.0
+        self._max_time = 0.0
+        self._histogram = microscope._dispatch.Histogram()
+
+    def process(self, data: np.ndarray) -> np.ndarray:
+        """Return the processed data."""
+        raise NotImplementedError()
+
+    def __call__(self, data: np.ndarray) -> np.ndarray:
+        start = time.perf_counter()
+        data = self.process(data)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._count += 1
+            self._total_time += elapsed
+            self._max_time = max(self._max_time, elapsed)
+            self._histogram.add(elapsed)
+        return data
+
+    def get_status(self) -> Dict[str, Any]:
+        """Return the timing statistics of this stage.
+
+        The returned dict has the number of items processed,
+        ``"count"``, and the mean and maximum processing time in
+        seconds, ``"mean_time"`` and ``"max_time"``.
+        """
+        with self._lock:
+            return {
+                "count": self._count,
+                "mean_time": self._total_time / max(self._count, 1),
+                "max_time": self._max_time,
+            }
+
+    def get_histogram(self) -> Dict[str, Any]:
+        """Return the histogram of processing times, in seconds."""
+        with self._lock:
+            return self._histogram.get_status()
+
+
+class FunctionStage(Stage):
+    """Stage that calls a function on the data."""
+
+    def __init__(
+        self, name: str, function: Callable[[np.ndarray], np.ndarray]
+    ) -> None:
+        super().__init__(name)
+        self._function = function
+
+    def process(self, data: np.ndarray) -> np.ndarray:
+        return self._function(data)
+
+
+class CropStage(Stage):
+    """Crop the data to a region of interest.
+
+    Args:
+        roi: region to keep.  A width or height of zero keeps
+            everything after left or top.
+
+    """
+
+    def __init__(self, roi: microscope.ROI) -> None:
+        super().__init__("crop")
+        self.roi = microscope.ROI(*roi)
+
+    def process(self, data: np.ndarray) -> np.ndarray:
+        left, top, width, height = self.roi
+        bottom = top + height if height else None
+        right = left + width if width else None
+        return data[top:bottom, left:right]
+
+
+class BinningStage(Stage):
+    """Sum blocks of pixels.
+
+    Rows and columns that do not fill a whole bin are discarded.  The
+    sum is computed in a larger integer type, as returned by
+    :func:`numpy.sum`, so that it does not overflow.
+
+    Args:
+        binning: size of the bins.
+
+    """
+
+    def __init__(self, binning: microscope.Binning) -> None:
+        super().__init__("binning")
+        self.binning = microscope.Binning(*binning)
+
+    def process(self, data: np.ndarray) -> np.ndarray:
+        h_bin, v_bin = self.binning
+        height = data.shape[0] // v_bin
+        width = data.shape[1] // h_bin
+        blocks = data[: height * v_bin, : width * h_bin].reshape(
+            height, v_bin, width, h_bin
+        )
+        return blocks.sum(axis=(1, 3))
+
+
+class BackgroundStage(Stage):
+    """Subtract a background image, clipping at zero.
+
+    The data keeps its type.  Data with a shape different from the
+    background is not modified.
+
+    Args:
+        background: image to subtract.
+
+    """
+
+    def __init__(self, background: Optional[np.ndarray] = None) -> None:
+        super().__init__("background")
+        self.background = background
+
+    def process(self, data: np.ndarray) -> np.ndarray:
+        background = self.background
+        if background is None or background.shape != data.shape:
+            return data
+        return data - np.minimum(data, background)
+
+
+class StatisticsStage(Stage):
+    """Compute simple statistics of the data without modifying it.
+
+    The statistics of the latest data are reported with the timings
+    under the ``"statistics"`` key.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("statistics")
+        self._latest: Dict[str, float] = {}
+
+    def process(self, data: np.ndarray) -> np.ndarray:
+        # Replace the whole dict so that readers never see it half
+        # updated.
+        self._latest = {
+            "min": data.min().item(),
+            "max": data.max().item(),
+            "mean": data.mean().item(),
+        }
+        return data
+
+    def get_status(self) -> Dict[str, Any]:
+        status = super().get_status()
+        status["statistics"] = self._latest
+        return status
+
+
+def make_preview(
+    data: np.ndarray,
+    max_size: int,
+    value_range: Optional[Tuple[float, float]] = None,
+) -> np.ndarray:
+    """Return a small 8 bit version of an image for display.
+
+    The image is binned, by averaging, by the smallest integer factor
+    that makes both dimensions no larger than `max_size`, and then
+    scaled to the 0 to 255 range.  Colour images, with a trailing
+    channel axis, keep their channels and all are scaled the same.
+
+    Args:
+        data: the image, of shape ``(height, width)`` or ``(height,
+            width, channels)``.
+        max_size: maximum width and height of the preview.
+        value_range: the values of the image mapped to 0 and 255.  If
+            `None`, the minimum and maximum of the binned image.
+
+    """
+    factor = max(1, math.ceil(max(data.shape[:2]) / max_size))
+    if factor > 1:
+        height = data.shape[0] // factor
+        width = data.shape[1] // factor
+        data = (
+            data[: height * factor, : width * factor]
+            .reshape(height, factor, width, factor, *data.shape[2:])
+            .mean(axis=(1, 3))
+        )
+    if value_range is None:
+        low, high = data.min(), data.max()
+    else:
+        low, high = value_range
+    scale = 255.0 / (high - low) if high > low else 0.0
+    preview = (np.asarray(data, dtype=np.float32) - low) * scale
+    return np.clip(preview, 0, 255, out=preview).astype(np.uint8)
+
+
+class Pipeline:
+    """Processing stages run on a pool of threads.
+
+    Items are delivered in the same order they are put on the
+    pipeline, even if processed concurrently.  With no workers, the
+    default, items are processed and delivered on the calling thread.
+
+    Args:
+        first: function to call on the data before the stages,
+            typically the device ``_process_data``.
+        deliver: function called with the processed data, the
+            context given to :meth:`put`, and the exception raised
+            while processing or `None`.
+        max_pending: maximum number of items being processed at the
+            same time.  When reached, :meth:`put` blocks.
+
+    """
+
+    def __init__(
+        self,
+        first: Callable[[Any], Any],
+        deliver: Callable[[Any, Any, Optional[Exception]], None],
+        max_pending: int = 32,
+    ) -> None:
+        self._first = FunctionStage("process_data", first)
+        self._deliver = deliver
+        self._stages: Sequence[Stage] = ()
+        self._lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._n_workers = 0
+        # Futures, in order, and their context.  Only used, and the
+        # collector thread only started, once there are workers.
+        self._pending: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._collector: Optional[threading.Thread] = None
+
+    @property
+    def n_workers(self) -> int:
+        return self._n_workers
+
+    @property
+    def first(self) -> Stage:
+        """The stage with the function called before all others."""
+        return self._first
+
+    @property
+    def stages(self) -> Sequence[Stage]:
+        return self._stages
+
+    def set_stages(self, stages: Sequence[Stage]) -> None:
+        """Replace the processing stages.
+
+        Items already being processed are not affected.
+        """
+        self._stages = tuple(stages)
+
+    def set_workers(self, n_workers: int) -> None:
+        """Change the number of worker threads.
+
+        Items already being processed finish on the old workers.
+        """
+        if n_workers < 0:
+            raise ValueError("number of workers must not be negative")
+        with self._lock:
+            if n_workers == self._n_workers:
+                return
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if n_workers > 0:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    n_workers, thread_name_prefix="pipeline"
+                )
+                if self._collector is None:
+                    self._collector = threading.Thread(
+                        target=self._collect, daemon=True
+                    )
+                    self._collector.start()
+            self._n_workers = n_workers
+
+    def run(self, data: Any) -> Any:
+        """Process data through all stages."""
+        data = self._first(data)
+        for stage in self._stages:
+            data = stage(data)
+        return data
+
+    def put(self, data: Any, context: Any, process: bool = True) -> None:
+        """Process and deliver data.
+
+        Args:
+            data: the data to process.
+            context: passed, unmodified, to the deliver function.
+            process: if `False`, the data is delivered unmodified but
+                still in order with the other items.
+
+        """
+        # Submit while holding the lock, otherwise set_workers or
+        # close may shut down the executor in between.
+        with self._lock:
+            collector = self._collector
+            if self._executor is not None and process:
+                future = self._executor.submit(self.run, data)
+            else:
+                future = None
+        if future is None:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(self.run(data) if process else data)
+            except Exception as err:
+                future.set_exception(err)
+            if collector is None:
+                # Never had workers so nothing is pending.
+                self._deliver_future(future, context)
+                return
+        self._pending.put((future, context))
+
+    def _deliver_future(self, future, context) -> None:
+        try:
+            data = future.result()
+        except Exception as err:
+            self._deliver(None, context, err)
+        else:
+            self._deliver(data, context, None)
+
+    def _collect(self) -> None:
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            future, context = item
+            try:
+                self._deliver_future(future, context)
+            except Exception as err:
+                _logger.error("failed to deliver processed data", exc_info=err)
+
+    def get_status(self) -> Dict[str, Any]:
+        """Return the number of workers and the timing of each stage."""
+        return {
+            "workers": self._n_workers,
+            "pending": self._pending.qsize(),
+            "stages": {
+                stage.name: stage.get_status()
+                for stage in (self._first,) + tuple(self._stages)
+            },
+        }
+
+    def close(self) -> None:
+        """Stop the worker threads."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            self._n_workers = 0
+            if self._collector is not None:
+                self._pending.put(None)
+                self._collector = None
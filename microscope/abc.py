@@ -21,20 +21,38 @@
 """Abstract Base Classes for the different device types."""
 
 import abc
+import contextlib
 import functools
 import itertools
 import logging
-import queue
+import os
+import random
 import threading
 import time
 from enum import EnumMeta
 from threading import Thread
-from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 import numpy as np
 import Pyro4
 
 import microscope
+import microscope._dispatch
+import microscope._pipeline
+import microscope._transport
+import microscope.recording
 
 _logger = logging.getLogger(__name__)
 
@@ -53,6 +71,10 @@ DTYPES = {
 }
 
 
+# Value of a setting that has not been read or set yet.
+_UNKNOWN = object()
+
+
 def _call_if_callable(f):
     """Call callables, or return value of non-callables."""
     return f() if callable(f) else f
@@ -74,6 +96,22 @@ class _Setting:
             function will return `True` or `False` to indicate its
             current state.  If set to no `None` (default), then its
             value will be dependent on the value of `set_func`.
+        cache: policy for caching the value returned by `get_func`.
+            `None` (default) for no caching, ``"static"`` for values
+            that never change, ``"write"`` for values that only change
+            when the setting is set, or a number of seconds for which
+            the value is kept.  Setting a value always clears the
+            cache.
+        depends: names of the settings that must be set before this
+            one.  Setting any of them may change the value of this
+            setting.
+        verify: whether to read the value back after setting it in
+            :meth:`Device.update_settings`, for settings that the
+            hardware may not set to the exact value requested.
+        live: whether the setting can be set during acquisition.  If
+            `False`, data devices stop acquisition to set it.
+        optional: whether :meth:`Device.update_settings` with
+            ``init=True`` can be given no value for it.
 
     A client needs some way of knowing a setting name and data type,
     retrieving the current value and, if settable, a way to retrieve
@@ -101,8 +139,36 @@ class _Setting:
         set_func: Optional[Callable[[Any], None]] = None,
         values: Any = None,
         readonly: Optional[Callable[[], bool]] = None,
+        cache: Union[None, str, float] = None,
+        depends: Sequence[str] = (),
+        verify: bool = False,
+        live: bool = False,
+        optional: bool = False,
     ) -> None:
         self.name = name
+        self.depends = tuple(depends)
+        self.verify = verify
+        self.live = live
+        self.optional = optional
+        # Last value read or set, as it would be returned by get.
+        self.last_known: Any = _UNKNOWN
+        if not (
+            cache is None
+            or cache in ("static", "write")
+            or (
+                isinstance(cache, (int, float))
+                and not isinstance(cache, bool)
+                and cache >= 0
+            )
+        ):
+            raise ValueError(
+                "Invalid cache policy for '%s': %s" % (name, cache)
+            )
+        self.cache = cache
+        # Cached value and the time it was read, or None.
+        self._cached: Optional[Tuple[Any, float]] = None
+        self.cache_hits = 0
+        self.cache_misses = 0
         if dtype not in DTYPES:
             raise ValueError("Unsupported dtype.")
         elif not (isinstance(values, DTYPES[dtype]) or callable(values)):
@@ -145,16 +211,79 @@ class _Setting:
             "cached": self._last_written is not None,
         }
 
-    def get(self):
-        if self._get is not None:
-            value = self._get()
-        else:
-            value = self._last_written
+    def _valid_cache(self) -> Optional[Tuple[Any, float]]:
+        cached = self._cached
+        if cached is not None and (
+            isinstance(self.cache, str)
+            or time.monotonic() - cached[1] < self.cache
+        ):
+            return cached
+        return None
+
+    def _read(self):
+        if self.cache is None:
+            return self._get()
+        cached = self._valid_cache()
+        if cached is not None:
+            self.cache_hits += 1
+            return cached[0]
+        self.cache_misses += 1
+        value = self._get()
+        self._cached = (value, time.monotonic())
+        return value
+
+    def _convert(self, value):
         if isinstance(self._values, EnumMeta):
             return self._values(value).value
         else:
             return value
 
+    def invalidate(self) -> None:
+        """Clear the cached and last known value, if any."""
+        self._cached = None
+        self.last_known = _UNKNOWN
+
+    def needs_read(self) -> bool:
+        """Whether getting the value requires reading the hardware."""
+        return self._get is not None and (
+            self.cache is None or self._valid_cache() is None
+        )
+
+    def is_known(self) -> bool:
+        """Whether the last known value can be trusted as current.
+
+        Values of settings without a cache policy may change by other
+        means at any time.  With ``"static"`` and ``"write"`` policies
+        they only change when set, and otherwise until the cache
+        expires.
+        """
+        if self.last_known is _UNKNOWN or self.cache is None:
+            return False
+        if isinstance(self.cache, str):
+            return True
+        return not self.needs_read()
+
+    def get(self):
+        if self._get is not None:
+            value = self._read()
+        else:
+            value = self._last_written
+        self.last_known = self._convert(value)
+        return self.last_known
+
+    def get_from(self, value):
+        """Return the value of the setting given the read value.
+
+        For values read by other means than `get_func`, typically
+        together with other settings.  The value is cached according
+        to the cache policy.
+        """
+        if self.cache is not None:
+            self.cache_misses += 1
+            self._cached = (value, time.monotonic())
+        self.last_known = self._convert(value)
+        return self.last_known
+
     def readonly(self) -> bool:
         return self._readonly()
 
@@ -163,9 +292,15 @@ class _Setting:
         if self._set is None:
             raise NotImplementedError()
         # TODO further validation.
+        self.last_known = _UNKNOWN
+        requested = value
         if isinstance(self._values, EnumMeta):
             value = self._values(value)
-        self._set(value)
+        try:
+            self._set(value)
+        finally:
+            self._cached = None
+        self.last_known = requested
 
     def values(self):
         if isinstance(self._values, EnumMeta):
@@ -282,6 +417,20 @@ class TriggerTargetMixin(metaclass=abc.ABCMeta):
 class Device(metaclass=abc.ABCMeta):
     """A base device class. All devices should subclass this class."""
 
+    # Clients of subscribe_events to their subscriber and the names
+    # of the events they want.  Replaced, never modified, on change so
+    # it can be iterated without the lock.  These are class attributes
+    # because not all devices call `Device.__init__`.
+    _event_subscribers: Mapping[
+        Any, Tuple[microscope._dispatch.Subscriber, Optional[frozenset]]
+    ] = {}
+    _event_subscribers_lock = threading.Lock()
+
+    # Version and cache of describe_settings, and whether it needs to
+    # be checked for changes.
+    _settings_descriptions: Tuple[int, List] = (0, [])
+    _settings_descriptions_stale = True
+
     def __init__(self) -> None:
         self.enabled = False
         self._settings: Dict[str, _Setting] = {}
@@ -289,6 +438,105 @@ class Device(metaclass=abc.ABCMeta):
     def __del__(self) -> None:
         self.shutdown()
 
+    def subscribe_events(
+        self,
+        client,
+        names: Optional[List[str]] = None,
+        buffer_length: int = 64,
+    ) -> None:
+        """Subscribe a client to be notified of changes.
+
+        Instead of polling settings and state, clients can subscribe
+        to receive a :class:`microscope.DeviceEvent` when a setting is
+        set or the device is enabled or disabled.  Drivers may also
+        send events when they notice changes on the hardware.
+
+        Events are sent on a separate thread for each client, with
+        Pyro oneway calls, so slow clients do not delay the device.
+        If a client falls behind, its oldest events are dropped.
+
+        Subscribing a client that is already subscribed replaces its
+        subscription.
+
+        Args:
+            client: the client or its Pyro URI.  It must have a
+                ``receive_event`` method, that takes the event, or a
+                ``put`` method, like :class:`queue.Queue`.
+            names: names of the events to send.  If `None`, sends all.
+            buffer_length: maximum number of events waiting to be sent
+                to the client.
+
+        """
+        if isinstance(client, (str, Pyro4.core.URI)):
+            client = Pyro4.Proxy(client)
+        if isinstance(client, Pyro4.Proxy):
+            # Do not wait for the client to handle the event.
+            client._pyroOneway.add("receive_event")
+        subscriber = microscope._dispatch.Subscriber(
+            client, self._send_event, buffer_length
+        )
+        wanted = None if names is None else frozenset(names)
+        with self._event_subscribers_lock:
+            subscribers = dict(self._event_subscribers)
+            old = subscribers.get(client)
+            subscribers[client] = (subscriber, wanted)
+            self._event_subscribers = subscribers
+        if old is not None:
+            old[0].close()
+
+    def unsubscribe_events(self, client) -> None:
+        """Stop sending events to a client.
+
+        Args:
+            client: the client or its Pyro URI.
+
+        """
+        if isinstance(client, (str, Pyro4.core.URI)):
+            client = Pyro4.Proxy(client)
+        with self._event_subscribers_lock:
+            subscribers = dict(self._event_subscribers)
+            old = subscribers.pop(client, None)
+            self._event_subscribers = subscribers
+        if old is None:
+            _logger.warning("%s is not subscribed to events.", client)
+        else:
+            old[0].close()
+
+    def _notify(self, name: str, value: Any) -> None:
+        """Send an event to the subscribed clients.
+
+        Drivers should call this when they notice a change on the
+        hardware that was not made via this object, e.g., a change
+        made on the hardware front panel.
+
+        Args:
+            name: name of the setting or property that changed.
+            value: its new value.
+
+        """
+        # Any change may change the settings values or readonly state.
+        self._settings_descriptions_stale = True
+        subscribers = self._event_subscribers
+        if not subscribers:
+            return
+        event = microscope.DeviceEvent(name, value, time.time())
+        for subscriber, wanted in subscribers.values():
+            if wanted is None or name in wanted:
+                subscriber.put(event, None, 0)
+
+    def _send_event(self, client, event, metadata) -> None:
+        try:
+            if hasattr(client, "put"):
+                client.put(event)
+            else:
+                client.receive_event(event)
+        except (
+            Pyro4.errors.ConnectionClosedError,
+            Pyro4.errors.CommunicationError,
+        ):
+            _logger.info("Removing %s: disconnected.", client)
+            self.unsubscribe_events(client)
+
     def get_is_enabled(self) -> bool:
         return self.enabled
 
@@ -305,6 +553,7 @@ class Device(metaclass=abc.ABCMeta):
         """Disable the device for a short period for inactivity."""
         self._do_disable()
         self.enabled = False
+        self._notify("enabled", self.enabled)
 
     def _do_enable(self):
         """Do any device specific work on enable.
@@ -321,6 +570,7 @@ class Device(metaclass=abc.ABCMeta):
             self.enabled = self._do_enable()
         except Exception as err:
             _logger.debug("Error in _do_enable:", exc_info=err)
+        self._notify("enabled", self.enabled)
 
     @abc.abstractmethod
     def _do_shutdown(self) -> None:
@@ -392,6 +642,8 @@ class Device(metaclass=abc.ABCMeta):
         _logger.info("Shutting down ... ... ...")
         self._do_shutdown()
         _logger.info("... ... ... ... shut down completed.")
+        for client in list(self._event_subscribers):
+            self.unsubscribe_events(client)
 
     def add_setting(
         self,
@@ -401,6 +653,11 @@ class Device(metaclass=abc.ABCMeta):
         set_func,
         values,
         readonly: Optional[Callable[[], bool]] = None,
+        cache: Union[None, str, float] = None,
+        depends: Sequence[str] = (),
+        verify: bool = False,
+        live: bool = False,
+        optional: bool = False,
     ) -> None:
         """Add a setting definition.
 
@@ -418,6 +675,29 @@ class Device(metaclass=abc.ABCMeta):
                 indicate its current state.  If set to no `None`
                 (default), then its value will be dependent on the
                 value of `set_func`.
+            cache: policy for caching the value returned by
+                `get_func`.  `None` (default) for no caching,
+                ``"static"`` for values that never change, ``"write"``
+                for values that only change when set via this
+                setting, or a number of seconds for which the value is
+                kept.  Use it for settings that are slow to read.  If
+                the hardware state changes by other means, call
+                :meth:`invalidate_settings_cache`.
+            depends: names of the settings that must be set before
+                this one, e.g., exposure time may depend on binning.
+                Used by :meth:`update_settings`.
+            verify: whether :meth:`update_settings` reads the value
+                back after setting it, for hardware that may not set
+                the exact value requested.
+            live: whether the hardware accepts changes to this setting
+                during acquisition, e.g., gain on most cameras.  Data
+                devices only stop acquisition to set settings that are
+                not live.
+            optional: whether :meth:`update_settings` with
+                ``init=True`` can be given no value for this setting,
+                in which case it keeps its current value.  For
+                settings, such as those added by the base classes,
+                that were not in settings saved by older versions.
 
         A client needs some way of knowing a setting name and data
         type, retrieving the current value and, if settable, a way to
@@ -438,8 +718,64 @@ class Device(metaclass=abc.ABCMeta):
             )
         else:
             self._settings[name] = _Setting(
-                name, dtype, get_func, set_func, values, readonly
+                name,
+                dtype,
+                get_func,
+                set_func,
+                values,
+                readonly,
+                cache,
+                depends,
+                verify,
+                live,
+                optional,
             )
+            self._settings_descriptions_stale = True
+
+    def invalidate_settings_cache(
+        self, names: Optional[List[str]] = None
+    ) -> None:
+        """Clear the cached values of settings.
+
+        Drivers should call this when the hardware state may have
+        changed other than by setting a value, e.g., after changing
+        some other setting that affects it.
+
+        Args:
+            names: the settings to clear.  If `None`, clears all
+                settings except those with the ``"static"`` policy.
+
+        """
+        if names is None:
+            for setting in self._settings.values():
+                if setting.cache != "static":
+                    setting.invalidate()
+        else:
+            for name in names:
+                self._settings[name].invalidate()
+        self._settings_descriptions_stale = True
+
+    def get_settings_cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Return the use of the cache by each cached setting.
+
+        Returns a dict of setting names, for the settings with a cache
+        policy, to a dict with the ``"policy"``, the number of
+        ``"hits"`` and ``"misses"``, and the ``"hit_rate"``.
+
+        """
+        stats = {}
+        for name, setting in self._settings.items():
+            if setting.cache is None:
+                continue
+            hits = setting.cache_hits
+            misses = setting.cache_misses
+            stats[name] = {
+                "policy": setting.cache,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            }
+        return stats
 
     def get_setting(self, name: str):
         """Return the current value of a setting."""
@@ -451,17 +787,74 @@ class Device(metaclass=abc.ABCMeta):
 
     def get_all_settings(self):
         """Return ordered settings as a list of dicts."""
-
         # Fetching some settings may fail depending on device state.
         # Report these values as 'None' and continue fetching other settings.
-        def catch(f):
+        return {
+            k: None if isinstance(v, Exception) else v
+            for k, v in self.get_settings().items()
+        }
+
+    def _get_settings_batch(self, names: List[str]) -> Mapping[str, Any]:
+        """Read several settings from the hardware at once.
+
+        Called by :meth:`get_settings` with the names of the settings
+        that need to be read from hardware.  Drivers for hardware that
+        report many settings in one command should implement this to
+        avoid one command per setting.  The default reads nothing.
+
+        Args:
+            names: names of the settings to read.
+
+        Returns:
+            A dict with the values, as they would be returned by each
+            setting `get_func`, of any of the settings read.  The
+            settings not included are read one at a time.
+
+        """
+        return {}
+
+    def get_settings(
+        self, names: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """Return the current value of several settings.
+
+        Unlike :meth:`get_setting`, a failure to read a setting does
+        not stop the others from being read.
+
+        Args:
+            names: names of the settings to read.  If `None`, reads all
+                settings.
+
+        Returns:
+            A dict of setting names to their value or, if reading it
+            failed, the exception raised.
+
+        """
+        if names is None:
+            names = list(self._settings.keys())
+        to_read = [
+            name
+            for name in names
+            if name in self._settings and self._settings[name].needs_read()
+        ]
+        batch: Mapping[str, Any] = {}
+        if to_read:
             try:
-                return f()
+                batch = self._get_settings_batch(to_read)
             except Exception as err:
-                _logger.error("getting %s: %s", f.__self__.name, err)
-                return None
-
-        return {k: catch(v.get) for k, v in self._settings.items()}
+                _logger.error("failed to read settings in batch", exc_info=err)
+        results: Dict[str, Any] = {}
+        for name in names:
+            try:
+                setting = self._settings[name]
+                if name in batch:
+                    results[name] = setting.get_from(batch[name])
+                else:
+                    results[name] = setting.get()
+            except Exception as err:
+                _logger.error("getting %s: %s", name, err)
+                results[name] = err
+        return results
 
     def set_setting(self, name: str, value) -> None:
         """Set a setting."""
@@ -470,66 +863,201 @@ class Device(metaclass=abc.ABCMeta):
         except Exception as err:
             _logger.error("in set_setting(%s):", name, exc_info=err)
             raise
+        self._notify(name, value)
+
+    def set_settings(
+        self, values: Mapping[str, Any]
+    ) -> Dict[str, Optional[Exception]]:
+        """Set several settings.
+
+        Settings are set in the order given.  Unlike
+        :meth:`update_settings`, a failure to set a setting does not
+        stop the others from being set.
+
+        Args:
+            values: setting names to their new value.
+
+        Returns:
+            A dict of the setting names to `None`, if the setting was
+            set, or the exception raised while setting it.
+
+        """
+        results: Dict[str, Optional[Exception]] = {}
+        for name, value in values.items():
+            try:
+                self._settings[name].set(value)
+            except Exception as err:
+                _logger.error("in set_settings(%s):", name, exc_info=err)
+                results[name] = err
+            else:
+                results[name] = None
+                self._notify(name, value)
+        return results
 
     def describe_setting(self, name: str):
         """Return ordered setting descriptions as a list of dicts."""
         return self._settings[name].describe()
 
+    def _get_settings_descriptions(
+        self,
+    ) -> Tuple[int, List[Tuple[str, Dict[str, Any]]]]:
+        if self._settings_descriptions_stale:
+            # Clear the flag first so that changes while describing
+            # are not missed.
+            self._settings_descriptions_stale = False
+            descriptions = [
+                (k, v.describe()) for (k, v) in self._settings.items()
+            ]
+            version, old_descriptions = self._settings_descriptions
+            if version == 0:
+                # Start at a random version so that the version a
+                # client has of another instance, e.g., from before
+                # the device server was restarted, is not current.
+                version = random.getrandbits(62) + 1
+                self._settings_descriptions = (version, descriptions)
+            elif descriptions != old_descriptions:
+                self._settings_descriptions = (version + 1, descriptions)
+        return self._settings_descriptions
+
     def describe_settings(self):
-        """Return ordered setting descriptions as a list of dicts."""
-        return [(k, v.describe()) for (k, v) in self._settings.items()]
+        """Return ordered setting descriptions as a list of dicts.
+
+        The descriptions are cached and only evaluated again after a
+        setting is set, the device is enabled or disabled, or the
+        settings cache is invalidated.  Drivers whose settings values
+        or readonly state change by other means should call
+        :meth:`invalidate_settings_cache`.
+        """
+        _, descriptions = self._get_settings_descriptions()
+        return [(k, dict(v)) for (k, v) in descriptions]
+
+    def describe_settings_if_changed(
+        self, version: int
+    ) -> Tuple[int, Optional[List[Tuple[str, Dict[str, Any]]]]]:
+        """Return the setting descriptions if they changed.
+
+        Clients that keep a copy of the descriptions can use this to
+        avoid getting them again when they are current.
+
+        Args:
+            version: the version of the descriptions the client has or
+                zero if it has none.
+
+        Returns:
+            A tuple with the current version of the descriptions and
+            the descriptions, as returned by :meth:`describe_settings`,
+            or `None` if the version has not changed.
+
+        """
+        current, descriptions = self._get_settings_descriptions()
+        if version == current:
+            return (current, None)
+        return (current, [(k, dict(v)) for (k, v) in descriptions])
+
+    def _sort_settings(self, names: List[str]) -> List[str]:
+        """Order settings so that each comes after those it depends on.
+
+        Otherwise, keeps the order of `names`.
+        """
+        pending = list(names)
+        ordered: List[str] = []
+        while pending:
+            for name in pending:
+                depends = set(self._settings[name].depends) - {name}
+                if not depends.intersection(pending):
+                    break
+            else:
+                raise ValueError(
+                    "circular dependency between settings %s"
+                    % ", ".join(pending)
+                )
+            pending.remove(name)
+            ordered.append(name)
+        return ordered
 
     def update_settings(self, incoming, init: bool = False):
-        """Update settings based on dict of settings and values."""
+        """Update settings based on dict of settings and values.
+
+        Only the settings whose value differs from the current value
+        are set.  The current value of settings without a cache
+        policy, or whose cached value expired, is read first, all
+        together with :meth:`get_settings`, since it may have been
+        changed by other means.  For the others, the last known
+        value, i.e., the value last read or set, is used.  Settings
+        are set after the settings they depend on and, if any of
+        those is set, they are set too.
+
+        Args:
+            incoming: dict of setting names to their new value.
+                Unknown settings are ignored.
+            init: if `True`, assumes nothing about the current state
+                and sets all settings.  `incoming` must then have a
+                value for every setting, except those added with
+                ``optional=True``.
+
+        Returns:
+            A dict of the settings that were set to their value.  The
+            value is read back for settings marked with `verify`.
+
+        """
+        my_keys = set(self._settings.keys())
+        their_keys = set(incoming.keys())
+        keys = [key for key in incoming if key in my_keys]
         if init:
             # Assume nothing about state: set everything.
-            my_keys = set(self._settings.keys())
-            their_keys = set(incoming.keys())
-            update_keys = my_keys & their_keys
-            if update_keys != my_keys:
-                missing = ", ".join([k for k in my_keys - their_keys])
+            required = set(
+                key for key in my_keys if not self._settings[key].optional
+            )
+            if their_keys & required != required:
+                missing = ", ".join([k for k in required - their_keys])
                 msg = (
                     "update_settings init=True but missing keys: %s." % missing
                 )
                 _logger.debug(msg)
                 raise Exception(msg)
+            changed = set(keys)
         else:
-            # Only update changed values.
-            my_keys = set(self._settings.keys())
-            their_keys = set(incoming.keys())
-            update_keys = set(
+            # Only update changed values, reading those that may
+            # have changed since last known.
+            unknown = [
+                key for key in keys if not self._settings[key].is_known()
+            ]
+            if unknown:
+                self.get_settings(unknown)
+            changed = set(
                 key
-                for key in my_keys & their_keys
-                if self.get_setting(key) != incoming[key]
+                for key in keys
+                if self._settings[key].last_known is _UNKNOWN
+                or self._settings[key].last_known != incoming[key]
             )
         results = {}
-        # Update values.
-        for key in update_keys:
-            if key not in my_keys or not self._settings[key].set:
-                # Setting not recognised or no set function implemented
-                results[key] = NotImplemented
-                update_keys.remove(key)
+        updated: Set[str] = set()
+        for key in self._sort_settings(keys):
+            setting = self._settings[key]
+            if key not in changed and not updated.intersection(
+                setting.depends
+            ):
                 continue
-            if self._settings[key].readonly():
+            if setting.readonly():
                 continue
-            self._settings[key].set(incoming[key])
-        # Read back values in second loop.
-        for key in update_keys:
-            results[key] = self._settings[key].get()
+            setting.set(incoming[key])
+            updated.add(key)
+            self._notify(key, incoming[key])
+            results[key] = setting.get() if setting.verify else incoming[key]
         return results
 
 
 def keep_acquiring(func):
-    """Wrapper to preserve acquiring state of data capture devices."""
+    """Wrapper to preserve acquiring state of data capture devices.
+
+    The wrapped function is run in :meth:`DataDevice.batch_changes` so
+    that acquisition is restarted only once when several wrapped
+    functions are called as part of a larger change.
+    """
 
     def wrapper(self, *args, **kwargs):
-        if self._acquiring:
-            self.abort()
-            result = func(self, *args, **kwargs)
-            self._do_enable()
-        else:
-            result = func(self, *args, **kwargs)
-        return result
+        with self.batch_changes():
+            return func(self, *args, **kwargs)
 
     return wrapper
 
@@ -541,19 +1069,58 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
     it to a client.  The client is set using set_client(uri) or (legacy)
     receiveClient(uri).
 
+    In addition to that client, any number of clients may
+    :meth:`subscribe` to receive all data.  Each subscriber has its own
+    buffer and thread so that a slow client does not delay the others.
+    Data is processed once for all clients and, for Pyro clients,
+    also pickled only once.
+
     Derived classed should implement:
 
     * :meth:`abort` (required)
     * :meth:`_fetch_data` (required)
     * :meth:`_process_data` (optional)
+    * :meth:`_wait_for_data` (optional)
+    * :meth:`_get_hardware_metadata` (optional)
+    * :meth:`_get_acquisition_metadata` (optional)
+
+    When there is no data, the fetch thread waits before calling
+    :meth:`_fetch_data` again.  The wait starts at
+    `_fetch_backoff_min` seconds and doubles, while there is no data,
+    up to `_fetch_backoff_max`.  It is interrupted as soon as
+    :meth:`_notify_data_ready` is called.  Devices that can tell when
+    data is ready, e.g., from an SDK callback or on software trigger,
+    should call `_notify_data_ready` and set `_fetch_backoff_max` to
+    `None` so that the fetch thread sleeps until then.  Devices whose
+    SDK provides a wait handle should override `_wait_for_data`
+    instead.
 
     Derived classes may override ``__init__``, ``enable`` and
     ``disable``, but must ensure to call this class's implementations
     as indicated in the docstrings.
 
+    Args:
+        buffer_length: maximum number of items on the dispatch buffer.
+            If zero, there is no limit.
+        buffer_bytes: maximum size, in bytes, of the data on the
+            dispatch buffer.  If zero, there is no limit.  The default,
+            1 GiB, stops a slow client from using all memory: with
+            the default policy, fetching waits instead.
+        drop_policy: what to do with new data when the dispatch buffer
+            is full (see :class:`microscope.DropPolicy`).
+        shared_memory_slots: number of slots on the shared memory ring
+            used by clients that request shared memory transport.
+
     """
 
-    def __init__(self, buffer_length: int = 0, **kwargs) -> None:
+    def __init__(
+        self,
+        buffer_length: int = 0,
+        buffer_bytes: int = 2**30,
+        drop_policy: microscope.DropPolicy = microscope.DropPolicy.BLOCK,
+        shared_memory_slots: int = 8,
+        **kwargs,
+    ) -> None:
         """Derived.__init__ must call this at some point."""
         super().__init__(**kwargs)
         # A thread to fetch and dispatch data.
@@ -569,18 +1136,149 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
         # A thread to dispatch data.
         self._dispatch_thread = None
         # A buffer for data dispatch.
-        self._dispatch_buffer = queue.Queue(maxsize=buffer_length)
+        self._dispatch_buffer = microscope._dispatch.DispatchRing(
+            buffer_length, buffer_bytes, drop_policy
+        )
         # A flag to indicate if device is ready to acquire.
         self._acquiring = False
         # A condition to signal arrival of a new data and unblock grab_next_data
         self._new_data_condition = threading.Condition()
+        # An event to wake up the fetch thread when data is ready.
+        self._data_ready = threading.Event()
+        # Clients that get data via shared memory, and the ring of
+        # shared memory slots (only created when needed).
+        self._shared_memory_clients = set()
+        self._shared_memory_slots = shared_memory_slots
+        self._shared_memory = None
+        # Clients that get a FrameMetadata with the data.
+        self._metadata_clients = set()
+        # Map of clients that get compressed data to their encoder.
+        self._encoders: Dict[Any, microscope._transport.FrameEncoder] = {}
+        # Counters for get_stats.  Each has a single writer so they
+        # don't need a lock, except dispatch errors which are counted
+        # on the dispatch thread and, with processing workers, on the
+        # thread that delivers the processed data.
+        self._n_fetched = 0
+        self._n_fetch_errors = 0
+        self._n_unclaimed = 0
+        self._n_dispatched = 0
+        self._n_dispatch_errors = 0
+        self._n_dispatch_errors_lock = threading.Lock()
+        self._dispatch_latency = microscope._dispatch.Histogram()
+        self._reconfiguration_time = microscope._dispatch.Histogram()
+        # Depth of nested batch_changes.
+        self._batch_depth = 0
+        # The recorder subscribed by start_recording, if any.
+        self._recorder: Optional[microscope.recording.MemmapRecorder] = None
+        # Sequence number for the next data item.
+        self._sequence = itertools.count()
+        # Cache of the acquisition parameters for the frame metadata.
+        # Set to None whenever they may have changed.
+        self._acquisition_metadata: Optional[Dict[str, Any]] = None
+        # Map of clients to their Subscriber.  Replaced, not modified,
+        # so that the dispatch thread can iterate without a lock.
+        self._subscribers: Dict[Any, microscope._dispatch.Subscriber] = {}
+        self._subscribers_lock = threading.Lock()
+        # Processing of data before dispatch: _process_data followed
+        # by the stages from _get_processing_stages.
+        self._pipeline = microscope._pipeline.Pipeline(
+            lambda data: self._process_data(data), self._deliver
+        )
+        self.add_setting(
+            "processing workers",
+            "int",
+            lambda: self._pipeline.n_workers,
+            self._pipeline.set_workers,
+            lambda: (0, os.cpu_count() or 1),
+            optional=True,
+        )
 
     def __del__(self):
         self.disable()
         super().__del__()
 
-    # Wrap set_setting to pause and resume acquisition.
-    set_setting = keep_acquiring(Device.set_setting)
+    def shutdown(self) -> None:
+        super().shutdown()
+        if self._recorder is not None:
+            self.stop_recording()
+        for client in list(self._subscribers):
+            self.unsubscribe(client)
+        self._pipeline.close()
+        if self._shared_memory is not None:
+            self._shared_memory.close()
+
+    # Wait, in seconds, between polls of _fetch_data when no data is
+    # available (see class documentation).
+    _fetch_backoff_min = 0.0001
+    _fetch_backoff_max: Optional[float] = 0.001
+
+    def _changes(self, names: Iterable[str]):
+        """Context to set settings, stopping acquisition if needed.
+
+        Acquisition is only stopped if any of the settings is not
+        live, otherwise the settings are set during acquisition.
+        """
+        if all(
+            name in self._settings and self._settings[name].live
+            for name in names
+        ):
+            # Live settings may still change the frame metadata.
+            self._acquisition_metadata = None
+            return contextlib.nullcontext()
+        else:
+            return self.batch_changes()
+
+    def set_setting(self, name: str, value) -> None:
+        """Set a setting, pausing acquisition unless the setting is live."""
+        with self._changes([name]):
+            super().set_setting(name, value)
+
+    def set_settings(
+        self, values: Mapping[str, Any]
+    ) -> Dict[str, Optional[Exception]]:
+        """Set several settings, pausing acquisition at most once."""
+        with self._changes(values.keys()):
+            return super().set_settings(values)
+
+    @contextlib.contextmanager
+    def batch_changes(self):
+        """Context to make several changes with a single restart.
+
+        If the device is acquiring, acquisition is aborted on entering
+        the context and restarted on leaving it, instead of being
+        restarted by each change, e.g., when setting the ROI, binning,
+        and exposure time::
+
+            with camera.batch_changes():
+                camera.set_roi(roi)
+                camera.set_binning(binning)
+                camera.set_exposure_time(exposure)
+
+        Contexts can be nested, only the outermost one restarts
+        acquisition.  If an exception is raised, acquisition is not
+        restarted.  Over Pyro, use :meth:`set_settings`,
+        :meth:`update_settings`, or :meth:`Camera.apply_changes` which
+        also restart acquisition only once.  The time taken, from
+        abort to restart, is reported by :meth:`get_stats`.
+
+        """
+        # Whatever is being changed may affect the frame metadata and
+        # the settings descriptions.
+        self._acquisition_metadata = None
+        self._settings_descriptions_stale = True
+        restart = self._batch_depth == 0 and self._acquiring
+        if restart:
+            start = time.monotonic()
+            self.abort()
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+        self._acquisition_metadata = None
+        if restart:
+            self._do_enable()
+            self._reconfiguration_time.add(time.monotonic() - start)
 
     @abc.abstractmethod
     def abort(self) -> None:
@@ -595,22 +1293,27 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
 
         """
         _logger.debug("Enabling ...")
+        self._acquisition_metadata = None
+        self._update_processing_stages()
         # Call device-specific code.
         try:
             result = self._do_enable()
         except Exception as err:
             _logger.debug("Error in _do_enable:", exc_info=err)
             self.enabled = False
+            self._notify("enabled", self.enabled)
             raise err
         if not result:
             _logger.warning("Failed to enable but no error was raised")
             self.enabled = False
+            self._notify("enabled", self.enabled)
         else:
             self.enabled = True
             if self._using_callback:
                 _logger.debug("Setup with callback, disabling fetch thread")
                 if self._fetch_thread:
                     self._fetch_thread_run = False
+                    self._data_ready.set()
             else:
                 _logger.debug("Setting up fetch thread")
                 if not self._fetch_thread or not self._fetch_thread.is_alive():
@@ -627,6 +1330,7 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
                 self._dispatch_thread.start()
 
             _logger.debug("... enabled.")
+            self._notify("enabled", self.enabled)
 
     def disable(self) -> None:
         """Disable the data capture device.
@@ -639,6 +1343,10 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
             if self._fetch_thread.is_alive():
                 _logger.debug("Found fetch thread alive. Joining.")
                 self._fetch_thread_run = False
+                # The fetch thread may be waiting for data or blocked
+                # on a full buffer.
+                self._data_ready.set()
+                self._dispatch_buffer.cancel_waiting()
                 self._fetch_thread.join()
             _logger.debug("Fetch thread is dead.")
         super().disable()
@@ -657,68 +1365,268 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
         """
         raise NotImplementedError()
 
+    def _notify_data_ready(self) -> None:
+        """Wake up the fetch thread to call :meth:`_fetch_data`.
+
+        This can be called from any thread, typically from an SDK
+        callback or on a software trigger.
+
+        """
+        self._data_ready.set()
+
+    def _wait_for_data(self, timeout: Optional[float]) -> None:
+        """Block until data may be available.
+
+        Called by the fetch thread after :meth:`_fetch_data` returns
+        no data.  By default, it waits until :meth:`_notify_data_ready`
+        is called or `timeout` seconds have passed.  Implementations
+        may return earlier but should not block much longer than
+        `timeout` since the fetch thread checks if it should stop
+        between waits.
+
+        Args:
+            timeout: maximum time to wait in seconds, or `None` to
+                wait for :meth:`_notify_data_ready`.
+
+        """
+        self._data_ready.wait(timeout)
+
+    def _get_hardware_metadata(
+        self,
+    ) -> Tuple[Optional[int], Optional[float]]:
+        """Return the hardware frame counter and timestamp of the data.
+
+        This is called right after data is fetched, or when
+        :meth:`_put` is called by devices using callbacks.  Devices
+        that get a frame counter and timestamp from the SDK should
+        keep them when fetching the data and return them here.  The
+        default returns `None` for both.
+
+        """
+        return (None, None)
+
+    def _get_acquisition_metadata(self) -> Dict[str, Any]:
+        """Return the acquisition parameters for the frame metadata.
+
+        Returns a dict of :class:`microscope.FrameMetadata` fields,
+        such as ``"exposure_time"`` and ``"roi"``, that are the same
+        for all data until the device is reconfigured.  This is only
+        called once after each reconfiguration and the result is
+        reused for all data, so it is fine to query the hardware.
+
+        """
+        return {}
+
+    def _frame_metadata(self, timestamp: float) -> microscope.FrameMetadata:
+        """Create the metadata for newly fetched data."""
+        if self._acquisition_metadata is None:
+            try:
+                self._acquisition_metadata = self._get_acquisition_metadata()
+            except Exception as err:
+                _logger.error("failed to get acquisition metadata: %s", err)
+                self._acquisition_metadata = {}
+        hardware_frame, hardware_timestamp = self._get_hardware_metadata()
+        return microscope.FrameMetadata(
+            sequence=next(self._sequence),
+            timestamp=timestamp,
+            monotonic=time.monotonic(),
+            hardware_frame=hardware_frame,
+            hardware_timestamp=hardware_timestamp,
+            **self._acquisition_metadata,
+        )
+
     def _process_data(self, data):
         """Do any data processing and return data."""
         return data
 
-    def _send_data(self, client, data, timestamp):
+    def _get_processing_stages(self) -> List[microscope._pipeline.Stage]:
+        """Return the processing stages to run after `_process_data`.
+
+        Devices with optional processing steps, for example enabled
+        through settings, should override this to add their stages
+        and call :meth:`_update_processing_stages` whenever the stages
+        change.  Stages are run on the ``"processing workers"``
+        threads.
+
+        """
+        return []
+
+    def _update_processing_stages(self) -> None:
+        """Rebuild the processing pipeline from `_get_processing_stages`."""
+        self._pipeline.set_stages(self._get_processing_stages())
+
+    def get_processing_status(self) -> Dict[str, Any]:
+        """Return the state of the processing pipeline.
+
+        The returned dict has the number of ``"workers"`` threads, the
+        number of items being processed, ``"pending"``, and
+        ``"stages"``, a dict with the timings for each stage,
+        starting with ``"process_data"``.
+
+        """
+        return self._pipeline.get_status()
+
+    def _send_data(self, client, data, metadata: microscope.FrameMetadata):
         """Dispatch data to the client."""
         _logger.debug("sending data to client")
+        if client in self._shared_memory_clients and isinstance(
+            data, np.ndarray
+        ):
+            frame = self._shared_memory.write(data, owner=client)
+            if frame is None:
+                # Clients are slow to release the slots.  Send data
+                # inline, it's slower but nothing is lost.
+                _logger.debug("no free shared memory slot, sending inline")
+            else:
+                data = frame
+        encoder = self._encoders.get(client)
+        if encoder is not None and isinstance(data, np.ndarray):
+            data = encoder.encode(data)
         try:
             # Cockpit will send a client with receiveData and expects
-            # two arguments (data and timestamp).  But we really want
-            # to use Python's Queue and instead of just the timestamp
-            # we should be sending some proper metadata object.  We
-            # don't have that proper metadata class yet so just send
-            # the image data as a numpy ndarray for now.
-            if hasattr(client, "put"):
+            # two arguments (data and timestamp).  Python's Queue
+            # only takes the data.  Only send the metadata to clients
+            # that asked for it.
+            if client in self._metadata_clients:
+                if hasattr(client, "put"):
+                    client.put((data, metadata))
+                else:
+                    client.receiveData(data, metadata.timestamp, metadata)
+            elif hasattr(client, "put"):
                 client.put(data)
             else:
-                client.receiveData(data, timestamp)
+                client.receiveData(data, metadata.timestamp)
         except (
             Pyro4.errors.ConnectionClosedError,
             Pyro4.errors.CommunicationError,
         ):
             # Client not listening
-            _logger.info(
-                "Removing %s from client stack: disconnected.", client._pyroUri
-            )
+            _logger.info("Removing %s: disconnected.", client._pyroUri)
             self._clientStack = list(filter(client.__ne__, self._clientStack))
             self._liveClients = self._liveClients.difference([client])
+            if client in self._subscribers:
+                self.unsubscribe(client)
+            self._forget_client(client)
+
+    def _set_client_options(
+        self,
+        client,
+        shared_memory: bool = False,
+        metadata: bool = False,
+        encoder: Optional[microscope._transport.FrameEncoder] = None,
+    ) -> None:
+        """Set the transport options of a client, replacing any others."""
+        if shared_memory:
+            if self._shared_memory is None:
+                self._shared_memory = microscope._transport.SharedMemoryRing(
+                    self._shared_memory_slots
+                )
+            self._shared_memory_clients.add(client)
+        elif client in self._shared_memory_clients:
+            self._shared_memory_clients.discard(client)
+            self._shared_memory.release_owner(client)
+        if metadata:
+            self._metadata_clients.add(client)
+        else:
+            self._metadata_clients.discard(client)
+        if encoder is not None:
+            self._encoders[client] = encoder
+        else:
+            self._encoders.pop(client, None)
+
+    def _forget_client(self, client) -> None:
+        """Drop the transport options of a client that is gone."""
+        if client in self._clientStack or client in self._subscribers:
+            return
+        self._metadata_clients.discard(client)
+        self._encoders.pop(client, None)
+        if client in self._shared_memory_clients:
+            self._shared_memory_clients.discard(client)
+            self._shared_memory.release_owner(client)
 
     def _dispatch_loop(self) -> None:
         """Process data and send results to any client."""
         while True:
             _logger.debug("Getting data from dispatch buffer")
-            client, data, timestamp = self._dispatch_buffer.get(block=True)
+            client, data, metadata = self._dispatch_buffer.get()
+            subscribers = self._subscribers
             if client not in self._liveClients:
-                _logger.debug("Client not in liveClients so ignoring data.")
-                continue
-            err = None
-            if isinstance(data, Exception):
-                standard_exception = Exception(str(data).encode("ascii"))
-                try:
-                    self._send_data(client, standard_exception, timestamp)
-                except Exception as e:
-                    err = e
-            else:
-                try:
-                    self._send_data(
-                        client, self._process_data(data), timestamp
+                client = None
+                if not subscribers:
+                    _logger.debug("No live clients so ignoring data.")
+                    self._n_unclaimed += 1
+                    continue
+            context = (client, subscribers, metadata)
+            try:
+                if isinstance(data, Exception):
+                    standard_exception = Exception(str(data).encode("ascii"))
+                    self._pipeline.put(
+                        standard_exception, context, process=False
                     )
-                except Exception as e:
-                    err = e
-            if err:
-                # Raising an exception will kill the dispatch loop. We need
-                # another way to notify the client that there was a problem.
+                else:
+                    self._pipeline.put(data, context)
+            except Exception as err:
+                # Raising an exception will kill the dispatch loop.
+                with self._n_dispatch_errors_lock:
+                    self._n_dispatch_errors += 1
                 _logger.error("in _dispatch_loop:", exc_info=err)
-            self._dispatch_buffer.task_done()
+
+    def _deliver(self, data, context, err: Optional[Exception]) -> None:
+        """Send processed data to the client and subscribers.
+
+        This is called by the processing pipeline, in the same order
+        that data was put in the dispatch buffer.
+        """
+        client, subscribers, metadata = context
+        if err is None and subscribers:
+            self._publish(subscribers.values(), data, metadata)
+        if err is None and client is not None:
+            try:
+                self._send_data(client, data, metadata)
+            except Exception as e:
+                err = e
+        if err is None:
+            self._n_dispatched += 1
+            if metadata.monotonic is not None:
+                self._dispatch_latency.add(
+                    time.monotonic() - metadata.monotonic
+                )
+        else:
+            with self._n_dispatch_errors_lock:
+                self._n_dispatch_errors += 1
+        if err:
+            # Raising an exception will kill the dispatch loop. We need
+            # another way to notify the client that there was a problem.
+            _logger.error("in _dispatch_loop:", exc_info=err)
+
+    def _publish(self, subscribers, data, metadata) -> None:
+        """Put processed data on the buffer of each subscriber."""
+        nbytes = microscope._dispatch.data_nbytes(data)
+        shared = None
+        for subscriber in subscribers:
+            if subscriber.encode and isinstance(data, np.ndarray):
+                if shared is None:
+                    shared = microscope._dispatch.SharedPickle(data)
+                payload = shared
+            else:
+                payload = data
+            if not subscriber.put(payload, metadata, nbytes):
+                _logger.debug(
+                    "%s buffer full, data dropped", subscriber.client
+                )
 
     def _fetch_loop(self) -> None:
-        """Poll source for data and put it into dispatch buffer."""
+        """Fetch data from source and put it into dispatch buffer."""
         self._fetch_thread_run = True
 
+        timeout = self._fetch_backoff_min
         while self._fetch_thread_run:
+            # Clear before fetching so that a notification while
+            # fetching is not lost.  Check again after clearing since
+            # disable may have set it, to wake us up, in between.
+            self._data_ready.clear()
+            if not self._fetch_thread_run:
+                break
             _logger.debug("Fetching data from device.")
             try:
                 data = self._fetch_data()
@@ -729,14 +1637,29 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
                 timestamp = time.time()
                 self._put(e, timestamp)
                 data = None
+                failed = True
+            else:
+                failed = False
             if data is not None:
                 _logger.debug("Fetch data to be put into dispatch buffer.")
-                # TODO Add support for timestamp from hardware.
                 timestamp = time.time()
                 self._put(data, timestamp)
+                timeout = self._fetch_backoff_min
+            elif failed:
+                # Back-off also after errors, even if waiting for
+                # notifications, so that we keep trying without
+                # spinning.  Not with _wait_for_data since devices may
+                # implement it to return at once.
+                _logger.debug("Retrying to fetch data in %gs.", timeout)
+                self._data_ready.wait(timeout)
+                timeout = min(2 * timeout, self._fetch_backoff_max or 1.0)
+            elif self._fetch_backoff_max is None:
+                _logger.debug("Fetched no data, waiting for notification.")
+                self._wait_for_data(None)
             else:
                 _logger.debug("Fetched no data from device.")
-                time.sleep(0.001)
+                self._wait_for_data(timeout)
+                timeout = min(2 * timeout, self._fetch_backoff_max)
 
     @property
     def _client(self):
@@ -747,16 +1670,143 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
     def _client(self, val):
         """Push or pop a client from the _clientStack."""
         if val is None:
-            self._clientStack.pop()
+            old = self._clientStack.pop()
+            self._liveClients = set(self._clientStack)
+            self._forget_client(old)
         else:
             self._clientStack.append(val)
-        self._liveClients = set(self._clientStack)
+            self._liveClients = set(self._clientStack)
+
+    def _put(self, data, timestamp: float) -> None:
+        """Put data and its metadata into dispatch buffer.
+
+        This is called by the fetch thread but devices using callbacks
+        should call it directly.  The :class:`microscope.FrameMetadata`
+        is created here, so devices with hardware timestamps should
+        make them available to :meth:`_get_hardware_metadata` before
+        calling this.
+
+        Args:
+            data: the data or an exception.
+            timestamp: time, as given by :func:`time.time`, when the
+                data was fetched.
+
+        """
+        if isinstance(data, Exception):
+            self._n_fetch_errors += 1
+            metadata = microscope.FrameMetadata(timestamp=timestamp)
+        else:
+            self._n_fetched += 1
+            metadata = self._frame_metadata(timestamp)
+        if not self._dispatch_buffer.put(
+            (self._client, data, metadata),
+            microscope._dispatch.data_nbytes(data),
+        ):
+            _logger.debug("dispatch buffer full, data dropped")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return counters and latencies of the data path.
+
+        These are always collected and cheap to get so they can be
+        polled, e.g., to find where data is lost.  All counts are since
+        the device was created.  The returned dict has the keys:
+
+        ``"fetched"``
+            number of data items fetched from the hardware.
+        ``"fetch_errors"``
+            number of errors fetching data.
+        ``"dropped"``
+            number of items, including errors, dropped because the
+            dispatch buffer was full.
+        ``"unclaimed"``
+            number of items discarded because there were no clients.
+        ``"dispatched"``
+            number of items, including errors, processed and sent to
+            the client and put on the subscribers buffers.
+        ``"dispatch_errors"``
+            number of items that failed processing or sending.
+        ``"subscriber_dropped"``
+            number of items dropped because subscribers buffers were
+            full, for the current subscribers.
+        ``"queue_length"``, ``"queue_peak_length"``
+            current and maximum number of items in the dispatch
+            buffer.
+        ``"fetch_to_dispatch"``
+            histogram of the time, in seconds, from fetching the data
+            to sending it (see
+            :meth:`microscope._dispatch.Histogram.get_status`).
+        ``"process_data"``
+            histogram of the time, in seconds, spent in
+            :meth:`_process_data`.
+        ``"reconfiguration"``
+            histogram of the time, in seconds, acquisition was stopped
+            to change settings (see :meth:`batch_changes`).
+
+        """
+        return {
+            "fetched": self._n_fetched,
+            "fetch_errors": self._n_fetch_errors,
+            "dropped": self._dispatch_buffer.dropped,
+            "unclaimed": self._n_unclaimed,
+            "dispatched": self._n_dispatched,
+            "dispatch_errors": self._n_dispatch_errors,
+            "subscriber_dropped": sum(
+                s.ring.dropped for s in self._subscribers.values()
+            ),
+            "queue_length": len(self._dispatch_buffer),
+            "queue_peak_length": self._dispatch_buffer.peak_length,
+            "fetch_to_dispatch": self._dispatch_latency.get_status(),
+            "process_data": self._pipeline.first.get_histogram(),
+            "reconfiguration": self._reconfiguration_time.get_status(),
+        }
+
+    def get_buffer_status(self) -> Dict[str, Any]:
+        """Return the state of the dispatch buffer.
+
+        The returned dict has the keys:
+
+        ``"length"``
+            number of items waiting to be dispatched.
+        ``"bytes"``
+            total size, in bytes, of the data waiting to be
+            dispatched.
+        ``"dropped"``
+            number of items dropped since the device was created.
+        ``"policy"``
+            the :class:`microscope.DropPolicy` in use.
+        ``"subscribers"``
+            a list with a dict for each subscriber, with the same keys
+            as above for its own buffer, ``"client"`` with the string
+            representation of the client, and ``"skipped"`` with the
+            number of items skipped to limit the rate of previews.
 
-    def _put(self, data, timestamp) -> None:
-        """Put data and timestamp into dispatch buffer with target dispatch client."""
-        self._dispatch_buffer.put((self._client, data, timestamp))
+        """
+        return {
+            "length": len(self._dispatch_buffer),
+            "bytes": self._dispatch_buffer.nbytes,
+            "dropped": self._dispatch_buffer.dropped,
+            "policy": self._dispatch_buffer.policy,
+            "subscribers": [
+                {
+                    "client": str(subscriber.client),
+                    "length": len(subscriber.ring),
+                    "bytes": subscriber.ring.nbytes,
+                    "dropped": subscriber.ring.dropped,
+                    "skipped": subscriber.skipped,
+                    "policy": subscriber.ring.policy,
+                }
+                for subscriber in self._subscribers.values()
+            ],
+        }
 
-    def set_client(self, new_client) -> None:
+    def set_client(
+        self,
+        new_client,
+        shared_memory: bool = False,
+        metadata: bool = False,
+        codec: Optional[str] = None,
+        serializer: Optional[str] = None,
+    ) -> None:
         """Set up a connection to our client.
 
         Clients now sit in a stack so that a single device may send
@@ -772,12 +1822,50 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
         rework here to identify the caller and remove only that caller
         from the client stack.
 
+        The options given replace any options the client had before,
+        and are dropped when the client is popped off the stack.
+
+        Args:
+            new_client: the client, its Pyro URI, or `None` to pop
+                the current client from the stack.
+            shared_memory: if `True`, image data is written to shared
+                memory and the client receives a
+                :class:`microscope._transport.SharedFrame` descriptor
+                instead of the data itself.  The client must be on the
+                same host as the device and must release each frame
+                with :meth:`release_shared_frame` after reading it.
+            metadata: if `True`, the client also gets the
+                :class:`microscope.FrameMetadata` of each data.  Clients
+                with a ``receiveData`` method get it as a third
+                argument while clients with a ``put`` method, such as
+                :class:`queue.Queue`, get a ``(data, metadata)`` tuple.
+            codec: name of the codec, from
+                :data:`microscope._transport.CODECS`, to compress
+                image data.  The client receives a
+                :class:`microscope._transport.EncodedFrame` and must
+                decode it with a
+                :class:`microscope._transport.FrameDecoder`, as
+                :class:`microscope.clients.DataClient` does.  Ignored
+                for data sent via shared memory.
+            serializer: name of the Pyro serializer used to send data
+                to the client, e.g.,
+                :data:`microscope._transport.OOB_PICKLE`.  The client
+                must accept it.  Defaults to the one in the Pyro
+                configuration.
+
         """
         if new_client is not None:
             if isinstance(new_client, (str, Pyro4.core.URI)):
-                self._client = Pyro4.Proxy(new_client)
-            else:
-                self._client = new_client
+                new_client = Pyro4.Proxy(new_client)
+                new_client._pyroSerializer = serializer
+            encoder = None
+            if codec is not None:
+                encoder = microscope._transport.FrameEncoder(codec)
+            with self._subscribers_lock:
+                self._set_client_options(
+                    new_client, shared_memory, metadata, encoder
+                )
+            self._client = new_client
         else:
             self._client = None
         # _client uses a setter. Log the result of assignment.
@@ -786,10 +1874,213 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
         else:
             _logger.info("Current client is %s.", str(self._client))
 
-    @keep_acquiring
-    def update_settings(self, settings, init: bool = False) -> None:
+    def subscribe(
+        self,
+        client,
+        buffer_length: int = 8,
+        buffer_bytes: int = 0,
+        drop_policy: microscope.DropPolicy = microscope.DropPolicy.DROP_OLDEST,
+        shared_memory: bool = False,
+        metadata: bool = False,
+        codec: Optional[str] = None,
+        serializer: Optional[str] = None,
+    ) -> None:
+        """Subscribe a client to receive all data.
+
+        Unlike the client from :meth:`set_client`, subscribers are not
+        on a stack.  All subscribers receive all data, at the same time
+        as the current client, until :meth:`unsubscribe` is called or
+        the client disconnects.  Each subscriber has its own buffer,
+        limits, and drop policy, and receives data on its own thread.
+
+        Subscribing a client that is already subscribed replaces its
+        subscription.
+
+        Args:
+            client: the client or its Pyro URI.  As for
+                :meth:`set_client`, it must have a ``receiveData`` or
+                a ``put`` method.
+            buffer_length: maximum number of items waiting to be sent
+                to the client.  If zero, there is no limit.
+            buffer_bytes: maximum size, in bytes, of the data waiting
+                to be sent to the client.  If zero, there is no limit.
+            drop_policy: what to do with new data when the client
+                buffer is full.
+            shared_memory: as for :meth:`set_client`.
+            metadata: as for :meth:`set_client`.
+            codec: as for :meth:`set_client`.
+            serializer: as for :meth:`set_client`.
+
+        """
+        if isinstance(client, (str, Pyro4.core.URI)):
+            client = Pyro4.Proxy(client)
+            client._pyroSerializer = serializer
+        encoder = None
+        if codec is not None:
+            encoder = microscope._transport.FrameEncoder(codec)
+        subscriber = microscope._dispatch.Subscriber(
+            client,
+            self._send_data,
+            buffer_length,
+            buffer_bytes,
+            drop_policy,
+            encode=(
+                isinstance(client, Pyro4.Proxy)
+                and not shared_memory
+                and codec is None
+            ),
+        )
+        self._add_subscriber(subscriber, shared_memory, metadata, encoder)
+
+    def _add_subscriber(
+        self,
+        subscriber: microscope._dispatch.Subscriber,
+        shared_memory: bool = False,
+        metadata: bool = False,
+        encoder: Optional[microscope._transport.FrameEncoder] = None,
+    ) -> None:
+        """Add a subscriber, replacing any other for the same client."""
+        client = subscriber.client
+        with self._subscribers_lock:
+            old = self._subscribers.get(client)
+            subscribers = dict(self._subscribers)
+            subscribers[client] = subscriber
+            self._set_client_options(client, shared_memory, metadata, encoder)
+            self._subscribers = subscribers
+        if old is not None:
+            old.close()
+        _logger.info("Subscribed %s.", client)
+
+    def unsubscribe(self, client, drain: bool = False) -> None:
+        """Stop sending data to a subscribed client.
+
+        Args:
+            client: the client or its Pyro URI.
+            drain: if `True`, waits for the data already on the client
+                buffer to be sent.  Otherwise, that data is dropped.
+
+        """
+        if isinstance(client, (str, Pyro4.core.URI)):
+            client = Pyro4.Proxy(client)
+        with self._subscribers_lock:
+            subscribers = dict(self._subscribers)
+            subscriber = subscribers.pop(client, None)
+            self._subscribers = subscribers
+        if subscriber is None:
+            _logger.warning("%s is not subscribed.", client)
+            return
+        subscriber.close(drain)
+        self._forget_client(client)
+        _logger.info("Unsubscribed %s.", client)
+
+    def start_recording(
+        self,
+        directory: str,
+        frames_per_chunk: int = 100,
+        buffer_bytes: int = 2**30,
+    ) -> None:
+        """Start writing all data to disk on the device side.
+
+        The data and its metadata are written to memory mapped files
+        (see :class:`microscope.recording.MemmapRecorder`) by a
+        subscriber, so the data is never sent over the network.  Only
+        one recording can be active at a time.
+
+        Args:
+            directory: directory for the recording, on the computer
+                running the device.
+            frames_per_chunk: number of frames on each file.
+            buffer_bytes: maximum size, in bytes, of the data waiting
+                to be written.  When the disk can't keep up and the
+                buffer is full, new data is dropped.
+
+        """
+        if self._recorder is not None:
+            raise microscope.IncompatibleStateError(
+                "already recording to '%s'"
+                % self._recorder.get_status()["directory"]
+            )
+        recorder = microscope.recording.MemmapRecorder(
+            directory, frames_per_chunk
+        )
+        self.subscribe(
+            recorder,
+            buffer_length=0,
+            buffer_bytes=buffer_bytes,
+            drop_policy=microscope.DropPolicy.DROP_NEWEST,
+            metadata=True,
+        )
+        self._recorder = recorder
+
+    def stop_recording(self) -> Dict[str, Any]:
+        """Stop the recording after writing the data waiting on it.
+
+        Returns:
+            The final status, as from :meth:`get_recording_status`.
+
+        """
+        if self._recorder is None:
+            raise microscope.IncompatibleStateError("not recording")
+        status = self.get_recording_status()
+        self.unsubscribe(self._recorder, drain=True)
+        self._recorder.close()
+        status.update(self._recorder.get_status())
+        status["backlog"] = 0
+        self._recorder = None
+        return status
+
+    def get_recording_status(self) -> Dict[str, Any]:
+        """Return the state of the current recording.
+
+        The returned dict has the keys from
+        :meth:`microscope.recording.MemmapRecorder.get_status` plus
+        ``"backlog"``, the number of frames waiting to be written,
+        and ``"dropped"``, the number of frames dropped because the
+        backlog was full.
+
+        """
+        recorder = self._recorder
+        if recorder is None:
+            raise microscope.IncompatibleStateError("not recording")
+        status = recorder.get_status()
+        subscriber = self._subscribers.get(recorder)
+        if subscriber is not None:
+            status["backlog"] = len(subscriber.ring)
+            status["dropped"] = subscriber.ring.dropped
+        return status
+
+    def get_codec_status(self) -> List[Dict[str, Any]]:
+        """Return the compression statistics of each client.
+
+        Returns a list with a dict for each client that gets
+        compressed data, with the key ``"client"``, the string
+        representation of the client, and the statistics from
+        :meth:`microscope._transport.FrameEncoder.get_status`.
+
+        """
+        status = []
+        for client, encoder in list(self._encoders.items()):
+            client_status = encoder.get_status()
+            client_status["client"] = str(client)
+            status.append(client_status)
+        return status
+
+    @Pyro4.oneway
+    def release_shared_frame(self, generation: int, index: int) -> None:
+        """Release a shared memory slot so that it can be reused.
+
+        Clients that requested shared memory transport on
+        :meth:`set_client` must call this once they are done reading
+        each :class:`microscope._transport.SharedFrame`.
+
+        """
+        if self._shared_memory is not None:
+            self._shared_memory.release(generation, index)
+
+    def update_settings(self, settings, init: bool = False):
         """Update settings, toggling acquisition if necessary."""
-        super().update_settings(settings, init)
+        with self._changes(settings.keys()):
+            return super().update_settings(settings, init)
 
     # noinspection PyPep8Naming
     def receiveClient(self, client_uri: str) -> None:
@@ -818,8 +2109,71 @@ class DataDevice(Device, metaclass=abc.ABCMeta):
         # Return the data.
         return self._new_data
 
+    def grab_frames(
+        self,
+        n: int,
+        soft_trigger: bool = True,
+        timeout: Optional[float] = None,
+    ) -> np.ndarray:
+        """Acquire a number of frames and return them in one array.
+
+        Frames are processed, as they are for any other client, and
+        stacked into an array of shape ``(n, height, width)``.  This is
+        done on the device side so it takes a single call to acquire
+        series such as z-stacks.  Unlike :meth:`grab_next_data`, it
+        does not change the client stack so the current client still
+        receives the frames and it is safe to use from multiple
+        callers at the same time, although each caller will then see
+        frames triggered by the others.
+
+        Args:
+            n: number of frames.
+            soft_trigger: if `True`, calls :meth:`trigger` for each
+                frame, after the previous one is received.  If
+                `False`, waits for hardware triggers.
+            timeout: maximum time, in seconds, to wait for all the
+                frames.  If `None`, waits forever.
+
+        Raises:
+            TimeoutError: if the frames were not acquired within
+                `timeout` seconds.
+
+        """
+        if not self.enabled:
+            raise microscope.DisabledDeviceError("Camera not enabled.")
+        collector = microscope._dispatch.FrameCollector(n)
+        if timeout is None:
+            deadline = None
+        else:
+            deadline = time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else deadline - time.monotonic()
+
+        self.subscribe(
+            collector,
+            buffer_length=0,
+            drop_policy=microscope.DropPolicy.BLOCK,
+        )
+        try:
+            if soft_trigger:
+                for i in range(n):
+                    self.trigger()
+                    if not collector.wait(i + 1, remaining()):
+                        break
+            else:
+                collector.wait(n, remaining())
+        finally:
+            self.unsubscribe(collector)
+        if collector.count < n:
+            raise TimeoutError(
+                "only %d of %d frames acquired in %s seconds"
+                % (collector.count, n, timeout)
+            )
+        return collector.stack
+
     # noinspection PyPep8Naming
-    def receiveData(self, data, timestamp) -> None:
+    def receiveData(self, data, timestamp, *args) -> None:
         """Unblocks grab_next_frame so it can return."""
         with self._new_data_condition:
             self._new_data = (data, timestamp)
@@ -843,25 +2197,140 @@ class Camera(TriggerTargetMixin, DataDevice):
         self._client_transform = (False, False, False)
         # Result of combining client and readout transforms
         self._transform = (False, False, False)
+        # The transform as an index that reverses the axes to flip,
+        # and whether to then swap the axes.  None if no transform.
+        self._transform_view = None
         self.add_setting("roi", "tuple", self.get_roi, self.set_roi, None)
+        # Optional processing stages, enabled via settings.
+        self._background_stage = microscope._pipeline.BackgroundStage()
+        self._software_binning_stage = microscope._pipeline.BinningStage(
+            microscope.Binning(1, 1)
+        )
+        self._statistics_stage = microscope._pipeline.StatisticsStage()
+        self._subtract_background = False
+        self._compute_statistics = False
+        self.add_setting(
+            "software binning",
+            "int",
+            lambda: self._software_binning_stage.binning.h,
+            self._set_software_binning,
+            (1, 64),
+            optional=True,
+        )
+        self.add_setting(
+            "subtract background",
+            "bool",
+            lambda: self._subtract_background,
+            self._set_subtract_background,
+            None,
+            optional=True,
+        )
+        self.add_setting(
+            "frame statistics",
+            "bool",
+            lambda: self._compute_statistics,
+            self._set_compute_statistics,
+            None,
+            optional=True,
+        )
 
     def _process_data(self, data):
-        """Apply self._transform to data."""
-        flips = (self._transform[0], self._transform[1])
-        rot = self._transform[2]
-
-        # Choose appropriate transform based on (flips, rot).
-        # Do rotation
-        data = np.rot90(data, rot)
-        # Flip
-        data = {
-            (0, 0): lambda d: d,
-            (0, 1): np.flipud,
-            (1, 0): np.fliplr,
-            (1, 1): lambda d: np.fliplr(np.flipud(d)),
-        }[flips](data)
+        """Apply self._transform to data.
+
+        The transform is applied as a view of the data, without
+        copying it.
+        """
+        if self._transform_view is not None:
+            index, swap_axes = self._transform_view
+            data = data[index]
+            if swap_axes:
+                data = data.swapaxes(0, 1)
         return super()._process_data(data)
 
+    def _get_processing_stages(self) -> List[microscope._pipeline.Stage]:
+        stages = super()._get_processing_stages()
+        if self._subtract_background:
+            stages.append(self._background_stage)
+        if self._software_binning_stage.binning != (1, 1):
+            stages.append(self._software_binning_stage)
+        if self._compute_statistics:
+            stages.append(self._statistics_stage)
+        return stages
+
+    def _set_software_binning(self, value: int) -> None:
+        self._software_binning_stage.binning = microscope.Binning(value, value)
+        self._update_processing_stages()
+
+    def _set_subtract_background(self, value: bool) -> None:
+        self._subtract_background = value
+        self._update_processing_stages()
+
+    def _set_compute_statistics(self, value: bool) -> None:
+        self._compute_statistics = value
+        self._update_processing_stages()
+
+    def set_background(self, background: Optional[np.ndarray]) -> None:
+        """Set the image for the ``"subtract background"`` setting.
+
+        The background is subtracted after the transform, so it must
+        have the shape of the data as received by clients, before
+        software binning.  Data of a different shape is left as is.
+
+        Args:
+            background: the background image or `None` to clear it.
+
+        """
+        self._background_stage.background = background
+
+    def subscribe_preview(
+        self,
+        client,
+        max_rate: float = 20.0,
+        max_size: int = 512,
+        value_range: Optional[Tuple[float, float]] = None,
+        metadata: bool = False,
+    ) -> None:
+        """Subscribe a client to a low resolution preview of the images.
+
+        Previews are meant for display.  They are 8 bit images, binned
+        down to at most `max_size` pixels wide and high, at a limited
+        rate.  They are made from the processed images, the same sent
+        to other clients, on the client's own thread.  Only the latest
+        preview is kept if the client is slow.  Stop the preview with
+        :meth:`unsubscribe`.
+
+        Args:
+            client: the client or its Pyro URI, as for
+                :meth:`subscribe`.
+            max_rate: maximum number of previews per second.  Images
+                arriving faster are skipped.
+            max_size: maximum width and height of the previews.
+            value_range: the image values mapped to 0 and 255.  If
+                `None`, each preview is scaled to its own minimum and
+                maximum.
+            metadata: as for :meth:`set_client`.
+
+        """
+        if isinstance(client, (str, Pyro4.core.URI)):
+            client = Pyro4.Proxy(client)
+        if max_rate <= 0.0:
+            raise ValueError("max_rate must be positive (was %f)" % max_rate)
+        if max_size < 1:
+            raise ValueError("max_size must be positive (was %d)" % max_size)
+        subscriber = microscope._dispatch.Subscriber(
+            client,
+            self._send_data,
+            max_length=1,
+            policy=microscope.DropPolicy.KEEP_LATEST,
+            transform=functools.partial(
+                microscope._pipeline.make_preview,
+                max_size=max_size,
+                value_range=value_range,
+            ),
+            min_interval=1.0 / max_rate,
+        )
+        self._add_subscriber(subscriber, metadata=metadata)
+
     @property
     def shuttering_mode(self) -> microscope.ElectronicShutteringMode:
         """Return the electronic shuttering mode."""
@@ -881,6 +2350,14 @@ class Camera(TriggerTargetMixin, DataDevice):
         """Set the electronic shuttering mode."""
         raise NotImplementedError()
 
+    def _get_acquisition_metadata(self) -> Dict[str, Any]:
+        return {
+            "exposure_time": self.get_exposure_time(),
+            "roi": self.get_roi(),
+            "binning": self.get_binning(),
+            "transform": tuple(self._transform),
+        }
+
     def get_transform(self) -> Tuple[bool, bool, bool]:
         """Return the current transform without readout transform."""
         return self._client_transform
@@ -895,6 +2372,22 @@ class Camera(TriggerTargetMixin, DataDevice):
             lr = not lr
             ud = not ud
         self._transform = (lr, ud, rot)
+        self._acquisition_metadata = None
+        # A rotation by 90 degrees, as done by numpy.rot90, is a flip
+        # of the columns followed by swapping the axes.  Flips after
+        # the rotation are flips of the other axis before it.
+        if rot:
+            flip_rows, flip_columns = lr, not ud
+        else:
+            flip_rows, flip_columns = ud, lr
+        if not (flip_rows or flip_columns or rot):
+            self._transform_view = None
+        else:
+            index = (
+                slice(None, None, -1 if flip_rows else None),
+                slice(None, None, -1 if flip_columns else None),
+            )
+            self._transform_view = (index, bool(rot))
 
     def set_transform(self, transform: Tuple[bool, bool, bool]) -> None:
         """Set client transform and update resultant transform."""
@@ -958,6 +2451,7 @@ class Camera(TriggerTargetMixin, DataDevice):
             binning = microscope.Binning(v_bin, h_bin)
         else:
             binning = microscope.Binning(h_bin, v_bin)
+        self._acquisition_metadata = None
         return self._set_binning(binning)
 
     @abc.abstractmethod
@@ -994,8 +2488,40 @@ class Camera(TriggerTargetMixin, DataDevice):
             roi = microscope.ROI(left, top, height, width)
         else:
             roi = microscope.ROI(left, top, width, height)
+        self._acquisition_metadata = None
         return self._set_roi(roi)
 
+    def apply_changes(
+        self,
+        roi: Optional[microscope.ROI] = None,
+        binning: Optional[microscope.Binning] = None,
+        exposure_time: Optional[float] = None,
+        settings: Optional[Mapping[str, Any]] = None,
+    ) -> Dict[str, Optional[Exception]]:
+        """Make several changes with a single restart of acquisition.
+
+        This is :meth:`batch_changes` for use over Pyro.  Binning is
+        set before the ROI, so that a ROI with no width or height
+        spans the sensor at the new binning, then the exposure time,
+        and then the other settings.  Arguments that are `None` are
+        not changed.
+
+        Returns:
+            A map of the names in ``settings`` to the exception raised
+            when setting them, as :meth:`set_settings`.
+
+        """
+        with self.batch_changes():
+            if binning is not None:
+                self.set_binning(binning)
+            if roi is not None:
+                self.set_roi(roi)
+            if exposure_time is not None:
+                self.set_exposure_time(exposure_time)
+            if settings:
+                return self.set_settings(settings)
+        return {}
+
 
 class SerialDeviceMixin(metaclass=abc.ABCMeta):
     """Mixin for devices that are controlled via serial.
@@ -1249,6 +2775,7 @@ class LightSource(TriggerTargetMixin, Device, metaclass=abc.ABCMeta):
         clipped_power = max(min(power, 1.0), 0.0)
         self._do_set_power(clipped_power)
         self._set_point = clipped_power
+        self._notify("power", clipped_power)
 
     def get_set_power(self) -> float:
         """Return the power set point."""
@@ -214,6 +214,11 @@ class XimeaCamera(microscope.abc.Camera):
         self._acquiring = False
         self._handle = xiapi.Camera()
         self._img = xiapi.Image()
+        # Frame number and timestamp, in seconds, of the last image.
+        self._hardware_metadata: Tuple[Optional[int], Optional[float]] = (
+            None,
+            None,
+        )
         self._serial_number = serial_number
         self._sensor_shape = (0, 0)
         self._roi = microscope.ROI(None, None, None, None)
@@ -261,12 +266,27 @@ class XimeaCamera(microscope.abc.Camera):
             else:
                 raise
 
+        self._hardware_metadata = (
+            self._img.nframe,
+            self._img.tsSec + self._img.tsUSec * 1e-6,
+        )
         data: np.ndarray = self._img.get_image_data_numpy()
         _logger.info(
             "Fetched imaged with dims %s and size %s.", data.shape, data.size
         )
         return data
 
+    def _get_hardware_metadata(
+        self,
+    ) -> Tuple[Optional[int], Optional[float]]:
+        return self._hardware_metadata
+
+    def _wait_for_data(self, timeout: Optional[float]) -> None:
+        # While acquiring, _fetch_data already waits on the SDK for
+        # the next image, so there is no need to wait more.
+        if not self._acquiring:
+            super()._wait_for_data(timeout)
+
     def abort(self):
         _logger.info("Disabling acquisition.")
         if self._acquiring:
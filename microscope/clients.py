@@ -21,15 +21,23 @@
 
 import inspect
 import itertools
+import logging
 import queue
 import socket
 import threading
+from typing import Optional
 
 import Pyro4
 
+import microscope._transport
+
+_logger = logging.getLogger(__name__)
+
 # Pyro configuration. Use pickle because it can serialize numpy ndarrays.
 Pyro4.config.SERIALIZERS_ACCEPTED.add("pickle")
 Pyro4.config.SERIALIZER = "pickle"
+# Also accept pickle with out-of-band buffers for large arrays.
+_HAVE_OOB_PICKLE = microscope._transport.register_serializer()
 
 LISTENERS = {}
 
@@ -66,11 +74,46 @@ class Client:
 
 
 class DataClient(Client):
-    """A client that can receive and buffer data."""
-
-    def __init__(self, url):
+    """A client that can receive and buffer data.
+
+    Args:
+        url: Pyro URI of the data device.
+        shared_memory: if `True`, the device writes the data to shared
+            memory instead of sending it over the network.  This is
+            only possible if the client and the device are on the
+            same host.  In this mode, the data buffered is a
+            :class:`microscope._transport.SharedFrame` whose ``data``
+            attribute is a read-only view to the data.  The frame must
+            be given back to the device with :meth:`release`, after
+            which its ``data`` is no longer valid.
+        metadata: if `True`, the data buffered is a ``(data,
+            timestamp, metadata)`` tuple, where ``metadata`` is a
+            :class:`microscope.FrameMetadata`, instead of a ``(data,
+            timestamp)`` tuple.
+        codec: name of the codec, from
+            :data:`microscope._transport.CODECS`, to compress the data
+            sent over the network.  Data is decoded before being
+            buffered.
+
+    """
+
+    def __init__(
+        self,
+        url,
+        shared_memory: bool = False,
+        metadata: bool = False,
+        codec: Optional[str] = None,
+    ):
         super().__init__(url)
         self._buffer = queue.Queue()
+        self._shared_memory = shared_memory
+        self._metadata = metadata
+        self._codec = codec
+        self._decoder = microscope._transport.FrameDecoder()
+        if shared_memory:
+            self._reader = microscope._transport.SharedMemoryReader()
+        else:
+            self._reader = None
         # Register self with a listener.
         if self._url.split("@")[1].split(":")[0] in ["127.0.0.1", "localhost"]:
             iface = "127.0.0.1"
@@ -87,16 +130,59 @@ class DataClient(Client):
 
     def enable(self):
         """Set the client on the remote and enable it."""
-        self.set_client(self._client_uri)
+        # The device encodes for this client anew, so drop the key
+        # frames of the previous session.
+        self._decoder = microscope._transport.FrameDecoder()
+        # Only pass the options that are not the default so that
+        # devices served by older versions, whose set_client does not
+        # have them, still work.
+        options = {
+            name: value
+            for name, value in [
+                ("shared_memory", self._shared_memory),
+                ("metadata", self._metadata),
+                ("codec", self._codec),
+            ]
+            if value
+        }
+        if _HAVE_OOB_PICKLE:
+            try:
+                self.set_client(
+                    self._client_uri,
+                    serializer=microscope._transport.OOB_PICKLE,
+                    **options,
+                )
+            except TypeError:
+                _logger.info(
+                    "device does not support the %s serializer",
+                    microscope._transport.OOB_PICKLE,
+                )
+                self.set_client(self._client_uri, **options)
+        else:
+            self.set_client(self._client_uri, **options)
         self._proxy.enable()
 
+    def release(self, frame: microscope._transport.SharedFrame) -> None:
+        """Give a shared memory frame back to the device."""
+        frame.data = None
+        self._proxy.release_shared_frame(frame.generation, frame.index)
+
     @Pyro4.expose
     @Pyro4.oneway
     # noinspection PyPep8Naming
     # Legacy naming convention.
     def receiveData(self, data, timestamp, *args):
-        del args
-        self._buffer.put((data, timestamp))
+        if isinstance(data, microscope._transport.SharedFrame):
+            self._reader.view(data)
+        elif isinstance(data, microscope._transport.EncodedFrame):
+            try:
+                data = self._decoder.decode(data)
+            except ValueError as err:
+                data = err
+        if self._metadata:
+            self._buffer.put((data, timestamp, args[0]))
+        else:
+            self._buffer.put((data, timestamp))
 
     def trigger_and_wait(self):
         if not hasattr(self, "trigger"):
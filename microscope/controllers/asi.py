@@ -26,7 +26,7 @@ import logging
 import re
 import threading
 import time
-from typing import Dict, List, Mapping, Optional
+from typing import Any, Dict, List, Mapping, Optional
 
 import serial
 
@@ -231,13 +231,12 @@ class _ASIController:
         self.axis_list = []
         try:
             for axis in ["X", "Y", "Z"]:
-                self.command(bytes(f"INFO {axis}", "ascii"))
-                answer = self.read_multiline()
-                if answer == [b""]:  # no axis present
+                info = self.get_info(axis)
+                if not info:  # no axis present
                     _logger.info(f"Axis {axis} not present")
                     continue
                 _logger.info(f"Axis {axis} present")
-                self.axis_info[axis] = parse_info(answer)
+                self.axis_info[axis] = info
                 self.axis_list.append(axis)
         except Exception as e:
             raise InitialiseError(
@@ -253,6 +252,15 @@ class _ASIController:
     def is_busy(self):
         pass
 
+    def get_info(self, axis: str) -> Dict[str, Dict[str, Optional[str]]]:
+        """Return the parsed answer to the ``INFO`` command of an axis."""
+        with self._lock:
+            self.command(bytes(f"INFO {axis}", "ascii"))
+            answer = self.read_multiline()
+        if answer == [b""]:
+            return {}
+        return parse_info(answer)
+
     def get_number_axes(self):
         return len(self.axis_list)
 
@@ -578,6 +586,29 @@ class _ASIStage(microscope.abc.Stage):
         else:
             return answer
 
+    def _get_settings_batch(self, names: List[str]) -> Dict[str, Any]:
+        # One INFO command reports all the settings of an axis so
+        # read them all at once instead of one command per setting.
+        values = {}
+        for axis in self._dev_conn.axis_list:
+            suffix = f" {axis}"
+            wanted = [name for name in names if name.endswith(suffix)]
+            if not wanted:
+                continue
+            info = self._dev_conn.get_info(axis)
+            for name in wanted:
+                params = info.get(name[: -len(suffix)])
+                if params is None:
+                    continue
+                dtype = self._settings[name].dtype
+                if dtype == "int":
+                    values[name] = int(params["value"])
+                elif dtype == "float":
+                    values[name] = float(params["value"])
+                else:
+                    values[name] = params["value"]
+        return values
+
     def _set_setting(self, value, command, axis):
         if command is None:
             return False
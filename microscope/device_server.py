@@ -40,6 +40,7 @@ import importlib.machinery
 import importlib.util
 import logging
 import multiprocessing
+import multiprocessing.connection
 import os.path
 import signal
 import sys
@@ -47,11 +48,13 @@ import time
 from collections.abc import Iterable
 from dataclasses import dataclass
 from logging import FileHandler, StreamHandler
-from threading import Thread
-from typing import Any, Callable, Dict, Mapping, Optional, Sequence
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence
 
 import Pyro4
 
+import microscope._metrics
+import microscope._transport
 import microscope.abc
 from microscope.abc import FloatingDeviceMixin
 
@@ -68,6 +71,22 @@ if sys.platform == "darwin" and sys.version_info < (3, 8):
 # Pyro configuration. Use pickle because it can serialize numpy ndarrays.
 Pyro4.config.SERIALIZERS_ACCEPTED.add("pickle")
 Pyro4.config.SERIALIZER = "pickle"
+# Also accept pickle with out-of-band buffers for large arrays.
+_HAVE_OOB_PICKLE = microscope._transport.register_serializer()
+
+# Delays, in seconds, before restarting a device server that died or
+# retrying to construct a device.  They double after each consecutive
+# failure, up to the maximum.
+_RETRY_DELAY_MIN = 0.5
+_RETRY_DELAY_MAX = 30.0
+
+
+def _retry_delay(failures: int) -> float:
+    """Delay before trying again after a number of consecutive failures."""
+    if failures <= 0:
+        return 0.0
+    return min(_RETRY_DELAY_MAX, _RETRY_DELAY_MIN * 2 ** (failures - 1))
+
 
 # We effectively expose all attributes of the classes since our
 # devices don't hold any private data.  The private methods are to
@@ -83,6 +102,7 @@ def device(
     port: int,
     conf: Optional[Mapping[str, Any]] = None,
     uid: Optional[str] = None,
+    group: Optional[str] = None,
 ):
     """Define devices and where to serve them.
 
@@ -100,6 +120,17 @@ def device(
         uid: used to identify "floating" devices (see documentation
             for :class:`FloatingDeviceMixin`).  This must be specified
             if ``cls`` is a floating device.
+        group: name of a group of devices to serve together, on a
+            single process and Pyro daemon.  All devices in a group
+            must have the same host and port.  By default, each
+            device is served on its own process.  Grouping devices
+            that are cheap to serve, such as light sources, filter
+            wheels, and DIO, saves memory and start up time, while
+            devices that send a lot of data, such as cameras, are
+            better on their own process.  Devices are served with the
+            name of their class so a group can't have two devices of
+            the same class.  Floating devices can't be grouped.  If
+            the process dies, all devices in the group are restarted.
 
     Example
 
@@ -115,7 +146,10 @@ def device(
             device(construct_devices, '127.0.0.1', 8000),
             # passing a Device class
             device(Camera, '127.0.0.1', 8001,
-                   conf={'kwarg1': some, 'kwarg2': arguments})
+                   conf={'kwarg1': some, 'kwarg2': arguments}),
+            # serving two devices on the same process
+            device(LightSource, '127.0.0.1', 8002, group='lights'),
+            device(FilterWheel, '127.0.0.1', 8002, group='lights'),
         ]
 
     """
@@ -129,7 +163,11 @@ def device(
             raise TypeError("uid must be specified for floating devices")
         elif not issubclass(cls, FloatingDeviceMixin) and uid is not None:
             raise TypeError("uid must not be given for non floating devices")
-    return dict(cls=cls, host=host, port=int(port), uid=uid, conf=conf)
+    if uid is not None and group is not None:
+        raise TypeError("floating devices can't be grouped")
+    return dict(
+        cls=cls, host=host, port=int(port), uid=uid, conf=conf, group=group
+    )
 
 
 def _create_log_formatter(name: str):
@@ -200,6 +238,31 @@ class DeviceServerOptions:
     config_fpath: str
     logging_level: int
     logging_dir: str
+    wait_ready: bool = False
+    standby: bool = False
+    metrics_port: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class DeviceServerReady:
+    """Report sent by a :class:`DeviceServer` once it serves its devices.
+
+    Attributes:
+        pid: process ID of the device server.
+        uris: Pyro URIs of the served devices.
+        init_time: time, in seconds, from the start of the device
+            server until its devices are served.  Most of it is
+            usually the construction of the devices.
+        metrics_uri: Pyro URI of the
+            :class:`microscope._metrics.DeviceServerMetrics` of the
+            device server.
+
+    """
+
+    pid: int
+    uris: List[str]
+    init_time: float
+    metrics_uri: Optional[str] = None
 
 
 def _check_autoproxy_feature() -> None:
@@ -241,17 +304,78 @@ def _register_device(pyro_daemon, device, obj_id=None) -> None:
     return None
 
 
+def _unregister_device(pyro_daemon, device) -> None:
+    pyro_daemon.unregister(device)
+
+    if isinstance(device, microscope.abc.Controller):
+        for sub_device in device.devices.values():
+            _unregister_device(pyro_daemon, sub_device)
+
+    if isinstance(device, microscope.abc.Stage):
+        for axis in device.axes.values():
+            _unregister_device(pyro_daemon, axis)
+
+    return None
+
+
+# Pyro object id of the DeviceGroup served by the device server of a
+# group of devices.
+GROUP_OBJ_ID = "DeviceGroup"
+
+
+class DeviceGroup:
+    """Control of the devices of a group.
+
+    The device server of a group of devices serves this, next to the
+    devices, with the Pyro object id :data:`GROUP_OBJ_ID`, e.g.,
+    ``PYRO:DeviceGroup@127.0.0.1:8001``.
+
+    """
+
+    def __init__(self, server: "DeviceServer", pyro_daemon) -> None:
+        self._server = server
+        self._pyro_daemon = pyro_daemon
+
+    def get_device_names(self) -> List[str]:
+        """Return the Pyro object ids of the devices being served."""
+        return list(self._server._devices.keys())
+
+    def restart_device(self, name: str) -> None:
+        """Shut down a device of the group and construct it again.
+
+        The new device is served with the same Pyro object id, so
+        existing proxies to it can still be used, and the other
+        devices of the group are not affected.  Devices constructed
+        by the same function are restarted together.
+
+        Args:
+            name: Pyro object id of the device.
+
+        Raises:
+            KeyError: if there is no device named `name` in the group.
+            RuntimeError: if the device failed to construct.  It is
+                retried, like when the group starts, while the others
+                are being served.
+
+        """
+        self._server._restart_group_device(self._pyro_daemon, name)
+
+
 class DeviceServer(multiprocessing.Process):
     """Initialise a device and serve at host/port according to its id.
 
     Args:
-        device_def: definition of the device.
+        device_def: definition of the device, or list of definitions
+            of a group of devices to serve together.
         options: configuration for the device server.
         id_to_host: host or mapping of device identifiers to hostname.
         id_to_port: map or mapping of device identifiers to port
             number.
         exit_event: a shared event to signal that the process should
             quit.
+        standby: if true, the process starts as a warm standby.  It
+            loads its modules but does not construct the devices
+            until :meth:`activate` is called.
 
     """
 
@@ -262,23 +386,128 @@ class DeviceServer(multiprocessing.Process):
         id_to_host: Mapping[str, str],
         id_to_port: Mapping[str, int],
         exit_event: Optional[multiprocessing.Event] = None,
+        standby: bool = False,
     ):
         # The device to serve.
         self._device_def = device_def
         self._options = options
         self._devices: Dict[str, microscope.abc.Device] = {}
+        # For a group, the definition of each device, to restart it,
+        # and the definitions of the devices still to construct.
+        # Both are guarded by _group_lock, created on run.
+        self._group_defs: Dict[str, Mapping] = {}
+        self._pending: List = []
         # Where to serve it.
         self._id_to_host = id_to_host
         self._id_to_port = id_to_port
         # A shared event to allow clean shutdown.
         self.exit_event = exit_event
+        # A pipe to wake up the process when exit_event is set (see
+        # notify_exit).  Waiting on the event itself is not safe:
+        # if a process is killed while waiting, setting the event
+        # blocks forever (see https://bugs.python.org/issue30975).
+        self._exit_reader, self._exit_writer = multiprocessing.Pipe(
+            duplex=False
+        )
+        # A pipe to activate a standby process.
+        self._standby = standby
+        self._activate_reader, self._activate_writer = multiprocessing.Pipe(
+            duplex=False
+        )
+        # A pipe to send a DeviceServerReady to the parent.
+        self._ready_reader, self._ready_writer = multiprocessing.Pipe(
+            duplex=False
+        )
+        # The DeviceServerReady, once received by the parent.
+        self.ready: Optional[DeviceServerReady] = None
         super().__init__()
         self.daemon = True
 
-    def clone(self):
+    def start(self) -> None:
+        super().start()
+        # Close our copy of the child end so that ready_connection
+        # gets EOF if the child dies.
+        self._ready_writer.close()
+
+    @property
+    def ready_connection(self) -> multiprocessing.connection.Connection:
+        """Connection that becomes readable when the devices are served.
+
+        Like :attr:`sentinel`, it can be used with
+        :func:`multiprocessing.connection.wait`.  Once readable, call
+        :meth:`receive_ready`.
+        """
+        return self._ready_reader
+
+    def receive_ready(self) -> Optional[DeviceServerReady]:
+        """Receive the readiness report from the device server.
+
+        Blocks until the report is available, or the process dies.
+
+        Returns:
+            The report, also available on :attr:`ready`, or `None` if
+            the process died before serving its devices.
+        """
+        if self.ready is None:
+            try:
+                self.ready = self._ready_reader.recv()
+            except (EOFError, OSError):
+                pass
+        return self.ready
+
+    def notify_exit(self) -> None:
+        """Wake up the process after `exit_event` was set.
+
+        The process also checks `exit_event` every 5 seconds, so this
+        is only needed for a faster shutdown.
+        """
+        try:
+            self._exit_writer.send(None)
+        except OSError:
+            pass
+
+    def activate(self) -> None:
+        """Construct and serve the devices of a standby process."""
+        self._activate_writer.send(None)
+
+    def _wait_for_activation(self) -> bool:
+        """Wait until :meth:`activate` is called or `exit_event` set.
+
+        Returns:
+            Whether the process was activated.
+        """
+        connections = [self._activate_reader, self._exit_reader]
+        while self.exit_event is None or not self.exit_event.is_set():
+            try:
+                ready = multiprocessing.connection.wait(connections, 5.0)
+            except (KeyboardInterrupt, IOError):
+                continue
+            if self._activate_reader in ready:
+                try:
+                    self._activate_reader.recv()
+                except EOFError:
+                    return False
+                return True
+        return False
+
+    def _wait_for_exit(self, timeout: float) -> bool:
+        """Wait up to `timeout` seconds for `exit_event` to be set.
+
+        Returns:
+            Whether `exit_event` is set.
+        """
+        if self.exit_event is None:
+            return True
+        if not self.exit_event.is_set():
+            multiprocessing.connection.wait([self._exit_reader], timeout)
+        return self.exit_event.is_set()
+
+    def clone(self, standby: bool = False):
         """Create new instance with same settings.
 
-        This is useful to restart a device server.
+        This is useful to restart a device server.  With `standby`,
+        the clone can be started ahead of time and activated when
+        this device server dies.
 
         """
         return DeviceServer(
@@ -287,11 +516,108 @@ class DeviceServer(multiprocessing.Process):
             self._id_to_host,
             self._id_to_port,
             exit_event=self.exit_event,
+            standby=standby,
+        )
+
+    def _is_group(self) -> bool:
+        return not isinstance(self._device_def, Mapping)
+
+    def _serve_group_devices(self, pyro_daemon, device_defs) -> List:
+        """Construct and serve the devices of a group.
+
+        Returns:
+            The definitions of the devices that failed to construct.
+        """
+        failed = []
+        for device_def in device_defs:
+            cls = device_def["cls"]
+            try:
+                if isinstance(cls, type):
+                    devices = {cls.__name__: cls(**device_def["conf"])}
+                else:
+                    devices = cls(**device_def["conf"])
+            except Exception as e:
+                _logger.info(
+                    "Failed to start %s. Will retry.",
+                    cls.__name__,
+                    exc_info=e,
+                )
+                failed.append(device_def)
+                continue
+            for obj_id, device in devices.items():
+                if obj_id in self._devices:
+                    _logger.error(
+                        "Not serving %s, there is already a device"
+                        " named '%s' in the group",
+                        device,
+                        obj_id,
+                    )
+                    device.shutdown()
+                    continue
+                self._devices[obj_id] = device
+                self._group_defs[obj_id] = device_def
+                _register_device(pyro_daemon, device, obj_id=obj_id)
+                _logger.info("Serving %s", pyro_daemon.uriFor(device))
+        return failed
+
+    def _restart_group_device(self, pyro_daemon, name: str) -> None:
+        """Shut down a device of a group and serve it again.
+
+        See :meth:`DeviceGroup.restart_device`.
+        """
+        with self._group_lock:
+            device_def = self._group_defs[name]
+            for obj_id, other_def in list(self._group_defs.items()):
+                if other_def is not device_def:
+                    continue
+                del self._group_defs[obj_id]
+                device = self._devices.pop(obj_id)
+                _unregister_device(pyro_daemon, device)
+                _logger.info("Restarting %s", obj_id)
+                try:
+                    device.shutdown()
+                except Exception as e:
+                    _logger.error(
+                        "Failure to shutdown device %s", device, exc_info=e
+                    )
+            failed = self._serve_group_devices(pyro_daemon, [device_def])
+            self._pending.extend(failed)
+        if failed:
+            raise RuntimeError("failed to construct '%s', will retry" % name)
+
+    def _send_ready(self, pyro_daemon, start: float) -> None:
+        ready = DeviceServerReady(
+            pid=os.getpid(),
+            uris=[
+                str(pyro_daemon.uriFor(device))
+                for device in self._devices.values()
+            ],
+            init_time=time.monotonic() - start,
+            metrics_uri=str(
+                pyro_daemon.uriFor(microscope._metrics.METRICS_OBJ_ID)
+            ),
         )
+        _logger.info("Devices served after %.3f seconds.", ready.init_time)
+        try:
+            self._ready_writer.send(ready)
+        except OSError:
+            pass
 
     def run(self):
-        cls = self._device_def["cls"]
-        cls_name = cls.__name__
+        # By now, the interpreter is running and the modules of the
+        # devices are imported (with the spawn start method, they are
+        # imported to unpickle the device definition).  A standby
+        # waits here so that, once activated, it only needs to
+        # construct the devices.
+        if self._standby and not self._wait_for_activation():
+            return
+        start = time.monotonic()
+        if self._is_group():
+            cls = None
+            cls_name = self._device_def[0]["group"]
+        else:
+            cls = self._device_def["cls"]
+            cls_name = cls.__name__
 
         # If the multiprocessing start method is fork, the child
         # process gets a copy of the root logger.  The copy is
@@ -319,40 +645,58 @@ class DeviceServer(multiprocessing.Process):
 
         root_logger.addFilter(Filter())
 
-        # The cls argument can either be a Device subclass, or it can
-        # be a function that returns a map of names to devices.
-        cls_is_type = isinstance(cls, type)
-
-        if not cls_is_type:
-            self._devices = cls(**self._device_def["conf"])
+        # Devices of a group are constructed after the daemon starts
+        # so that a device that fails to construct does not stop the
+        # others from being served.
+        self._group_lock = Lock()
+        if self._is_group():
+            self._pending = list(self._device_def)
+            host = self._device_def[0]["host"]
+            port = self._device_def[0]["port"]
         else:
-            while not self.exit_event.is_set():
-                try:
-                    device = cls(**self._device_def["conf"])
-                except Exception as e:
-                    _logger.info(
-                        "Failed to start device. Retrying in 5s.", exc_info=e
+            # The cls argument can either be a Device subclass, or it
+            # can be a function that returns a map of names to
+            # devices.
+            cls_is_type = isinstance(cls, type)
+
+            if not cls_is_type:
+                self._devices = cls(**self._device_def["conf"])
+            else:
+                failures = 0
+                while not self.exit_event.is_set():
+                    try:
+                        device = cls(**self._device_def["conf"])
+                    except Exception as e:
+                        failures += 1
+                        delay = _retry_delay(failures)
+                        _logger.info(
+                            "Failed to start device. Retrying in %gs.",
+                            delay,
+                            exc_info=e,
+                        )
+                        self._wait_for_exit(delay)
+                    else:
+                        break
+                # FIXME: if the above never succeds, then local
+                # variable 'device' will now be referenced before
+                # assignment.
+                self._devices = {cls_name: device}
+
+            if cls_is_type and issubclass(cls, FloatingDeviceMixin):
+                uid = str(list(self._devices.values())[0].get_id())
+                if uid not in self._id_to_host or uid not in self._id_to_port:
+                    raise Exception(
+                        "Host or port not found for device %s" % (uid,)
                     )
-                    time.sleep(5)
-                else:
-                    break
-            # FIXME: if the above never succeds, then local variable
-            # 'device' will now be referenced before assignment.
-            self._devices = {cls_name: device}
-
-        if cls_is_type and issubclass(cls, FloatingDeviceMixin):
-            uid = str(list(self._devices.values())[0].get_id())
-            if uid not in self._id_to_host or uid not in self._id_to_port:
-                raise Exception(
-                    "Host or port not found for device %s" % (uid,)
-                )
-            host = self._id_to_host[uid]
-            port = self._id_to_port[uid]
-        else:
-            host = self._device_def["host"]
-            port = self._device_def["port"]
+                host = self._id_to_host[uid]
+                port = self._id_to_port[uid]
+            else:
+                host = self._device_def["host"]
+                port = self._device_def["port"]
 
         pyro_daemon = Pyro4.Daemon(port=port, host=host)
+        rpc_metrics = microscope._metrics.RPCMetrics()
+        rpc_metrics.instrument()
 
         log_handler = FileHandler(
             os.path.join(
@@ -366,6 +710,14 @@ class DeviceServer(multiprocessing.Process):
         _logger.info("Device initialized; starting daemon.")
         for obj_id, device in self._devices.items():
             _register_device(pyro_daemon, device, obj_id=obj_id)
+        pyro_daemon.register(
+            microscope._metrics.DeviceServerMetrics(
+                cls_name, self._devices, rpc_metrics, pyro_daemon
+            ),
+            microscope._metrics.METRICS_OBJ_ID,
+        )
+        if self._is_group():
+            pyro_daemon.register(DeviceGroup(self, pyro_daemon), GROUP_OBJ_ID)
 
         # Run the Pyro daemon in a separate thread so that we can do
         # clean shutdown under Windows.
@@ -378,16 +730,41 @@ class DeviceServer(multiprocessing.Process):
                 _logger.info(
                     "Device UID on port %s is %s", port, device.get_id()
                 )
-
-        # Wait for termination event. We should just be able to call
-        # wait() on the exit_event, but this causes issues with locks
-        # in multiprocessing - see http://bugs.python.org/issue30975 .
-        while self.exit_event and not self.exit_event.is_set():
-            # This tread waits for the termination event.
+        failures = 0
+        with self._group_lock:
+            self._pending = self._serve_group_devices(
+                pyro_daemon, self._pending
+            )
+            sent_ready = not self._pending
+        if sent_ready:
+            self._send_ready(pyro_daemon, start)
+
+        # Wait for termination event, retrying the construction of
+        # group devices that failed, including those that failed to
+        # restart.  The parent wakes us up with notify_exit, the
+        # timeout is only for when exit_event is set by something
+        # else.
+        while True:
+            if self._pending:
+                failures += 1
+                timeout = _retry_delay(failures)
+            else:
+                failures = 0
+                timeout = 5.0
             try:
-                time.sleep(5)
+                if self._wait_for_exit(timeout):
+                    break
             except (KeyboardInterrupt, IOError):
                 pass
+            with self._group_lock:
+                if self._pending:
+                    self._pending = self._serve_group_devices(
+                        pyro_daemon, self._pending
+                    )
+                send_ready = not (self._pending or sent_ready)
+            if send_ready:
+                sent_ready = True
+                self._send_ready(pyro_daemon, start)
         pyro_daemon.shutdown()
         pyro_thread.join()
         for device in self._devices.values():
@@ -399,7 +776,27 @@ class DeviceServer(multiprocessing.Process):
                 _logger.error("Failure to shutdown device %s", device, ex)
 
 
-def serve_devices(devices, options: DeviceServerOptions, exit_event=None):
+def serve_devices(
+    devices,
+    options: DeviceServerOptions,
+    exit_event=None,
+    ready_event=None,
+):
+    """Serve devices, each device definition on its own process.
+
+    Args:
+        devices: device definitions, see :func:`device`.
+        options: configuration for the device servers.
+        exit_event: a shared event to stop serving the devices.
+        ready_event: an event that is set once all devices are served.
+            If ``options.wait_ready`` is set, the URIs of the devices
+            are also printed to stdout at that time.
+
+    If ``options.metrics_port`` is set, the metrics of all device
+    servers are served together, in Prometheus text format, on
+    ``http://127.0.0.1:{metrics_port}/metrics``.
+
+    """
     root_logger = logging.getLogger()
 
     log_handler = FileHandler("__MAIN__.log")
@@ -439,6 +836,11 @@ def serve_devices(devices, options: DeviceServerOptions, exit_event=None):
         signal.signal(signal.SIGTERM, term_func)
         signal.signal(signal.SIGINT, term_func)
 
+    # DeviceServers are started without waiting for each other, so
+    # devices are constructed concurrently.  Each DeviceServer reports
+    # when it is serving its devices (see DeviceServerReady).
+    serve_start = time.monotonic()
+
     # Group devices by class.
     by_class = {}
     for dev in devices:
@@ -454,6 +856,9 @@ def serve_devices(devices, options: DeviceServerOptions, exit_event=None):
     if not by_class:
         _logger.warning("No valid devices specified. Maybe an empty list?")
 
+    # Devices to serve together, by group name.
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+
     for cls, devs in by_class.items():
         # Floating devices are devices that can only be identified
         # after having been initialized, so the constructor will
@@ -478,6 +883,9 @@ def serve_devices(devices, options: DeviceServerOptions, exit_event=None):
                 count += 1
 
         for dev in devs:
+            if dev.get("group") is not None:
+                groups.setdefault(dev["group"], []).append(dev)
+                continue
             servers.append(
                 DeviceServer(
                     dev,
@@ -489,72 +897,233 @@ def serve_devices(devices, options: DeviceServerOptions, exit_event=None):
             )
             servers[-1].start()
 
+    for group, devs in groups.items():
+        if len({(dev["host"], dev["port"]) for dev in devs}) != 1:
+            _logger.error(
+                "Not serving group '%s': its devices must have the same"
+                " host and port.",
+                group,
+            )
+            continue
+        # Devices are served with the name of their class (functions
+        # give their own names, which are checked when served).
+        classes = [dev["cls"] for dev in devs if isinstance(dev["cls"], type)]
+        if len(set(classes)) != len(classes):
+            _logger.error(
+                "Not serving group '%s': it has more than one device of"
+                " the same class.",
+                group,
+            )
+            continue
+        servers.append(
+            DeviceServer(devs, options, {}, {}, exit_event=exit_event)
+        )
+        servers[-1].start()
+
     # Main thread must be idle to process signals correctly, so use another
     # thread to check DeviceServers, restarting them where necessary. Define
     # the thread target here so that it can access variables in __main__ scope.
+    #
+    # The keep alive thread waits on the sentinels of the DeviceServer
+    # processes, which are ready when the process ends, and on a pipe
+    # written when exit_event is set.
+    exit_reader, exit_writer = multiprocessing.Pipe(duplex=False)
+
+    def notify_exit():
+        # Waiting on exit_event is fine here, this process is the
+        # one that sets it.
+        exit_event.wait()
+        exit_writer.send(None)
+
+    notify_exit_thread = Thread(target=notify_exit, daemon=True)
+    notify_exit_thread.start()
+
+    # Standby process for each DeviceServer, started once the
+    # DeviceServer is serving its devices (see options.standby).
+    standbys: Dict[DeviceServer, DeviceServer] = {}
+
+    def report_ready(s, restarted_after):
+        ready = s.receive_ready()
+        if ready is None:
+            # Died before serving its devices, the sentinel will
+            # tell us too.
+            return
+        if options.standby:
+            standbys[s] = s.clone(standby=True)
+            standbys[s].start()
+        _logger.info(
+            "DeviceServer with PID %s serving %s after %.3f seconds.",
+            ready.pid,
+            ", ".join(ready.uris),
+            ready.init_time,
+        )
+        if restarted_after is not None:
+            _logger.info(
+                "... serving again %.3f seconds after it died.",
+                time.monotonic() - restarted_after,
+            )
+
     def keep_alive():
         """Keep DeviceServers alive."""
+        # Number of consecutive failures, and time of the last start,
+        # of each DeviceServer.
+        failures = {s: 0 for s in servers}
+        started = {s: serve_start for s in servers}
+        # Time that the previous server died, for restarted servers.
+        restarted_after = {}
+        # DeviceServers waiting to be restarted as tuples of time to
+        # restart, the DeviceServer that died, and time it died.  If
+        # there is a standby for the DeviceServer that died, it is
+        # activated instead of starting a new process.
+        to_restart = []
+        all_ready = False
         while not exit_event.is_set():
-            for s in servers:
-                if s.is_alive():
-                    continue
+            now = time.monotonic()
+            for restart in sorted(to_restart, key=lambda r: r[0]):
+                when, dead, died = restart
+                if when > now:
+                    break
+                to_restart.remove(restart)
+                new = standbys.pop(dead, None)
+                if new is not None and new.is_alive():
+                    new.activate()
+                    how = "standby"
                 else:
-                    _logger.info(
-                        "DeviceServer Failure. Process %s is dead with"
-                        " exitcode %s. Restarting...",
-                        s.pid,
-                        s.exitcode,
-                    )
-                    servers.remove(s)
-                    servers.append(s.clone())
+                    if new is not None:
+                        new.join()
+                    new = dead.clone()
+                    new.start()
+                    how = "new process"
+                servers.append(new)
+                failures[new] = failures.pop(dead)
+                started[new] = time.monotonic()
+                restarted_after[new] = died
+                _logger.info(
+                    "... DeviceServer with PID %s restarted as %s with"
+                    " PID %s, %.3f seconds after it died.",
+                    dead.pid,
+                    how,
+                    new.pid,
+                    started[new] - died,
+                )
 
-                    try:
-                        s.join(30)
-                    except:
-                        _logger.error("... could not join PID %s.", s.pid)
-                    else:
-                        old_pid = s.pid
-                        del s
-                        servers[-1].start()
-                        _logger.info(
-                            "... DeviceServer with PID %s restarted"
-                            " as PID %s.",
-                            old_pid,
-                            servers[-1].pid,
-                        )
-            if not servers:
+            if not servers and not to_restart:
                 # Log and exit if no servers running. May want to change this
                 # if we add some interface to interactively restart servers.
                 _logger.info("No servers running. Exiting.")
                 exit_event.set()
-            else:
-                try:
-                    time.sleep(5)
-                except (KeyboardInterrupt, IOError):
-                    pass
+                break
+
+            if not all_ready and not to_restart:
+                if all(s.ready is not None for s in servers):
+                    all_ready = True
+                    announce_ready()
+
+            timeout = None
+            if to_restart:
+                timeout = max(0.0, min(r[0] for r in to_restart) - now)
+            sentinels = {s.sentinel: s for s in servers}
+            not_ready = {
+                s.ready_connection: s for s in servers if s.ready is None
+            }
+            ready = multiprocessing.connection.wait(
+                list(sentinels) + list(not_ready) + [exit_reader], timeout
+            )
+            if exit_event.is_set():
+                break
+            for connection in ready:
+                if connection in not_ready:
+                    s = not_ready[connection]
+                    report_ready(s, restarted_after.pop(s, None))
+            for sentinel in ready:
+                if sentinel not in sentinels:
+                    continue
+                s = sentinels[sentinel]
+                restarted_after.pop(s, None)
+                died = time.monotonic()
+                s.join()
+                servers.remove(s)
+                # A server that was running for a while is not failing
+                # repeatedly, so don't back off.
+                if died - started.pop(s) > _RETRY_DELAY_MAX:
+                    failures[s] = 0
+                failures[s] += 1
+                delay = _retry_delay(failures[s] - 1)
+                _logger.info(
+                    "DeviceServer Failure. Process %s is dead with"
+                    " exitcode %s. Restarting in %g seconds...",
+                    s.pid,
+                    s.exitcode,
+                    delay,
+                )
+                to_restart.append((died + delay, s, died))
+
+        for s in servers + list(standbys.values()):
+            s.notify_exit()
+        for standby in standbys.values():
+            standby.join()
+
+    def announce_ready():
+        _logger.info(
+            "All devices served after %.3f seconds.",
+            time.monotonic() - serve_start,
+        )
+        if options.wait_ready:
+            for s in servers:
+                for uri in s.ready.uris:
+                    print(uri, flush=True)
+        if ready_event is not None:
+            ready_event.set()
+
+    def collect_metrics() -> List[Dict[str, Any]]:
+        """Get the metrics of all device servers that are serving."""
+        all_metrics = []
+        for s in list(servers):
+            if s.ready is None or s.ready.metrics_uri is None:
+                continue
+            try:
+                with Pyro4.Proxy(s.ready.metrics_uri) as proxy:
+                    proxy._pyroTimeout = 5.0
+                    all_metrics.append(proxy.get_metrics())
+            except Pyro4.errors.CommunicationError as e:
+                # Probably died and will be restarted.
+                _logger.warning(
+                    "Failed to get metrics from DeviceServer with PID %s",
+                    s.pid,
+                    exc_info=e,
+                )
+        return all_metrics
+
+    metrics_server = None
+    if options.metrics_port is not None:
+        metrics_server = microscope._metrics.serve_http(
+            options.metrics_port,
+            lambda: microscope._metrics.to_prometheus(collect_metrics()),
+        )
+        _logger.info(
+            "Serving metrics on http://127.0.0.1:%d/metrics",
+            options.metrics_port,
+        )
 
     keep_alive_thread = Thread(target=keep_alive)
     keep_alive_thread.start()
 
     _logger.info("Device Server started. Press Ctrl+C to exit.")
-    while not exit_event.is_set():
+    while keep_alive_thread.is_alive():
         try:
-            time.sleep(5)
+            # With a timeout so that KeyboardInterrupt is raised on
+            # Windows.
+            keep_alive_thread.join(1)
         except (KeyboardInterrupt, IOError):
             _logger.debug("KeyboardInterrupt or IOError")
             exit_event.set()
 
+    if metrics_server is not None:
+        metrics_server.shutdown()
     _logger.debug("Shutting down servers ...")
-    while servers:
-        for s in servers:
-            if not s.is_alive():
-                servers.remove(s)
-                del s
-        time.sleep(1)
+    for s in list(servers):
+        s.join()
     _logger.info(" ... No more servers running.")
-    _logger.debug("Joining threads ...")
-    keep_alive_thread.join()
-    _logger.debug("... Threads joined. Exiting.")
     return
 
 
@@ -576,6 +1145,28 @@ def _parse_cmd_line_args(args: Sequence[str]) -> DeviceServerOptions:
         help="Directory where log files are written to",
     )
 
+    parser.add_argument(
+        "--wait-ready",
+        action="store_true",
+        help="Print the URI of each device to stdout once all are served",
+    )
+
+    parser.add_argument(
+        "--standby",
+        action="store_true",
+        help="Keep a standby process for each device server, with its"
+        " modules loaded, to restart it faster",
+    )
+
+    parser.add_argument(
+        "--metrics-port",
+        action="store",
+        type=int,
+        default=None,
+        help="Serve the metrics of all device servers, in Prometheus"
+        " text format, on this port of localhost",
+    )
+
     parser.add_argument(
         "config_fpath",
         action="store",
@@ -588,6 +1179,9 @@ def _parse_cmd_line_args(args: Sequence[str]) -> DeviceServerOptions:
         config_fpath=parsed.config_fpath,
         logging_level=getattr(logging, parsed.logging_level.upper()),
         logging_dir=parsed.logging_dir,
+        wait_ready=parsed.wait_ready,
+        standby=parsed.standby,
+        metrics_port=parsed.metrics_port,
     )
 
 
@@ -59,6 +59,9 @@ class RPiDIO(microscope.abc.DigitalIO):
     25 to in
     29 to out"""
 
+    # Input changes are notified from the GPIO interrupt callback.
+    _fetch_backoff_max = None
+
     def __init__(self, gpioMap=[], gpioState=[], **kwargs):
         super().__init__(numLines=len(gpioMap), **kwargs)
         # setup io lines 1-n mapped to GPIO lines
@@ -98,6 +101,7 @@ class RPiDIO(microscope.abc.DigitalIO):
         state = GPIO.input(pin)
         line = self._gpioMap.index(pin)
         self.inputQ.put((line, state))
+        self._notify_data_ready()
 
     def get_IO_state(self, line: int) -> bool:
         # returns
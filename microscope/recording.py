@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Recording of data to disk on the device side.
+
+A :class:`MemmapRecorder` writes data as it is acquired to memory
+mapped files so that long acquisitions are not limited by memory.
+It is typically started with
+:meth:`microscope.abc.DataDevice.start_recording` so that data goes
+to disk without leaving the device server.
+
+A recording is a directory of chunks.  Each chunk is a raw file,
+``NNNNNN.raw``, with a fixed number of frames in C order, and a JSON
+sidecar file, ``NNNNNN.json``, with the shape and type of the frames,
+the number of frames actually written, and the metadata of each
+frame.  Chunks can be read with :func:`read_chunks`::
+
+    for frames, metadata in microscope.recording.read_chunks(path):
+        ...  # frames is a read-only numpy.memmap
+
+"""
+
+import json
+import logging
+import os
+import os.path
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import microscope
+
+_logger = logging.getLogger(__name__)
+
+
+def _metadata_to_dict(
+    metadata: Optional[microscope.FrameMetadata],
+) -> Optional[Dict[str, Any]]:
+    if metadata is None:
+        return None
+    return {name: getattr(metadata, name) for name in metadata.__slots__}
+
+
+def _to_json(value: Any) -> Any:
+    # Drivers may return numpy scalars for the hardware metadata.
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("can't serialise %s to JSON" % type(value))
+
+
+class MemmapRecorder:
+    """Client that writes frames to memory mapped files.
+
+    The recorder behaves like a :class:`queue.Queue` client with
+    metadata, i.e., it has a ``put`` method that takes a ``(data,
+    metadata)`` tuple.  Each chunk file is allocated when its first
+    frame arrives, with the shape and type of that frame.  A new
+    chunk is started when a chunk is full or when the shape or type
+    of the frames changes.
+
+    Args:
+        directory: directory for the chunk files.  It is created if it
+            does not exist.  It must not have chunks from a previous
+            recording.
+        frames_per_chunk: number of frames in each chunk file.
+
+    """
+
+    def __init__(self, directory: str, frames_per_chunk: int = 100) -> None:
+        if frames_per_chunk < 1:
+            raise ValueError(
+                "frames_per_chunk must be positive (was %d)" % frames_per_chunk
+            )
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self._chunk_path(directory, 0, ".json")):
+            raise FileExistsError(
+                "directory '%s' already has a recording" % directory
+            )
+        self._directory = directory
+        self._frames_per_chunk = frames_per_chunk
+        self._lock = threading.Lock()
+        self._chunk: Optional[np.memmap] = None
+        self._chunk_index = -1
+        self._chunk_count = 0
+        self._chunk_metadata: List[Optional[Dict[str, Any]]] = []
+        self._n_frames = 0
+        self._n_bytes = 0
+        self._n_errors = 0
+        self._write_time = 0.0
+        self._start_time = time.monotonic()
+        self._closed = False
+
+    @staticmethod
+    def _chunk_path(directory: str, index: int, extension: str) -> str:
+        return os.path.join(directory, "%06d%s" % (index, extension))
+
+    def _open_chunk(self, data: np.ndarray) -> None:
+        self._chunk_index += 1
+        self._chunk_count = 0
+        self._chunk_metadata = []
+        self._chunk = np.memmap(
+            self._chunk_path(self._directory, self._chunk_index, ".raw"),
+            dtype=data.dtype,
+            mode="w+",
+            shape=(self._frames_per_chunk,) + data.shape,
+        )
+
+    def _close_chunk(self) -> None:
+        if self._chunk is None:
+            return
+        self._chunk.flush()
+        sidecar = {
+            "dtype": self._chunk.dtype.str,
+            "shape": list(self._chunk.shape[1:]),
+            "n_frames": self._chunk_count,
+            "metadata": self._chunk_metadata,
+        }
+        path = self._chunk_path(self._directory, self._chunk_index, ".json")
+        with open(path, "w") as fh:
+            json.dump(sidecar, fh, default=_to_json)
+        self._chunk = None
+
+    def put(self, item: Tuple[Any, Optional[microscope.FrameMetadata]]):
+        if isinstance(item, tuple):
+            data, metadata = item
+        else:
+            data, metadata = item, None
+        if isinstance(data, Exception):
+            _logger.warning("not recording error from device: %s", data)
+            self._n_errors += 1
+            return
+        start = time.perf_counter()
+        with self._lock:
+            if self._closed:
+                return
+            chunk = self._chunk
+            if (
+                chunk is None
+                or self._chunk_count >= self._frames_per_chunk
+                or chunk.shape[1:] != data.shape
+                or chunk.dtype != data.dtype
+            ):
+                self._close_chunk()
+                self._open_chunk(data)
+            self._chunk[self._chunk_count] = data
+            self._chunk_metadata.append(_metadata_to_dict(metadata))
+            self._chunk_count += 1
+            if self._chunk_count == self._frames_per_chunk:
+                self._close_chunk()
+            self._n_frames += 1
+            self._n_bytes += data.nbytes
+            self._write_time += time.perf_counter() - start
+
+    def close(self) -> None:
+        """Finish the current chunk.  Later frames are ignored."""
+        with self._lock:
+            self._close_chunk()
+            self._closed = True
+
+    def get_status(self) -> Dict[str, Any]:
+        """Return the state of the recording.
+
+        The returned dict has the keys:
+
+        ``"directory"``
+            the recording directory.
+        ``"frames"``
+            number of frames written.
+        ``"bytes"``
+            number of bytes written.
+        ``"chunks"``
+            number of chunk files started.
+        ``"errors"``
+            number of errors received from the device, which are not
+            recorded.
+        ``"write_throughput"``
+            bytes per second while writing, i.e., the sustained rate
+            the disk can take.
+        ``"throughput"``
+            bytes per second since the recording started, i.e., the
+            rate data is arriving.
+
+        """
+        with self._lock:
+            elapsed = time.monotonic() - self._start_time
+            return {
+                "directory": self._directory,
+                "frames": self._n_frames,
+                "bytes": self._n_bytes,
+                "chunks": self._chunk_index + 1,
+                "errors": self._n_errors,
+                "write_throughput": (
+                    self._n_bytes / self._write_time
+                    if self._write_time
+                    else 0.0
+                ),
+                "throughput": self._n_bytes / elapsed if elapsed else 0.0,
+            }
+
+
+def read_chunks(
+    directory: str,
+) -> Iterator[Tuple[np.memmap, List[Optional[Dict[str, Any]]]]]:
+    """Iterate over the chunks of a recording.
+
+    Yields:
+        A tuple with a read-only memory map of the frames in the
+        chunk, of shape ``(n_frames, height, width)``, and a list of
+        the metadata, as dicts, of each frame.
+
+    """
+    index = 0
+    while True:
+        sidecar_path = MemmapRecorder._chunk_path(directory, index, ".json")
+        if not os.path.exists(sidecar_path):
+            return
+        with open(sidecar_path, "r") as fh:
+            sidecar = json.load(fh)
+        n_frames = sidecar["n_frames"]
+        frames = np.memmap(
+            MemmapRecorder._chunk_path(directory, index, ".raw"),
+            dtype=np.dtype(sidecar["dtype"]),
+            mode="r",
+            shape=(n_frames,) + tuple(sidecar["shape"]),
+        )
+        yield frames, sidecar["metadata"]
+        index += 1
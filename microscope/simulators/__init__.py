@@ -165,6 +165,10 @@ class _ImageGenerator:
 class SimulatedCamera(
     microscope._utils.OnlyTriggersOnceOnSoftwareMixin, microscope.abc.Camera
 ):
+    # There is only data after a trigger, and triggers notify the
+    # fetch thread, so there is no need to poll.
+    _fetch_backoff_max = None
+
     def __init__(self, sensor_shape: Tuple[int, int] = (512, 512), **kwargs):
         super().__init__(**kwargs)
         # Binning and ROI
@@ -219,6 +223,7 @@ class SimulatedCamera(
             lambda: self._gain,
             self._set_gain,
             lambda: (0, 8192),
+            live=True,
         )
         self._acquiring = False
         self._exposure_time = 0.1
@@ -263,6 +268,10 @@ class SimulatedCamera(
             self._sent += 1
             return image
 
+    def _get_hardware_metadata(self):
+        # Mimic a hardware frame counter that resets on enable.
+        return (self._sent - 1, None)
+
     def abort(self):
         _logger.info("Disabling acquisition; %d images sent.", self._sent)
         if self._acquiring:
@@ -283,6 +292,7 @@ class SimulatedCamera(
 
     def set_exposure_time(self, value):
         self._exposure_time = value
+        self._acquisition_metadata = None
 
     def get_exposure_time(self):
         return self._exposure_time
@@ -309,6 +319,7 @@ class SimulatedCamera(
         )
         if self._acquiring:
             self._triggered += 1
+            self._notify_data_ready()
 
     def _get_binning(self):
         return self._binning
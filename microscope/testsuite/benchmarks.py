@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmarks of the data path.
+
+Run with ``python -m microscope.testsuite.benchmarks NAME`` where
+``NAME`` is one of the benchmarks, or none to run them all.
+
+"""
+
+import argparse
+import itertools
+import pickle
+import sys
+import timeit
+from typing import Callable, Dict, List
+
+import numpy as np
+import Pyro4
+
+import microscope._dispatch
+import microscope._transport
+from microscope import simulators
+
+# (width, height) of common sensors: EMCCD, 4.2 MP and 5.5 MP sCMOS.
+SENSOR_SHAPES = [(512, 512), (1024, 1024), (2048, 2048), (2560, 2160)]
+
+
+def _time(function: Callable[[], None], repeat: int = 3) -> float:
+    """Return the best time, in seconds, of a call to function."""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def _rot90_flip_transform(data: np.ndarray, transform) -> np.ndarray:
+    # The transform as done before it was precomputed as a view.
+    lr, ud, rot = transform
+    data = np.rot90(data, rot)
+    return {
+        (0, 0): lambda d: d,
+        (0, 1): np.flipud,
+        (1, 0): np.fliplr,
+        (1, 1): lambda d: np.fliplr(np.flipud(d)),
+    }[(lr, ud)](data)
+
+
+def benchmark_transform() -> None:
+    """Camera transform followed by pickling, as sent over Pyro."""
+    print(
+        "%-11s %-21s %12s %12s %12s"
+        % ("shape", "transform", "transform", "+ pickle", "rot90+pickle")
+    )
+    for shape in SENSOR_SHAPES:
+        camera = simulators.SimulatedCamera(sensor_shape=shape)
+        data = np.zeros(shape[::-1], dtype=np.uint16)
+        for transform in itertools.product([False, True], repeat=3):
+            camera.set_transform(transform)
+
+            def process():
+                camera._process_data(data)
+
+            def process_and_pickle():
+                pickle.dumps(
+                    camera._process_data(data), pickle.HIGHEST_PROTOCOL
+                )
+
+            def old_and_pickle():
+                pickle.dumps(
+                    _rot90_flip_transform(data, transform),
+                    pickle.HIGHEST_PROTOCOL,
+                )
+
+            print(
+                "%-11s %-21s %10.3fms %10.3fms %10.3fms"
+                % (
+                    "%dx%d" % shape,
+                    transform,
+                    _time(process) * 1000,
+                    _time(process_and_pickle) * 1000,
+                    _time(old_and_pickle) * 1000,
+                ),
+                flush=True,
+            )
+        camera.shutdown()
+
+
+def benchmark_serializer() -> None:
+    """Pyro serialization of a call to receiveData, both ways."""
+    if not microscope._transport.register_serializer():
+        print("out-of-band pickle requires Python 3.8 or later")
+        return
+    serializers = {
+        "pickle": Pyro4.util.get_serializer("pickle"),
+        "oob-pickle": Pyro4.util.get_serializer(
+            microscope._transport.OOB_PICKLE
+        ),
+    }
+    print(
+        "%-11s %-11s %12s %12s %12s"
+        % ("shape", "serializer", "array", "shared", "loads")
+    )
+    for shape in SENSOR_SHAPES:
+        data = np.zeros(shape[::-1], dtype=np.uint16)
+        for name, serializer in serializers.items():
+
+            def dumps_array():
+                serializer.dumpsCall("client", "receiveData", (data, 0.0), {})
+
+            def dumps_shared():
+                # A new SharedPickle per frame, as in dispatch.
+                shared = microscope._dispatch.SharedPickle(data)
+                serializer.dumpsCall(
+                    "client", "receiveData", (shared, 0.0), {}
+                )
+
+            dumped = serializer.dumpsCall(
+                "client",
+                "receiveData",
+                (microscope._dispatch.SharedPickle(data), 0.0),
+                {},
+            )
+
+            def loads():
+                serializer.loadsCall(dumped)
+
+            print(
+                "%-11s %-11s %10.3fms %10.3fms %10.3fms"
+                % (
+                    "%dx%d" % shape,
+                    name,
+                    _time(dumps_array) * 1000,
+                    _time(dumps_shared) * 1000,
+                    _time(loads) * 1000,
+                ),
+                flush=True,
+            )
+
+
+BENCHMARKS: Dict[str, Callable[[], None]] = {
+    "transform": benchmark_transform,
+    "serializer": benchmark_serializer,
+}
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="microscope.testsuite.benchmarks")
+    parser.add_argument(
+        "names",
+        nargs="*",
+        metavar="NAME",
+        help="benchmarks to run, from %s (default: all)"
+        % ", ".join(BENCHMARKS),
+    )
+    args = parser.parse_args(argv[1:])
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark '%s'" % name)
+    for name in args.names or BENCHMARKS:
+        print("== %s ==" % name, flush=True)
+        BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
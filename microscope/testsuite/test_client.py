@@ -62,6 +62,21 @@ class ExposedDeformableMirror(dummies.TestDeformableMirror):
         return super().n_actuators
 
 
+@Pyro4.expose
+class OldDataDevice:
+    """Data device served by a version without set_client options."""
+
+    def __init__(self):
+        self.client = None
+        self.enabled = False
+
+    def set_client(self, new_client):
+        self.client = new_client
+
+    def enable(self):
+        self.enabled = True
+
+
 class TestClient(unittest.TestCase):
     def setUp(self):
         self.daemon = Pyro4.Daemon()
@@ -99,6 +114,15 @@ class TestClient(unittest.TestCase):
         self.assertTrue(client.attr, 10)
         self.assertTrue(obj.attr, 10)
 
+    def test_data_client_with_old_device(self):
+        device = OldDataDevice()
+        uri = str(self.daemon.register(device))
+        self.thread.start()
+        client = microscope.clients.DataClient(uri)
+        client.enable()
+        self.assertTrue(device.enabled)
+        self.assertIsNotNone(device.client)
+
 
 if __name__ == "__main__":
     unittest.main()
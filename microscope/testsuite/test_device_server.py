@@ -19,6 +19,7 @@
 
 import logging
 import multiprocessing
+import multiprocessing.connection
 import os
 import os.path
 import signal
@@ -26,10 +27,12 @@ import tempfile
 import time
 import unittest
 import unittest.mock
+import urllib.request
 
 import Pyro4
 import Pyro4.errors
 
+import microscope._metrics
 import microscope.abc
 import microscope.clients
 import microscope.device_server
@@ -44,12 +47,23 @@ from microscope.testsuite.devices import (
 class ExposePIDDevice(microscope.abc.Device):
     """Test device for testing the device server keep alive."""
 
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._creation_time = time.monotonic()
+
     def _do_shutdown(self) -> None:
         pass
 
     def get_pid(self) -> int:
         return os.getpid()
 
+    def get_creation_time(self) -> float:
+        return self._creation_time
+
+
+class OtherExposePIDDevice(ExposePIDDevice):
+    pass
+
 
 class DeviceServerExceptionQueue(microscope.device_server.DeviceServer):
     """`DeviceServer` that queues an exception during `run`.
@@ -99,12 +113,14 @@ class BaseTestServeDevices(unittest.TestCase):
 
     Attributes:
         DEVICES (list): list of :class:`microscope.devices` to initialise.
+        OPTIONS (dict): other fields of the device server options.
         TIMEOUT (number): time given for service to terminate after
             receiving signal to terminate.
         p (multiprocessing.Process): device server process.
     """
 
     DEVICES = []
+    OPTIONS = {}
     TIMEOUT = 5
 
     @_patch_out_device_server_logs
@@ -113,6 +129,7 @@ class BaseTestServeDevices(unittest.TestCase):
             config_fpath="",
             logging_level=logging.INFO,
             logging_dir="",
+            **self.OPTIONS,
         )
         self.p = multiprocessing.Process(
             target=microscope.device_server.serve_devices,
@@ -324,6 +341,19 @@ class TestFunctionInDeviceDefinition(BaseTestDeviceServer):
         self.assertEqual(dm1.n_actuators, 10)
         self.assertEqual(dm2.n_actuators, 20)
 
+    def test_ready(self):
+        """DeviceServer reports when and where the devices are served"""
+        ready = self.process.receive_ready()
+        self.assertIsInstance(
+            ready, microscope.device_server.DeviceServerReady
+        )
+        self.assertEqual(ready.pid, self.process.pid)
+        self.assertEqual(
+            sorted(ready.uris),
+            ["PYRO:dm1@localhost:8001", "PYRO:dm2@localhost:8001"],
+        )
+        self.assertGreater(ready.init_time, 0.0)
+
 
 class TestCopyOfDeviceConf(BaseTestServeDevices):
     """Ensure that device configurations are a copy."""
@@ -390,6 +420,72 @@ class TestCopyOfDeviceConf(BaseTestServeDevices):
         )
 
 
+class TestReadyEvent(unittest.TestCase):
+    DEVICES = [
+        microscope.device_server.device(
+            ExposePIDDevice, "127.0.0.1", 8001, {}
+        ),
+        microscope.device_server.device(
+            TestFilterWheel, "127.0.0.1", 8002, {"positions": 3}
+        ),
+    ]
+
+    @_patch_out_device_server_logs
+    def setUp(self):
+        options = microscope.device_server.DeviceServerOptions(
+            config_fpath="",
+            logging_level=logging.INFO,
+            logging_dir="",
+        )
+        self.ready_event = multiprocessing.Event()
+        self.p = multiprocessing.Process(
+            target=microscope.device_server.serve_devices,
+            args=(self.DEVICES, options),
+            kwargs={"ready_event": self.ready_event},
+        )
+        self.p.start()
+
+    def tearDown(self):
+        self.p.terminate()
+        self.p.join(5)
+        self.assertFalse(self.p.is_alive())
+
+    def test_ready_event(self):
+        self.assertTrue(self.ready_event.wait(10))
+        device = Pyro4.Proxy("PYRO:ExposePIDDevice@127.0.0.1:8001")
+        filterwheel = Pyro4.Proxy("PYRO:SimulatedFilterWheel@127.0.0.1:8002")
+        self.assertNotEqual(device.get_pid(), os.getpid())
+        self.assertEqual(filterwheel.n_positions, 3)
+
+
+class TestRetryDelay(unittest.TestCase):
+    def test_exponential_back_off(self):
+        delays = [microscope.device_server._retry_delay(n) for n in range(12)]
+        self.assertEqual(delays[:4], [0.0, 0.5, 1.0, 2.0])
+        self.assertEqual(delays[-1], microscope.device_server._RETRY_DELAY_MAX)
+
+
+class TestGroupWithSameClass(BaseTestServeDevices):
+    DEVICES = [
+        microscope.device_server.device(
+            ExposePIDDevice, "127.0.0.1", 8001, {}, group="pids"
+        ),
+        microscope.device_server.device(
+            ExposePIDDevice, "127.0.0.1", 8001, {}, group="pids"
+        ),
+        microscope.device_server.device(
+            TestFilterWheel, "127.0.0.1", 8002, {"positions": 3}
+        ),
+    ]
+
+    def test_group_not_served(self):
+        filterwheel = Pyro4.Proxy("PYRO:SimulatedFilterWheel@127.0.0.1:8002")
+        self.assertEqual(filterwheel.n_positions, 3)
+        device = Pyro4.Proxy("PYRO:ExposePIDDevice@127.0.0.1:8001")
+        with self.assertRaises(Pyro4.errors.CommunicationError):
+            device.get_pid()
+
+
 class TestKeepDeviceServerAlive(BaseTestServeDevices):
     DEVICES = [
         microscope.device_server.device(
@@ -410,14 +506,198 @@ class TestKeepDeviceServerAlive(BaseTestServeDevices):
         with self.assertRaises(Pyro4.errors.ConnectionClosedError):
             device.get_pid()
 
-        # The device server checks every 5 seconds for a crashed
-        # device server so give it 6 seconds.
-        time.sleep(6)
+        # The device server is restarted as soon as it dies, give it
+        # 2 seconds to construct the device and serve it again.
+        start = time.monotonic()
+        while True:
+            try:
+                device._pyroReconnect(tries=1)
+            except Pyro4.errors.CommunicationError:
+                if time.monotonic() - start > 2:
+                    raise
+                time.sleep(0.1)
+            else:
+                break
 
-        device._pyroReconnect(tries=1)
         new_pid = device.get_pid()
         self.assertNotEqual(initial_pid, new_pid)
 
 
+class TestKeepDeviceServerAliveWithStandby(TestKeepDeviceServerAlive):
+    OPTIONS = {"standby": True}
+
+
+class TestStandbyDeviceServer(unittest.TestCase):
+    @_patch_out_device_server_logs
+    def setUp(self):
+        options = microscope.device_server.DeviceServerOptions(
+            config_fpath="",
+            logging_level=logging.INFO,
+            logging_dir="",
+        )
+        self.exit_event = multiprocessing.Event()
+        self.server = microscope.device_server.DeviceServer(
+            microscope.device_server.device(
+                ExposePIDDevice, "127.0.0.1", 8001, {}
+            ),
+            options,
+            {},
+            {},
+            exit_event=self.exit_event,
+            standby=True,
+        )
+        self.server.start()
+
+    def tearDown(self):
+        self.exit_event.set()
+        self.server.notify_exit()
+        self.server.join(5)
+        self.assertFalse(self.server.is_alive())
+
+    def test_serves_once_activated(self):
+        connection = self.server.ready_connection
+        self.assertEqual(multiprocessing.connection.wait([connection], 1), [])
+        self.assertTrue(self.server.is_alive())
+
+        self.server.activate()
+        ready = self.server.receive_ready()
+        self.assertEqual(ready.pid, self.server.pid)
+        device = Pyro4.Proxy("PYRO:ExposePIDDevice@127.0.0.1:8001")
+        self.assertEqual(device.get_pid(), self.server.pid)
+
+    def test_exit_without_activation(self):
+        self.exit_event.set()
+        self.server.notify_exit()
+        self.server.join(5)
+        self.assertEqual(self.server.exitcode, 0)
+        self.assertIsNone(self.server.receive_ready())
+
+
+class TestMetrics(BaseTestServeDevices):
+    DEVICES = [
+        microscope.device_server.device(
+            ExposePIDDevice, "127.0.0.1", 8001, {}
+        ),
+        microscope.device_server.device(TestCamera, "127.0.0.1", 8002, {}),
+    ]
+    OPTIONS = {"metrics_port": 8003}
+
+    def test_pyro(self):
+        device = Pyro4.Proxy("PYRO:ExposePIDDevice@127.0.0.1:8001")
+        pid = device.get_pid()
+        device.get_pid()
+        metrics = Pyro4.Proxy("PYRO:DeviceServerMetrics@127.0.0.1:8001")
+        status = metrics.get_metrics()
+        self.assertEqual(status["name"], "ExposePIDDevice")
+        self.assertEqual(status["pid"], pid)
+        self.assertEqual(status["rpc"]["ExposePIDDevice.get_pid"]["count"], 2)
+        self.assertEqual(status["rpc"]["ExposePIDDevice.get_pid"]["errors"], 0)
+        self.assertGreaterEqual(status["thread_pool"]["busy"], 1)
+        self.assertGreater(status["cpu_time"], 0.0)
+        self.assertEqual(status["devices"], {})
+
+    def test_data_device_counters(self):
+        metrics = Pyro4.Proxy("PYRO:DeviceServerMetrics@127.0.0.1:8002")
+        devices = metrics.get_metrics()["devices"]
+        self.assertEqual(list(devices.keys()), ["TestCamera"])
+        self.assertIn("fetched", devices["TestCamera"])
+
+    def test_prometheus(self):
+        device = Pyro4.Proxy("PYRO:ExposePIDDevice@127.0.0.1:8001")
+        pid = device.get_pid()
+        with urllib.request.urlopen("http://127.0.0.1:8003/metrics") as f:
+            text = f.read().decode()
+        self.assertIn(
+            'microscope_rpc_calls_total{method="ExposePIDDevice.get_pid",'
+            'server="ExposePIDDevice",pid="%d"} 1.0' % pid,
+            text,
+        )
+        self.assertIn('microscope_data_fetched{device="TestCamera"', text)
+
+
+class TestPrometheusText(unittest.TestCase):
+    def test_histogram(self):
+        rpc = microscope._metrics.RPCMetrics()
+        rpc.record("Device.method", 1e-6, failed=False)
+        rpc.record("Device.method", 100.0, failed=True)
+        metrics = {
+            "name": 'with "quotes"',
+            "pid": 1,
+            "uptime": 2.0,
+            "rpc": rpc.get_status(),
+            "thread_pool": None,
+            "rss": None,
+            "max_rss": None,
+            "cpu_time": 0.5,
+            "devices": {},
+        }
+        lines = microscope._metrics.to_prometheus([metrics]).splitlines()
+        labels = 'method="Device.method",server="with \\"quotes\\"",pid="1"'
+        self.assertIn("microscope_rpc_calls_total{%s} 2.0" % labels, lines)
+        self.assertIn("microscope_rpc_errors_total{%s} 1.0" % labels, lines)
+        self.assertIn(
+            'microscope_rpc_latency_seconds_bucket{le="+Inf",%s} 2.0' % labels,
+            lines,
+        )
+        self.assertEqual(
+            lines.count("# TYPE microscope_rpc_calls_total counter"), 1
+        )
+        self.assertFalse(any("resident_memory" in line for line in lines))
+
+
+class TestGroupedDevices(BaseTestServeDevices):
+    DEVICES = [
+        microscope.device_server.device(
+            ExposePIDDevice, "127.0.0.1", 8001, {}, group="pids"
+        ),
+        microscope.device_server.device(
+            OtherExposePIDDevice, "127.0.0.1", 8001, {}, group="pids"
+        ),
+        microscope.device_server.device(
+            TestFilterWheel, "127.0.0.1", 8002, {"positions": 3}
+        ),
+    ]
+
+    def test_same_process(self):
+        device = Pyro4.Proxy("PYRO:ExposePIDDevice@127.0.0.1:8001")
+        other = Pyro4.Proxy("PYRO:OtherExposePIDDevice@127.0.0.1:8001")
+        self.assertEqual(device.get_pid(), other.get_pid())
+        self.assertNotEqual(device.get_pid(), os.getpid())
+        filterwheel = Pyro4.Proxy("PYRO:SimulatedFilterWheel@127.0.0.1:8002")
+        self.assertEqual(filterwheel.n_positions, 3)
+
+    def test_restart_device(self):
+        device = Pyro4.Proxy("PYRO:ExposePIDDevice@127.0.0.1:8001")
+        other = Pyro4.Proxy("PYRO:OtherExposePIDDevice@127.0.0.1:8001")
+        created = device.get_creation_time()
+        other_created = other.get_creation_time()
+        group = Pyro4.Proxy("PYRO:DeviceGroup@127.0.0.1:8001")
+        group.restart_device("ExposePIDDevice")
+        # The same proxy reaches the new device, on the same process.
+        self.assertGreater(device.get_creation_time(), created)
+        self.assertEqual(device.get_pid(), other.get_pid())
+        self.assertEqual(other.get_creation_time(), other_created)
+        self.assertEqual(
+            sorted(group.get_device_names()),
+            ["ExposePIDDevice", "OtherExposePIDDevice"],
+        )
+
+    def test_restart_unknown_device(self):
+        group = Pyro4.Proxy("PYRO:DeviceGroup@127.0.0.1:8001")
+        with self.assertRaises(KeyError):
+            group.restart_device("SimulatedFilterWheel")
+
+    def test_floating_devices_not_grouped(self):
+        with self.assertRaisesRegex(TypeError, "can't be grouped"):
+            microscope.device_server.device(
+                TestFloatingDevice,
+                "127.0.0.1",
+                8001,
+                {},
+                uid="foo",
+                group="pids",
+            )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -35,6 +35,7 @@ constructs the device instance required to run the tests.
 
 """
 
+import itertools
 import unittest
 import unittest.mock
 from queue import Queue
@@ -42,6 +43,7 @@ from queue import Queue
 import numpy as np
 
 import microscope
+import microscope._transport
 import microscope.testsuite.devices as dummies
 import microscope.testsuite.mock_devices as mocks
 from microscope import simulators
@@ -442,6 +444,266 @@ class TestImageGenerator(unittest.TestCase):
                 self.assertEqual(image.shape, (height, width))
 
 
+class TestCameraTransform(unittest.TestCase):
+    def setUp(self):
+        self.camera = simulators.SimulatedCamera(sensor_shape=(7, 5))
+        self.addCleanup(self.camera.shutdown)
+        self.data = np.arange(35).reshape(5, 7)
+
+    def expected(self):
+        lr, ud, rot = self.camera._transform
+        data = np.rot90(self.data, rot)
+        if ud:
+            data = np.flipud(data)
+        if lr:
+            data = np.fliplr(data)
+        return data
+
+    def test_all_orientations(self):
+        """Transform is the same as rotating then flipping, as a view"""
+        flags = list(itertools.product([False, True], repeat=3))
+        for readout, client in itertools.product(flags, flags):
+            with self.subTest(readout=readout, client=client):
+                self.camera._set_readout_transform(readout)
+                self.camera.set_transform(client)
+                transformed = self.camera._process_data(self.data)
+                np.testing.assert_array_equal(transformed, self.expected())
+                self.assertTrue(np.shares_memory(transformed, self.data))
+
+    def test_no_transform(self):
+        self.assertIs(self.camera._process_data(self.data), self.data)
+
+
+class TestFrameMetadata(unittest.TestCase):
+    def setUp(self):
+        self.camera = simulators.SimulatedCamera(sensor_shape=(32, 16))
+        self.camera.set_exposure_time(0.01)
+        self.buffer = Queue()
+        self.camera.set_client(self.buffer, metadata=True)
+        self.camera.enable()
+        self.addCleanup(self.camera.shutdown)
+
+    def test_metadata_with_data(self):
+        self.camera.trigger()
+        data, metadata = self.buffer.get()
+        self.assertIsInstance(metadata, microscope.FrameMetadata)
+        self.assertEqual(data.shape, (16, 32))
+        self.assertEqual(metadata.exposure_time, 0.01)
+        self.assertEqual(metadata.roi, microscope.ROI(0, 0, 32, 16))
+        self.assertEqual(metadata.binning, microscope.Binning(1, 1))
+        self.assertEqual(metadata.transform, (False, False, False))
+        self.assertEqual(metadata.hardware_frame, 0)
+        self.assertIsNone(metadata.hardware_timestamp)
+
+    def test_sequence_and_timestamps_increase(self):
+        metadatas = []
+        for i in range(3):
+            self.camera.trigger()
+            metadatas.append(self.buffer.get()[1])
+        first = metadatas[0].sequence
+        self.assertEqual(
+            [m.sequence for m in metadatas], [first, first + 1, first + 2]
+        )
+        self.assertTrue(
+            metadatas[0].monotonic
+            < metadatas[1].monotonic
+            < metadatas[2].monotonic
+        )
+
+    def test_metadata_updated_on_reconfiguration(self):
+        self.camera.set_exposure_time(0.02)
+        self.camera.set_transform((True, False, False))
+        self.camera.trigger()
+        metadata = self.buffer.get()[1]
+        self.assertEqual(metadata.exposure_time, 0.02)
+        self.assertEqual(metadata.transform, (True, False, False))
+
+    def test_no_metadata_by_default(self):
+        buffer = Queue()
+        self.camera.set_client(buffer)
+        self.camera.trigger()
+        self.assertIsInstance(buffer.get(), np.ndarray)
+
+
+@unittest.skipIf(
+    microscope._transport.shared_memory is None,
+    "shared memory requires Python 3.8 or later",
+)
+class TestSharedMemoryTransport(unittest.TestCase):
+    def setUp(self):
+        self.camera = simulators.SimulatedCamera(
+            sensor_shape=(32, 16), shared_memory_slots=2
+        )
+        self.camera.set_setting("display image number", False)
+        self.buffer = Queue()
+        self.camera.set_client(self.buffer, shared_memory=True)
+        self.camera.enable()
+        self.reader = microscope._transport.SharedMemoryReader()
+        self.addCleanup(self.reader.close)
+        self.addCleanup(self.camera.shutdown)
+
+    def test_client_gets_shared_frame(self):
+        self.camera.set_setting("image pattern", 5)  # white
+        self.camera.trigger()
+        frame = self.buffer.get()
+        self.assertIsInstance(frame, microscope._transport.SharedFrame)
+        data = self.reader.view(frame)
+        self.assertEqual(data.shape, (16, 32))
+        self.assertTrue(np.all(data == 255))
+        self.assertFalse(data.flags.writeable)
+
+    def test_slots_not_reused_until_released(self):
+        frames = []
+        for i in range(3):
+            self.camera.trigger()
+            frames.append(self.buffer.get())
+        # Only two slots so the third frame is sent inline.
+        self.assertIsInstance(frames[0], microscope._transport.SharedFrame)
+        self.assertIsInstance(frames[1], microscope._transport.SharedFrame)
+        self.assertIsInstance(frames[2], np.ndarray)
+        self.camera.release_shared_frame(frames[0].generation, frames[0].index)
+        self.camera.trigger()
+        frame = self.buffer.get()
+        self.assertIsInstance(frame, microscope._transport.SharedFrame)
+        self.assertEqual(frame.index, frames[0].index)
+
+
+class TestFrameCodecs(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.frames = [
+            rng.integers(0, 2**12, (64, 48), dtype=np.uint16) for i in range(2)
+        ]
+
+    def test_lossless(self):
+        for codec in microscope._transport.CODECS:
+            for dtype in [np.uint8, np.uint16, np.int32, np.float64]:
+                with self.subTest(codec=codec, dtype=dtype):
+                    encoder = microscope._transport.FrameEncoder(codec)
+                    decoder = microscope._transport.FrameDecoder()
+                    for frame in self.frames:
+                        data = frame.astype(dtype)
+                        decoded = decoder.decode(encoder.encode(data))
+                        self.assertEqual(decoded.dtype, data.dtype)
+                        np.testing.assert_array_equal(decoded, data)
+
+    def test_non_contiguous_data(self):
+        data = self.frames[0][::-1].T
+        encoder = microscope._transport.FrameEncoder("zlib")
+        decoded = microscope._transport.FrameDecoder().decode(
+            encoder.encode(data)
+        )
+        np.testing.assert_array_equal(decoded, data)
+
+    def test_compresses_static_scene(self):
+        encoder = microscope._transport.FrameEncoder("delta")
+        for i in range(10):
+            encoder.encode(self.frames[0])
+        status = encoder.get_status()
+        self.assertEqual(status["frames"], 10)
+        self.assertGreater(status["ratio"], 5)
+
+    def test_delta_key_frames(self):
+        encoder = microscope._transport.FrameEncoder(
+            "delta", keyframe_interval=2
+        )
+        frames = [encoder.encode(self.frames[i % 2]) for i in range(6)]
+        self.assertEqual([f.key for f in frames], [None, 0, 0, None, 3, 3])
+        # Delta frames can be decoded out of order, but not without
+        # their key frame.
+        decoder = microscope._transport.FrameDecoder()
+        decoder.decode(frames[3])
+        np.testing.assert_array_equal(
+            decoder.decode(frames[4]), self.frames[0]
+        )
+        with self.assertRaisesRegex(ValueError, "key frame 0"):
+            decoder.decode(frames[1])
+
+    def test_reenable_mid_delta_stream(self):
+        decoder = microscope._transport.FrameDecoder()
+        first = microscope._transport.FrameEncoder("delta")
+        for i in range(3):
+            decoder.decode(first.encode(self.frames[0]))
+        # The client is set again, and the new key frame, with the
+        # same index as the old one, is lost or arrives late.
+        second = microscope._transport.FrameEncoder("delta")
+        keyframe = second.encode(self.frames[1])
+        delta = second.encode(self.frames[1])
+        self.assertEqual(delta.key, 0)
+        with self.assertRaisesRegex(ValueError, "key frame 0"):
+            decoder.decode(delta)
+        decoder.decode(keyframe)
+        np.testing.assert_array_equal(decoder.decode(delta), self.frames[1])
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            microscope._transport.FrameEncoder("gzip")
+
+
+class TestCompressedTransport(unittest.TestCase):
+    def setUp(self):
+        self.camera = simulators.SimulatedCamera(sensor_shape=(32, 16))
+        self.camera.set_exposure_time(0.0)
+        self.camera.enable()
+        self.addCleanup(self.camera.shutdown)
+
+    def test_client_codec(self):
+        buffer = Queue()
+        self.camera.set_client(buffer, codec="zlib")
+        self.camera.trigger()
+        frame = buffer.get(timeout=5)
+        self.assertIsInstance(frame, microscope._transport.EncodedFrame)
+        data = microscope._transport.FrameDecoder().decode(frame)
+        self.assertEqual(data.shape, (16, 32))
+        [status] = self.camera.get_codec_status()
+        self.assertEqual(status["codec"], "zlib")
+        self.assertEqual(status["frames"], 1)
+        self.assertEqual(status["client"], str(buffer))
+
+    def test_options_dropped_when_popped(self):
+        buffer = Queue()
+        self.camera.set_client(buffer, metadata=True, codec="zlib")
+        self.camera.set_client(None)
+        self.camera.set_client(buffer)
+        self.camera.trigger()
+        self.assertIsInstance(buffer.get(timeout=5), np.ndarray)
+        self.assertNotIn(buffer, self.camera._metadata_clients)
+        self.assertNotIn(buffer, self.camera._encoders)
+
+    def test_options_replaced(self):
+        buffer = Queue()
+        self.camera.set_client(buffer, metadata=True, codec="zlib")
+        self.camera.set_client(buffer)
+        self.camera.trigger()
+        self.assertIsInstance(buffer.get(timeout=5), np.ndarray)
+
+    def test_delta_across_set_client(self):
+        buffer = Queue()
+        decoder = microscope._transport.FrameDecoder()
+        for session in range(2):
+            self.camera.disable()
+            self.camera.set_client(buffer, codec="delta")
+            self.camera.enable()
+            for i in range(3):
+                self.camera.trigger()
+                data = decoder.decode(buffer.get(timeout=5))
+                self.assertEqual(data.shape, (16, 32))
+            self.camera.set_client(None)
+
+    def test_codec_per_subscriber(self):
+        plain = Queue()
+        compressed = Queue()
+        self.camera.subscribe(plain)
+        self.camera.subscribe(compressed, codec="delta")
+        self.camera.trigger()
+        self.assertIsInstance(plain.get(timeout=5), np.ndarray)
+        self.assertIsInstance(
+            compressed.get(timeout=5), microscope._transport.EncodedFrame
+        )
+        self.camera.unsubscribe(compressed)
+        self.assertEqual(self.camera.get_codec_status(), [])
+
+
 class TestStageAwareCamera(unittest.TestCase, CameraTests):
     def setUp(self):
         image = np.full((3000, 1500, 1), 42, dtype=np.uint8)
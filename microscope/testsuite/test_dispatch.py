@@ -0,0 +1,638 @@
+#!/usr/bin/env python3
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the buffering and dispatch of data from data devices."""
+
+import pickle
+import queue
+import threading
+import time
+import unittest
+import unittest.mock
+
+import numpy as np
+import Pyro4
+
+import microscope
+import microscope._dispatch
+import microscope._transport
+import microscope.clients  # configures Pyro to use pickle
+from microscope import simulators
+
+
+class TestDispatchRing(unittest.TestCase):
+    def fill(self, ring, n, nbytes=10):
+        return [ring.put(i, nbytes) for i in range(n)]
+
+    def drain(self, ring):
+        items = []
+        while True:
+            try:
+                items.append(ring.get(timeout=0))
+            except queue.Empty:
+                return items
+
+    def test_unbounded(self):
+        ring = microscope._dispatch.DispatchRing()
+        self.assertTrue(all(self.fill(ring, 100)))
+        self.assertEqual(len(ring), 100)
+        self.assertEqual(ring.nbytes, 1000)
+        self.assertEqual(self.drain(ring), list(range(100)))
+        self.assertEqual(ring.nbytes, 0)
+
+    def test_drop_oldest_on_bytes(self):
+        ring = microscope._dispatch.DispatchRing(
+            max_bytes=35, policy=microscope.DropPolicy.DROP_OLDEST
+        )
+        self.fill(ring, 5)
+        self.assertEqual(self.drain(ring), [2, 3, 4])
+        self.assertEqual(ring.dropped, 2)
+
+    def test_drop_newest_on_length(self):
+        ring = microscope._dispatch.DispatchRing(
+            max_length=3, policy=microscope.DropPolicy.DROP_NEWEST
+        )
+        self.assertEqual(self.fill(ring, 5), [True] * 3 + [False] * 2)
+        self.assertEqual(self.drain(ring), [0, 1, 2])
+        self.assertEqual(ring.dropped, 2)
+
+    def test_keep_latest(self):
+        ring = microscope._dispatch.DispatchRing(
+            policy=microscope.DropPolicy.KEEP_LATEST
+        )
+        self.fill(ring, 5)
+        self.assertEqual(self.drain(ring), [4])
+        self.assertEqual(ring.dropped, 4)
+
+    def test_oversized_item_on_empty_buffer(self):
+        ring = microscope._dispatch.DispatchRing(
+            max_bytes=10, policy=microscope.DropPolicy.DROP_NEWEST
+        )
+        self.assertTrue(ring.put("big", 100))
+        self.assertFalse(ring.put("small", 1))
+
+    def test_block_until_space(self):
+        ring = microscope._dispatch.DispatchRing(max_length=1)
+        ring.put(0, 0)
+        putter = threading.Thread(target=ring.put, args=(1, 0))
+        putter.start()
+        putter.join(0.1)
+        self.assertTrue(putter.is_alive(), "put did not block on full ring")
+        self.assertEqual(ring.get(), 0)
+        putter.join(1)
+        self.assertFalse(putter.is_alive())
+        self.assertEqual(ring.get(), 1)
+
+    def test_cancel_blocked_put(self):
+        ring = microscope._dispatch.DispatchRing(max_length=1)
+        ring.put(0, 0)
+        results = []
+        putter = threading.Thread(
+            target=lambda: results.append(ring.put(1, 0))
+        )
+        putter.start()
+        ring.cancel_waiting()
+        putter.join(1)
+        self.assertEqual(results, [False])
+        self.assertEqual(ring.dropped, 1)
+
+    def test_close(self):
+        ring = microscope._dispatch.DispatchRing()
+        ring.put(0, 0)
+        errors = []
+
+        def get():
+            try:
+                while True:
+                    ring.get()
+            except microscope._dispatch.RingClosedError as e:
+                errors.append(e)
+
+        getter = threading.Thread(target=get)
+        getter.start()
+        ring.close()
+        getter.join(1)
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(ring.put(1, 0))
+
+
+class TestHistogram(unittest.TestCase):
+    def test_bins(self):
+        histogram = microscope._dispatch.Histogram([1.0, 2.0])
+        for value in [0.5, 1.0, 1.5, 3.0, 4.0]:
+            histogram.add(value)
+        status = histogram.get_status()
+        self.assertEqual(status["counts"], [2, 1, 2])
+        self.assertEqual(status["count"], 5)
+        self.assertEqual(status["mean"], 2.0)
+        self.assertEqual(status["max"], 4.0)
+
+    def test_empty(self):
+        status = microscope._dispatch.Histogram().get_status()
+        self.assertEqual(status["count"], 0)
+        self.assertEqual(status["mean"], 0.0)
+        self.assertEqual(len(status["counts"]), len(status["edges"]) + 1)
+
+
+class TestSharedPickle(unittest.TestCase):
+    def test_unpickles_to_data(self):
+        data = np.arange(12).reshape(3, 4)
+        shared = microscope._dispatch.SharedPickle(data)
+        np.testing.assert_array_equal(pickle.loads(pickle.dumps(shared)), data)
+
+    def test_pickled_once(self):
+        shared = microscope._dispatch.SharedPickle(np.zeros((4, 4)))
+        first = pickle.dumps(shared)
+        pickled = shared._pickled
+        self.assertEqual(pickle.dumps(shared), first)
+        self.assertIs(shared._pickled, pickled)
+
+    @unittest.skipIf(pickle.HIGHEST_PROTOCOL < 5, "requires pickle protocol 5")
+    def test_out_of_band_buffers(self):
+        data = np.arange(1024, dtype=np.uint16).reshape(32, 32)
+        buffers = []
+        stream = pickle.dumps(
+            microscope._dispatch.SharedPickle(data),
+            protocol=5,
+            buffer_callback=buffers.append,
+        )
+        self.assertEqual(len(buffers), 1)
+        self.assertLess(len(stream), data.nbytes)
+        np.testing.assert_array_equal(
+            pickle.loads(stream, buffers=buffers), data
+        )
+
+
+@unittest.skipIf(pickle.HIGHEST_PROTOCOL < 5, "requires pickle protocol 5")
+class TestOutOfBandPickleSerializer(unittest.TestCase):
+    def setUp(self):
+        self.serializer = microscope._transport.OutOfBandPickleSerializer()
+
+    def test_round_trip(self):
+        data = {
+            "image": np.arange(64, dtype=np.uint16).reshape(8, 8),
+            "transposed": np.arange(12.0).reshape(3, 4).T,
+            "shared": microscope._dispatch.SharedPickle(np.ones(16)),
+            "other": [1, "two", None],
+        }
+        loaded = self.serializer.loads(self.serializer.dumps(data))
+        np.testing.assert_array_equal(loaded["image"], data["image"])
+        np.testing.assert_array_equal(loaded["transposed"], data["transposed"])
+        np.testing.assert_array_equal(loaded["shared"], np.ones(16))
+        self.assertEqual(loaded["other"], data["other"])
+        self.assertTrue(loaded["image"].flags.writeable)
+
+    def test_call(self):
+        data = np.zeros((4, 4))
+        obj, method, vargs, kwargs = self.serializer.loadsCall(
+            self.serializer.dumpsCall("obj", "receiveData", (data, 1.0), {})
+        )
+        self.assertEqual((obj, method, kwargs), ("obj", "receiveData", {}))
+        np.testing.assert_array_equal(vargs[0], data)
+
+    def test_pyro_client(self):
+        @Pyro4.expose
+        class Receiver:
+            def __init__(self):
+                self.buffer = queue.Queue()
+
+            def receiveData(self, data, timestamp):
+                self.buffer.put(data)
+
+        camera = simulators.SimulatedCamera(sensor_shape=(32, 16))
+        camera.enable()
+        self.addCleanup(camera.shutdown)
+        daemon = Pyro4.Daemon()
+        receiver = Receiver()
+        uri = daemon.register(receiver)
+        thread = threading.Thread(target=daemon.requestLoop)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(daemon.shutdown)
+        camera.set_client(uri, serializer=microscope._transport.OOB_PICKLE)
+        camera.trigger()
+        data = receiver.buffer.get(timeout=5)
+        self.assertIsInstance(data, np.ndarray)
+        self.assertEqual(data.shape, (16, 32))
+
+
+class TestDataDeviceBufferLimits(unittest.TestCase):
+    def test_slow_client_drops(self):
+        """Frames are dropped, and counted, with a slow client"""
+        shape = (16, 16)
+        camera = simulators.SimulatedCamera(
+            sensor_shape=shape,
+            buffer_bytes=2 * np.prod(shape),
+            drop_policy=microscope.DropPolicy.DROP_OLDEST,
+        )
+        camera.set_exposure_time(0.0)
+        blocked = threading.Event()
+        release = threading.Event()
+
+        class SlowClient:
+            def put(self, data):
+                blocked.set()
+                release.wait()
+
+        camera.set_client(SlowClient())
+        camera.enable()
+        self.addCleanup(camera.shutdown)
+        self.addCleanup(release.set)
+        # Wait for the dispatch thread to be blocked on the client.
+        camera.trigger()
+        self.assertTrue(blocked.wait(5))
+        for i in range(9):
+            camera.trigger()
+        # The buffer holds two frames and the rest are dropped.
+        for i in range(500):
+            if camera.get_buffer_status()["dropped"] == 7:
+                break
+            time.sleep(0.01)
+        status = camera.get_buffer_status()
+        self.assertEqual(status["dropped"], 7)
+        self.assertEqual(status["length"], 2)
+        self.assertIs(status["policy"], microscope.DropPolicy.DROP_OLDEST)
+
+    def test_bounded_by_default(self):
+        camera = simulators.SimulatedCamera()
+        self.addCleanup(camera.shutdown)
+        ring = camera._dispatch_buffer
+        self.assertIs(ring.policy, microscope.DropPolicy.BLOCK)
+        ring.put(None, 2**30)
+        self.assertFalse(ring._fits(1))
+
+
+class TestSubscribers(unittest.TestCase):
+    def setUp(self):
+        self.camera = simulators.SimulatedCamera(sensor_shape=(16, 16))
+        self.camera.set_exposure_time(0.0)
+        self.camera.enable()
+        self.addCleanup(self.camera.shutdown)
+
+    def get_frames(self, buffer, n):
+        return [buffer.get(timeout=5) for i in range(n)]
+
+    def test_all_subscribers_get_data(self):
+        buffers = [queue.Queue() for i in range(3)]
+        for buffer in buffers:
+            self.camera.subscribe(buffer)
+        for i in range(4):
+            self.camera.trigger()
+        frames = [self.get_frames(buffer, 4) for buffer in buffers]
+        for i in range(4):
+            self.assertIs(frames[0][i], frames[1][i])
+            self.assertIs(frames[0][i], frames[2][i])
+
+    def test_subscribers_and_client(self):
+        client = queue.Queue()
+        subscriber = queue.Queue()
+        self.camera.set_client(client)
+        self.camera.subscribe(subscriber, metadata=True)
+        self.camera.trigger()
+        data = client.get(timeout=5)
+        sub_data, metadata = subscriber.get(timeout=5)
+        self.assertIs(data, sub_data)
+        self.assertIsInstance(metadata, microscope.FrameMetadata)
+
+    def test_slow_subscriber_does_not_block_others(self):
+        blocked = threading.Event()
+        release = threading.Event()
+
+        class SlowClient:
+            def put(self, data):
+                blocked.set()
+                release.wait()
+
+        slow = SlowClient()
+        fast = queue.Queue()
+        self.camera.subscribe(slow, buffer_length=2)
+        self.camera.subscribe(fast)
+        self.addCleanup(release.set)
+        self.camera.trigger()
+        self.assertTrue(blocked.wait(5))
+        for i in range(9):
+            self.camera.trigger()
+        self.assertEqual(len(self.get_frames(fast, 10)), 10)
+        status = self.camera.get_buffer_status()["subscribers"]
+        slow_status = [s for s in status if s["client"] == str(slow)][0]
+        self.assertEqual(slow_status["length"], 2)
+        self.assertEqual(slow_status["dropped"], 7)
+
+    def test_pyro_subscribers(self):
+        @Pyro4.expose
+        class Receiver:
+            def __init__(self):
+                self.buffer = queue.Queue()
+
+            def receiveData(self, data, timestamp):
+                self.buffer.put(data)
+
+        daemon = Pyro4.Daemon()
+        receivers = [Receiver() for i in range(2)]
+        uris = [daemon.register(receiver) for receiver in receivers]
+        thread = threading.Thread(target=daemon.requestLoop)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(daemon.shutdown)
+        for uri in uris:
+            self.camera.subscribe(uri)
+        self.camera.trigger()
+        frames = [receiver.buffer.get(timeout=5) for receiver in receivers]
+        self.assertIsInstance(frames[0], np.ndarray)
+        np.testing.assert_array_equal(frames[0], frames[1])
+        for uri in uris:
+            self.camera.unsubscribe(uri)
+        self.assertEqual(self.camera.get_buffer_status()["subscribers"], [])
+
+    def test_unsubscribe(self):
+        buffer = queue.Queue()
+        self.camera.subscribe(buffer)
+        self.camera.trigger()
+        buffer.get(timeout=5)
+        self.camera.unsubscribe(buffer)
+        self.assertEqual(self.camera.get_buffer_status()["subscribers"], [])
+        self.camera.trigger()
+        with self.assertRaises(queue.Empty):
+            buffer.get(timeout=0.2)
+
+
+class TestGrabFrames(unittest.TestCase):
+    def setUp(self):
+        self.camera = simulators.SimulatedCamera(sensor_shape=(32, 16))
+        self.camera.set_exposure_time(0.0)
+        self.camera.enable()
+        self.addCleanup(self.camera.shutdown)
+
+    def test_grab_frames(self):
+        client = queue.Queue()
+        self.camera.set_client(client)
+        stack = self.camera.grab_frames(5, timeout=5)
+        self.assertEqual(stack.shape, (5, 16, 32))
+        frames = [client.get(timeout=5) for i in range(5)]
+        np.testing.assert_array_equal(stack, np.stack(frames))
+        self.assertEqual(self.camera.get_buffer_status()["subscribers"], [])
+
+    def test_hardware_triggers(self):
+        def trigger():
+            for i in range(3):
+                time.sleep(0.01)
+                self.camera.trigger()
+
+        thread = threading.Thread(target=trigger)
+        thread.start()
+        self.addCleanup(thread.join)
+        stack = self.camera.grab_frames(3, soft_trigger=False, timeout=5)
+        self.assertEqual(stack.shape, (3, 16, 32))
+
+    def test_timeout(self):
+        with self.assertRaisesRegex(TimeoutError, "0 of 2 frames"):
+            self.camera.grab_frames(2, soft_trigger=False, timeout=0.1)
+        self.assertEqual(self.camera.get_buffer_status()["subscribers"], [])
+
+    def test_disabled(self):
+        self.camera.disable()
+        with self.assertRaises(microscope.DisabledDeviceError):
+            self.camera.grab_frames(2)
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        self.camera = simulators.SimulatedCamera(sensor_shape=(32, 16))
+        self.camera.set_exposure_time(0.0)
+        self.camera.enable()
+        self.addCleanup(self.camera.shutdown)
+
+    def wait_for(self, key, value):
+        for i in range(500):
+            if self.camera.get_stats()[key] == value:
+                break
+            time.sleep(0.01)
+        return self.camera.get_stats()
+
+    def test_counts(self):
+        buffer = queue.Queue()
+        self.camera.set_client(buffer)
+        for i in range(3):
+            self.camera.trigger()
+            buffer.get(timeout=5)
+        stats = self.wait_for("dispatched", 3)
+        self.assertEqual(stats["fetched"], 3)
+        self.assertEqual(stats["dispatched"], 3)
+        self.assertEqual(stats["dropped"], 0)
+        self.assertEqual(stats["unclaimed"], 0)
+        self.assertEqual(stats["queue_length"], 0)
+        self.assertGreaterEqual(stats["queue_peak_length"], 1)
+        self.assertEqual(stats["fetch_to_dispatch"]["count"], 3)
+        self.assertEqual(stats["process_data"]["count"], 3)
+
+    def test_unclaimed(self):
+        self.camera.trigger()
+        stats = self.wait_for("unclaimed", 1)
+        self.assertEqual(stats["unclaimed"], 1)
+        self.assertEqual(stats["dispatched"], 0)
+
+    def test_fetch_errors(self):
+        fetch = self.camera._fetch_data
+        failed = []
+
+        def fail_once():
+            if not failed:
+                failed.append(True)
+                raise RuntimeError("fetch failed")
+            return fetch()
+
+        self.camera._fetch_data = fail_once
+        self.camera.trigger()
+        stats = self.wait_for("fetched", 1)
+        self.assertEqual(stats["fetch_errors"], 1)
+        self.assertEqual(stats["fetched"], 1)
+
+
+class TestBatchChanges(unittest.TestCase):
+    def setUp(self):
+        self.camera = simulators.SimulatedCamera(sensor_shape=(32, 16))
+        self.camera.enable()
+        self.addCleanup(self.camera.shutdown)
+        self.aborts = []
+        abort = self.camera.abort
+        self.camera.abort = lambda: self.aborts.append(True) or abort()
+
+    def test_single_restart(self):
+        with self.camera.batch_changes():
+            self.camera.set_roi(microscope.ROI(0, 0, 16, 8))
+            self.camera.set_binning(microscope.Binning(2, 2))
+            self.camera.set_setting("gain", 2)
+        self.assertEqual(len(self.aborts), 1)
+        self.assertTrue(self.camera._acquiring)
+        stats = self.camera.get_stats()
+        self.assertEqual(stats["reconfiguration"]["count"], 1)
+
+    def test_set_settings(self):
+        self.camera.set_settings(
+            {"roi": microscope.ROI(0, 0, 16, 8), "gain": 2}
+        )
+        self.assertEqual(len(self.aborts), 1)
+        self.assertTrue(self.camera._acquiring)
+
+    def test_live_setting(self):
+        self.camera.set_setting("gain", 2)
+        self.camera.set_settings({"gain": 3})
+        self.camera.update_settings({"gain": 4})
+        self.assertEqual(self.aborts, [])
+        self.assertEqual(self.camera.get_setting("gain"), 4)
+        self.assertEqual(
+            self.camera.get_stats()["reconfiguration"]["count"], 0
+        )
+
+    def test_live_and_not_live_settings(self):
+        self.camera.update_settings(
+            {"gain": 2, "roi": microscope.ROI(0, 0, 16, 8)}
+        )
+        self.assertEqual(len(self.aborts), 1)
+
+    def test_not_acquiring(self):
+        self.camera.abort()
+        self.aborts.clear()
+        with self.camera.batch_changes():
+            self.camera.set_roi(microscope.ROI(0, 0, 16, 8))
+        self.assertEqual(self.aborts, [])
+        self.assertFalse(self.camera._acquiring)
+        self.assertEqual(
+            self.camera.get_stats()["reconfiguration"]["count"], 0
+        )
+
+    def test_error_does_not_restart(self):
+        with self.assertRaises(RuntimeError):
+            with self.camera.batch_changes():
+                raise RuntimeError("failed")
+        self.assertFalse(self.camera._acquiring)
+        self.assertEqual(self.camera._batch_depth, 0)
+
+    def test_apply_changes_over_pyro(self):
+        # Like the device server, do not require Pyro4.expose.
+        patcher = unittest.mock.patch.object(
+            Pyro4.config, "REQUIRE_EXPOSE", False
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        daemon = Pyro4.Daemon()
+        uri = daemon.register(self.camera)
+        thread = threading.Thread(target=daemon.requestLoop, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(daemon.shutdown)
+        with Pyro4.Proxy(uri) as proxy:
+            errors = proxy.apply_changes(
+                roi=microscope.ROI(0, 0, 8, 4),
+                binning=microscope.Binning(2, 2),
+                exposure_time=0.01,
+                settings={"gain": 2},
+            )
+        self.assertEqual(errors, {"gain": None})
+        self.assertEqual(len(self.aborts), 1)
+        self.assertTrue(self.camera._acquiring)
+        self.assertEqual(self.camera.get_roi(), microscope.ROI(0, 0, 8, 4))
+        self.assertEqual(self.camera.get_binning(), microscope.Binning(2, 2))
+        self.assertEqual(self.camera.get_exposure_time(), 0.01)
+        self.assertEqual(self.camera.get_setting("gain"), 2)
+
+
+class TestFetchLoop(unittest.TestCase):
+    def count_fetches(self, device, duration):
+        fetch = device._fetch_data
+        calls = []
+
+        def counted_fetch():
+            calls.append(time.monotonic())
+            return fetch()
+
+        device._fetch_data = counted_fetch
+        device.enable()
+        self.addCleanup(device.shutdown)
+        time.sleep(duration)
+        return calls
+
+    def test_idle_notified_device_does_not_poll(self):
+        camera = simulators.SimulatedCamera()
+        calls = self.count_fetches(camera, 0.2)
+        self.assertLessEqual(len(calls), 1)
+
+    def test_notification_wakes_fetch(self):
+        camera = simulators.SimulatedCamera()
+        camera.set_exposure_time(0.0)
+        buffer = queue.Queue()
+        camera.set_client(buffer)
+        self.count_fetches(camera, 0.0)
+        time.sleep(0.1)
+        start = time.monotonic()
+        camera.trigger()
+        buffer.get(timeout=5)
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    def test_polling_device_backs_off(self):
+        dio = simulators.SimulatedDigitalIO(numLines=4)
+        calls = self.count_fetches(dio, 0.3)
+        # Without back-off, at the initial 0.1 ms wait, there would
+        # be thousands of calls.
+        self.assertLess(len(calls), 0.3 / dio._fetch_backoff_max + 20)
+
+    def test_disable_interrupts_wait(self):
+        camera = simulators.SimulatedCamera()
+        camera.enable()
+        start = time.monotonic()
+        camera.disable()
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertFalse(camera._fetch_thread.is_alive())
+
+    def test_errors_back_off(self):
+        camera = simulators.SimulatedCamera()
+        # Like devices that wait for data in _fetch_data.
+        camera._wait_for_data = lambda timeout: None
+
+        def failing_fetch():
+            raise RuntimeError("fetch failed")
+
+        camera._fetch_data = failing_fetch
+        calls = self.count_fetches(camera, 0.3)
+        self.assertLess(len(calls), 50)
+
+    def test_disable_between_check_and_clear(self):
+        camera = simulators.SimulatedCamera()
+
+        class RacingEvent(threading.Event):
+            race = False
+
+            def clear(self):
+                if self.race:
+                    # What disable does, just before the fetch thread
+                    # clears the event.
+                    camera._fetch_thread_run = False
+                    self.set()
+                super().clear()
+
+        camera._data_ready = RacingEvent()
+        camera.enable()
+        self.addCleanup(camera.shutdown)
+        time.sleep(0.1)
+        camera._data_ready.race = True
+        camera._notify_data_ready()
+        camera._fetch_thread.join(1.0)
+        self.assertFalse(camera._fetch_thread.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
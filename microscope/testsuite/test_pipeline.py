@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the processing of data before dispatch."""
+
+import queue
+import random
+import threading
+import time
+import unittest
+
+import numpy as np
+
+import microscope
+import microscope._pipeline
+from microscope import simulators
+
+
+class TestStages(unittest.TestCase):
+    def setUp(self):
+        self.data = np.arange(30, dtype=np.uint16).reshape(5, 6)
+
+    def test_crop(self):
+        stage = microscope._pipeline.CropStage(microscope.ROI(1, 2, 3, 2))
+        np.testing.assert_array_equal(stage(self.data), self.data[2:4, 1:4])
+
+    def test_crop_to_edge(self):
+        stage = microscope._pipeline.CropStage(microscope.ROI(4, 3, 0, 0))
+        np.testing.assert_array_equal(stage(self.data), self.data[3:, 4:])
+
+    def test_binning(self):
+        stage = microscope._pipeline.BinningStage(microscope.Binning(3, 2))
+        binned = stage(self.data)
+        self.assertEqual(binned.shape, (2, 2))
+        self.assertEqual(binned[0, 0], self.data[0:2, 0:3].sum())
+        self.assertEqual(binned[1, 1], self.data[2:4, 3:6].sum())
+
+    def test_background_clips(self):
+        background = np.full(self.data.shape, 10, dtype=np.uint16)
+        stage = microscope._pipeline.BackgroundStage(background)
+        subtracted = stage(self.data)
+        self.assertEqual(subtracted.dtype, self.data.dtype)
+        np.testing.assert_array_equal(
+            subtracted, np.clip(self.data.astype(int) - 10, 0, None)
+        )
+
+    def test_background_wrong_shape(self):
+        stage = microscope._pipeline.BackgroundStage(np.zeros((2, 2)))
+        self.assertIs(stage(self.data), self.data)
+
+    def test_statistics(self):
+        stage = microscope._pipeline.StatisticsStage()
+        self.assertIs(stage(self.data), self.data)
+        status = stage.get_status()
+        self.assertEqual(status["count"], 1)
+        self.assertEqual(
+            status["statistics"], {"min": 0, "max": 29, "mean": 14.5}
+        )
+
+
+class TestPreview(unittest.TestCase):
+    def test_make_preview(self):
+        data = np.arange(64 * 40, dtype=np.uint16).reshape(40, 64)
+        preview = microscope._pipeline.make_preview(data, max_size=16)
+        self.assertEqual(preview.dtype, np.uint8)
+        self.assertEqual(preview.shape, (10, 16))
+        self.assertEqual(preview.min(), 0)
+        self.assertEqual(preview.max(), 255)
+
+    def test_make_preview_value_range(self):
+        data = np.array([[0, 50], [100, 200]], dtype=np.uint16)
+        preview = microscope._pipeline.make_preview(
+            data, max_size=2, value_range=(0, 100)
+        )
+        np.testing.assert_array_equal(preview, [[0, 127], [255, 255]])
+
+    def test_make_preview_rgb(self):
+        data = np.zeros((40, 64, 3), dtype=np.uint8)
+        data[..., 0] = 200
+        data[:, :32, 1] = 100
+        preview = microscope._pipeline.make_preview(
+            data, max_size=16, value_range=(0, 200)
+        )
+        self.assertEqual(preview.shape, (10, 16, 3))
+        self.assertTrue((preview[..., 0] == 255).all())
+        self.assertTrue((preview[:, :8, 1] == 127).all())
+        self.assertFalse(preview[:, 8:, 1:].any())
+
+    def test_make_preview_constant(self):
+        data = np.full((4, 4), 7, dtype=np.uint16)
+        preview = microscope._pipeline.make_preview(data, max_size=4)
+        self.assertFalse(preview.any())
+
+    def test_camera_preview(self):
+        camera = simulators.SimulatedCamera(sensor_shape=(32, 16))
+        camera.set_exposure_time(0.0)
+        camera.set_setting("image pattern", 0)  # noise
+        camera.enable()
+        self.addCleanup(camera.shutdown)
+        full = queue.Queue()
+        preview = queue.Queue()
+        camera.set_client(full)
+        camera.subscribe_preview(preview, max_rate=2.0, max_size=8)
+        for i in range(5):
+            camera.trigger()
+        frames = [full.get(timeout=5) for i in range(5)]
+        self.assertEqual(frames[0].shape, (16, 32))
+        small = preview.get(timeout=5)
+        self.assertEqual(small.shape, (4, 8))
+        self.assertEqual(small.dtype, np.uint8)
+        # Triggered faster than the max rate so only one preview.
+        with self.assertRaises(queue.Empty):
+            preview.get(timeout=0.1)
+        [status] = camera.get_buffer_status()["subscribers"]
+        self.assertEqual(status["skipped"], 4)
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.delivered = queue.Queue()
+        self.pipeline = microscope._pipeline.Pipeline(
+            lambda data: data,
+            lambda data, context, err: self.delivered.put(
+                (data, context, err)
+            ),
+        )
+        self.addCleanup(self.pipeline.close)
+
+    def get_delivered(self, n):
+        return [self.delivered.get(timeout=5) for i in range(n)]
+
+    def test_inline_without_workers(self):
+        thread = []
+        self.pipeline.set_stages(
+            [
+                microscope._pipeline.FunctionStage(
+                    "record",
+                    lambda d: thread.append(threading.current_thread()) or d,
+                )
+            ]
+        )
+        self.pipeline.put(1, "a")
+        self.assertEqual(self.delivered.get_nowait(), (1, "a", None))
+        self.assertEqual(thread, [threading.current_thread()])
+
+    def test_order_kept_with_workers(self):
+        def sleep(data):
+            time.sleep(random.uniform(0, 0.01))
+            return data * 2
+
+        self.pipeline.set_stages(
+            [microscope._pipeline.FunctionStage("sleep", sleep)]
+        )
+        self.pipeline.set_workers(4)
+        for i in range(50):
+            self.pipeline.put(i, i)
+        delivered = self.get_delivered(50)
+        self.assertEqual([d[0] for d in delivered], [i * 2 for i in range(50)])
+        self.assertEqual([d[1] for d in delivered], list(range(50)))
+
+    def test_unprocessed_items_in_order(self):
+        self.pipeline.set_stages(
+            [
+                microscope._pipeline.FunctionStage(
+                    "slow", lambda d: time.sleep(0.05) or d
+                )
+            ]
+        )
+        self.pipeline.set_workers(2)
+        self.pipeline.put("processed", 0)
+        self.pipeline.put("error", 1, process=False)
+        delivered = self.get_delivered(2)
+        self.assertEqual([d[0] for d in delivered], ["processed", "error"])
+
+    def test_errors_delivered(self):
+        def fail(data):
+            raise ValueError(data)
+
+        self.pipeline.set_stages(
+            [microscope._pipeline.FunctionStage("fail", fail)]
+        )
+        self.pipeline.set_workers(2)
+        self.pipeline.put(1, "a")
+        data, context, err = self.delivered.get(timeout=5)
+        self.assertIsNone(data)
+        self.assertIsInstance(err, ValueError)
+
+    def test_put_while_changing_workers(self):
+        stop = threading.Event()
+
+        def change_workers():
+            n_workers = 0
+            while not stop.is_set():
+                n_workers = (n_workers + 1) % 3
+                self.pipeline.set_workers(n_workers)
+
+        thread = threading.Thread(target=change_workers)
+        thread.start()
+        try:
+            for i in range(200):
+                self.pipeline.put(i, i)
+        finally:
+            stop.set()
+            thread.join()
+        delivered = self.get_delivered(200)
+        self.assertEqual([d[1] for d in delivered], list(range(200)))
+
+    def test_stage_timings(self):
+        self.pipeline.set_stages(
+            [microscope._pipeline.FunctionStage("identity", lambda d: d)]
+        )
+        for i in range(3):
+            self.pipeline.put(i, i)
+        stages = self.pipeline.get_status()["stages"]
+        self.assertEqual(list(stages), ["process_data", "identity"])
+        self.assertEqual(stages["identity"]["count"], 3)
+
+
+class TestCameraProcessing(unittest.TestCase):
+    def setUp(self):
+        self.camera = simulators.SimulatedCamera(sensor_shape=(32, 16))
+        self.camera.set_exposure_time(0.0)
+        self.buffer = queue.Queue()
+        self.camera.set_client(self.buffer)
+        self.camera.enable()
+        self.addCleanup(self.camera.shutdown)
+
+    def grab(self):
+        self.camera.trigger()
+        return self.buffer.get(timeout=5)
+
+    def test_dispatch_survives_failed_put(self):
+        put = self.camera._pipeline.put
+
+        def fail_once(*args, **kwargs):
+            self.camera._pipeline.put = put
+            raise RuntimeError("cannot schedule new futures after shutdown")
+
+        self.camera._pipeline.put = fail_once
+        self.camera.trigger()
+        self.assertEqual(self.grab().shape, (16, 32))
+        self.assertEqual(self.camera.get_stats()["dispatch_errors"], 1)
+
+    def test_software_binning(self):
+        self.camera.set_setting("software binning", 4)
+        self.assertEqual(self.grab().shape, (4, 8))
+        self.assertEqual(self.camera.get_setting("software binning"), 4)
+
+    def test_subtract_background(self):
+        background = np.full((16, 32), np.iinfo(np.uint16).max, np.uint16)
+        self.camera.set_background(background)
+        self.camera.set_setting("subtract background", True)
+        self.assertFalse(self.grab().any())
+
+    def test_workers(self):
+        self.camera.set_setting("processing workers", 3)
+        self.camera.set_setting("software binning", 2)
+        self.camera.set_setting("frame statistics", True)
+        for i in range(10):
+            self.camera.trigger()
+        for i in range(10):
+            self.assertEqual(self.buffer.get(timeout=5).shape, (8, 16))
+        status = self.camera.get_processing_status()
+        self.assertEqual(status["workers"], 3)
+        self.assertEqual(
+            list(status["stages"]), ["process_data", "binning", "statistics"]
+        )
+        self.assertEqual(status["stages"]["binning"]["count"], 10)
+        self.assertIn("mean", status["stages"]["statistics"]["statistics"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+## This file is part of Microscope.
+##
+## Microscope is free software: you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation, either version 3 of the License, or
+## (at your option) any later version.
+##
+## Microscope is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with Microscope.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+import microscope
+import microscope.recording
+from microscope import simulators
+
+
+class TestMemmapRecorder(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.directory = os.path.join(tmpdir.name, "recording")
+
+    def test_chunks(self):
+        recorder = microscope.recording.MemmapRecorder(
+            self.directory, frames_per_chunk=4
+        )
+        frames = [np.full((3, 5), i, dtype=np.uint16) for i in range(10)]
+        for i, frame in enumerate(frames):
+            recorder.put((frame, microscope.FrameMetadata(sequence=i)))
+        recorder.close()
+        chunks = list(microscope.recording.read_chunks(self.directory))
+        self.assertEqual([len(c[0]) for c in chunks], [4, 4, 2])
+        np.testing.assert_array_equal(
+            np.concatenate([c[0] for c in chunks]), np.stack(frames)
+        )
+        sequences = [m["sequence"] for c in chunks for m in c[1]]
+        self.assertEqual(sequences, list(range(10)))
+        status = recorder.get_status()
+        self.assertEqual(status["frames"], 10)
+        self.assertEqual(status["chunks"], 3)
+        self.assertEqual(status["bytes"], 10 * frames[0].nbytes)
+
+    def test_new_chunk_on_shape_change(self):
+        recorder = microscope.recording.MemmapRecorder(self.directory)
+        recorder.put((np.zeros((2, 2), np.uint8), None))
+        recorder.put((np.zeros((4, 4), np.uint8), None))
+        recorder.close()
+        chunks = list(microscope.recording.read_chunks(self.directory))
+        self.assertEqual([c[0].shape for c in chunks], [(1, 2, 2), (1, 4, 4)])
+
+    def test_refuse_existing_recording(self):
+        recorder = microscope.recording.MemmapRecorder(self.directory)
+        recorder.put((np.zeros((2, 2)), None))
+        recorder.close()
+        with self.assertRaises(FileExistsError):
+            microscope.recording.MemmapRecorder(self.directory)
+
+
+class TestDeviceRecording(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.directory = tmpdir.name
+        self.camera = simulators.SimulatedCamera(sensor_shape=(32, 16))
+        self.camera.set_exposure_time(0.0)
+        self.camera.enable()
+        self.addCleanup(self.camera.shutdown)
+
+    def test_record(self):
+        self.camera.start_recording(self.directory, frames_per_chunk=3)
+        with self.assertRaises(microscope.IncompatibleStateError):
+            self.camera.start_recording(self.directory)
+        for i in range(7):
+            self.camera.trigger()
+        for i in range(500):
+            if self.camera.get_recording_status()["frames"] == 7:
+                break
+            time.sleep(0.01)
+        status = self.camera.stop_recording()
+        self.assertEqual(status["frames"], 7)
+        self.assertEqual(status["backlog"], 0)
+        self.assertEqual(status["dropped"], 0)
+        chunks = list(microscope.recording.read_chunks(self.directory))
+        self.assertEqual(sum(len(c[0]) for c in chunks), 7)
+        self.assertEqual(chunks[0][0].shape[1:], (16, 32))
+        self.assertEqual(chunks[0][1][0]["exposure_time"], 0.0)
+
+    def test_not_recording(self):
+        with self.assertRaises(microscope.IncompatibleStateError):
+            self.camera.get_recording_status()
+        with self.assertRaises(microscope.IncompatibleStateError):
+            self.camera.stop_recording()
+
+
+if __name__ == "__main__":
+    unittest.main()
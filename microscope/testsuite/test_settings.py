@@ -20,9 +20,17 @@
 """Tests for the microscope devices settings."""
 
 import enum
+import queue
+import threading
+import time
 import unittest
 
+import Pyro4
+
+import microscope
 import microscope.abc
+import microscope.clients  # configures Pyro to use pickle
+import microscope.simulators
 
 
 class EnumSetting(enum.Enum):
@@ -76,5 +84,445 @@ class TestEnumSetting(unittest.TestCase):
         self.assertEqual(EnumSetting(2), thing.val)
 
 
+class CountingThing(ThingWithSomething):
+    """Container that counts the number of reads."""
+
+    def __init__(self, val):
+        super().__init__(val)
+        self.reads = 0
+
+    def get_val(self):
+        self.reads += 1
+        return super().get_val()
+
+
+def create_cached_setting(cache):
+    thing = CountingThing(1)
+    setting = microscope.abc._Setting(
+        "foobar",
+        "int",
+        get_func=thing.get_val,
+        set_func=thing.set_val,
+        values=(0, 10),
+        cache=cache,
+    )
+    return setting, thing
+
+
+class TestSettingCache(unittest.TestCase):
+    def test_no_cache_by_default(self):
+        setting, thing = create_cached_setting(None)
+        setting.get()
+        setting.get()
+        self.assertEqual(thing.reads, 2)
+
+    def test_invalid_policy(self):
+        for cache in ["forever", -1.0, True]:
+            with self.assertRaises(ValueError):
+                create_cached_setting(cache)
+
+    def test_ttl(self):
+        setting, thing = create_cached_setting(0.2)
+        self.assertEqual(setting.get(), 1)
+        thing.val = 2  # changed behind the setting's back
+        self.assertEqual(setting.get(), 1)
+        self.assertEqual(thing.reads, 1)
+        time.sleep(0.25)
+        self.assertEqual(setting.get(), 2)
+        self.assertEqual(thing.reads, 2)
+
+    def test_set_clears_cache(self):
+        for cache in ["write", "static", 60.0]:
+            setting, thing = create_cached_setting(cache)
+            setting.get()
+            setting.set(3)
+            self.assertEqual(setting.get(), 3)
+            self.assertEqual(thing.reads, 2)
+
+    def test_write_policy(self):
+        setting, thing = create_cached_setting("write")
+        for i in range(5):
+            setting.get()
+        self.assertEqual(thing.reads, 1)
+        self.assertEqual((setting.cache_hits, setting.cache_misses), (4, 1))
+
+    def test_invalidate(self):
+        setting, thing = create_cached_setting("write")
+        setting.get()
+        thing.val = 2
+        setting.invalidate()
+        self.assertEqual(setting.get(), 2)
+
+
+class TestDeviceSettingsCache(unittest.TestCase):
+    def setUp(self):
+        self.device = microscope.simulators.SimulatedFilterWheel(positions=4)
+        self.things = {}
+        for name, cache in [("static", "static"), ("write", "write")]:
+            thing = CountingThing(1)
+            self.device.add_setting(
+                name, "int", thing.get_val, thing.set_val, (0, 10), cache=cache
+            )
+            self.things[name] = thing
+
+    def test_invalidate_all_keeps_static(self):
+        for name in self.things:
+            self.device.get_setting(name)
+        self.device.invalidate_settings_cache()
+        for name in self.things:
+            self.device.get_setting(name)
+        self.assertEqual(self.things["static"].reads, 1)
+        self.assertEqual(self.things["write"].reads, 2)
+
+    def test_invalidate_named(self):
+        self.device.get_setting("static")
+        self.device.invalidate_settings_cache(["static"])
+        self.device.get_setting("static")
+        self.assertEqual(self.things["static"].reads, 2)
+
+    def test_stats(self):
+        for i in range(4):
+            self.device.get_setting("write")
+        stats = self.device.get_settings_cache_stats()
+        self.assertEqual(set(stats), {"static", "write"})
+        self.assertEqual(
+            stats["write"],
+            {"policy": "write", "hits": 3, "misses": 1, "hit_rate": 0.75},
+        )
+        self.assertEqual(stats["static"]["hit_rate"], 0.0)
+
+
+class TestBatchSettings(unittest.TestCase):
+    def setUp(self):
+        self.device = microscope.simulators.SimulatedFilterWheel(positions=4)
+        self.things = {name: CountingThing(1) for name in ["a", "b", "c"]}
+        for name, thing in self.things.items():
+            self.device.add_setting(
+                name, "int", thing.get_val, thing.set_val, (0, 10)
+            )
+
+    def test_get_settings(self):
+        values = self.device.get_settings(["a", "b"])
+        self.assertEqual(values, {"a": 1, "b": 1})
+
+    def test_get_settings_partial_errors(self):
+        def fail():
+            raise RuntimeError("no")
+
+        self.device.add_setting("bad", "int", fail, None, (0, 10))
+        values = self.device.get_settings(["a", "bad", "unknown"])
+        self.assertEqual(values["a"], 1)
+        self.assertIsInstance(values["bad"], RuntimeError)
+        self.assertIsInstance(values["unknown"], KeyError)
+        self.assertIsNone(self.device.get_all_settings()["bad"])
+
+    def test_set_settings_partial_errors(self):
+        results = self.device.set_settings({"a": 5, "unknown": 2, "c": 7})
+        self.assertIsNone(results["a"])
+        self.assertIsInstance(results["unknown"], KeyError)
+        self.assertIsNone(results["c"])
+        self.assertEqual(self.things["a"].val, 5)
+        self.assertEqual(self.things["c"].val, 7)
+
+    def test_batch_hook(self):
+        requested = []
+
+        def read_batch(names):
+            requested.append(names)
+            return {"a": 8, "b": 9}
+
+        self.device._get_settings_batch = read_batch
+        self.assertEqual(
+            self.device.get_settings(["a", "b", "c"]), {"a": 8, "b": 9, "c": 1}
+        )
+        self.assertEqual(requested, [["a", "b", "c"]])
+        self.assertEqual(self.things["a"].reads, 0)
+        self.assertEqual(self.things["c"].reads, 1)
+
+    def test_batch_hook_skips_cached(self):
+        thing = CountingThing(1)
+        self.device.add_setting(
+            "cached", "int", thing.get_val, None, (0, 10), cache="static"
+        )
+        self.device.get_setting("cached")
+        requested = []
+        self.device._get_settings_batch = (
+            lambda names: requested.extend(names) or {}
+        )
+        self.device.get_settings(["a", "cached"])
+        self.assertEqual(requested, ["a"])
+
+    def test_batch_hook_fills_cache(self):
+        thing = CountingThing(1)
+        self.device.add_setting(
+            "cached", "int", thing.get_val, None, (0, 10), cache="static"
+        )
+        self.device._get_settings_batch = lambda names: {"cached": 4}
+        self.device.get_settings(["cached"])
+        self.assertEqual(self.device.get_setting("cached"), 4)
+        self.assertEqual(thing.reads, 0)
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        self.device = microscope.simulators.SimulatedLightSource()
+        self.addCleanup(self.device.shutdown)
+        self.thing = ThingWithSomething(1)
+        self.device.add_setting(
+            "foo", "int", self.thing.get_val, self.thing.set_val, (0, 10)
+        )
+        self.events = queue.Queue()
+
+    def get_events(self, n):
+        return [self.events.get(timeout=5) for i in range(n)]
+
+    def test_setting_events(self):
+        self.device.subscribe_events(self.events)
+        self.device.set_setting("foo", 3)
+        self.device.set_settings({"foo": 4})
+        events = self.get_events(2)
+        self.assertEqual(
+            [(e.name, e.value) for e in events], [("foo", 3), ("foo", 4)]
+        )
+        self.assertIsInstance(events[0], microscope.DeviceEvent)
+        self.assertLessEqual(events[0].timestamp, time.time())
+
+    def test_state_and_power_events(self):
+        self.device.subscribe_events(self.events)
+        self.device.enable()
+        self.device.power = 2.0
+        self.device.disable()
+        self.assertEqual(
+            [(e.name, e.value) for e in self.get_events(3)],
+            [("enabled", True), ("power", 1.0), ("enabled", False)],
+        )
+
+    def test_filter_names(self):
+        self.device.subscribe_events(self.events, names=["power"])
+        self.device.set_setting("foo", 3)
+        self.device.power = 0.5
+        [event] = self.get_events(1)
+        self.assertEqual(event.name, "power")
+        with self.assertRaises(queue.Empty):
+            self.events.get(timeout=0.1)
+
+    def test_unsubscribe(self):
+        self.device.subscribe_events(self.events)
+        self.device.unsubscribe_events(self.events)
+        self.device.set_setting("foo", 3)
+        with self.assertRaises(queue.Empty):
+            self.events.get(timeout=0.1)
+
+    def test_pyro_client(self):
+        @Pyro4.expose
+        class Receiver:
+            def __init__(self):
+                self.events = queue.Queue()
+
+            def receive_event(self, event):
+                self.events.put(event)
+
+        daemon = Pyro4.Daemon()
+        receiver = Receiver()
+        uri = daemon.register(receiver)
+        thread = threading.Thread(target=daemon.requestLoop)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(daemon.shutdown)
+        self.device.subscribe_events(uri)
+        self.device.set_setting("foo", 5)
+        event = receiver.events.get(timeout=5)
+        self.assertEqual((event.name, event.value), ("foo", 5))
+        self.device.unsubscribe_events(uri)
+
+
+class TestDescribeSettings(unittest.TestCase):
+    def setUp(self):
+        self.device = microscope.simulators.SimulatedFilterWheel(positions=4)
+        self.limits = (0, 10)
+        self.n_calls = 0
+
+        def values():
+            self.n_calls += 1
+            return self.limits
+
+        self.thing = ThingWithSomething(1)
+        self.device.add_setting(
+            "foo", "int", self.thing.get_val, self.thing.set_val, values
+        )
+
+    def test_cached(self):
+        first = self.device.describe_settings()
+        self.assertEqual(self.device.describe_settings(), first)
+        self.assertEqual(self.n_calls, 1)
+
+    def test_if_changed(self):
+        version, descriptions = self.device.describe_settings_if_changed(0)
+        self.assertEqual(descriptions, self.device.describe_settings())
+        self.assertEqual(
+            self.device.describe_settings_if_changed(version), (version, None)
+        )
+
+    def test_version_differs_between_instances(self):
+        # A client with the descriptions of a device that was
+        # restarted must not take them as current.
+        version, _ = self.device.describe_settings_if_changed(0)
+        other = microscope.simulators.SimulatedFilterWheel(positions=4)
+        other_version, descriptions = other.describe_settings_if_changed(
+            version
+        )
+        self.assertNotEqual(other_version, version)
+        self.assertEqual(descriptions, other.describe_settings())
+
+    def test_version_only_changes_with_description(self):
+        version, _ = self.device.describe_settings_if_changed(0)
+        self.device.set_setting("foo", 2)
+        self.assertEqual(
+            self.device.describe_settings_if_changed(version), (version, None)
+        )
+        self.assertEqual(self.n_calls, 2)
+        self.limits = (0, 5)
+        self.device.set_setting("foo", 3)
+        new_version, descriptions = self.device.describe_settings_if_changed(
+            version
+        )
+        self.assertNotEqual(new_version, version)
+        self.assertEqual(dict(descriptions)["foo"]["values"], (0, 5))
+
+    def test_invalidate(self):
+        self.device.describe_settings()
+        self.limits = (0, 5)
+        self.device.invalidate_settings_cache()
+        self.assertEqual(
+            dict(self.device.describe_settings())["foo"]["values"], (0, 5)
+        )
+
+    def test_new_setting(self):
+        version, _ = self.device.describe_settings_if_changed(0)
+        self.device.add_setting("bar", "bool", lambda: True, None, None)
+        new_version, descriptions = self.device.describe_settings_if_changed(
+            version
+        )
+        self.assertNotEqual(new_version, version)
+        self.assertIn("bar", dict(descriptions))
+
+
+class TestUpdateSettings(unittest.TestCase):
+    def setUp(self):
+        self.device = microscope.simulators.SimulatedFilterWheel(positions=4)
+        self.things = {name: CountingThing(1) for name in ["a", "b", "c"]}
+        self.written = []
+        for name, thing in self.things.items():
+            self.device.add_setting(
+                name,
+                "int",
+                thing.get_val,
+                self._recorder(name, thing),
+                (0, 10),
+                depends=["a"] if name == "b" else (),
+                verify=(name == "c"),
+            )
+
+    def _recorder(self, name, thing):
+        def set_val(value):
+            self.written.append(name)
+            thing.set_val(value)
+
+        return set_val
+
+    def test_only_changed_written(self):
+        results = self.device.update_settings({"a": 1, "c": 5})
+        self.assertEqual(self.written, ["c"])
+        self.assertEqual(results, {"c": 5})
+
+    def test_no_reads_when_cached(self):
+        things = {name: CountingThing(1) for name in ["x", "y"]}
+        for name, thing in things.items():
+            self.device.add_setting(
+                name,
+                "int",
+                thing.get_val,
+                thing.set_val,
+                (0, 10),
+                cache="write",
+                verify=(name == "y"),
+            )
+        self.device.update_settings({"x": 2, "y": 2})
+        reads = {name: thing.reads for name, thing in things.items()}
+        self.device.update_settings({"x": 2, "y": 3})
+        self.assertEqual(things["x"].reads, reads["x"])
+        # Only read back because it is marked with verify.
+        self.assertEqual(things["y"].reads, reads["y"] + 1)
+
+    def test_uncached_read_every_time(self):
+        self.device.update_settings({"a": 2, "b": 2, "c": 2})
+        reads = {name: thing.reads for name, thing in self.things.items()}
+        self.device.update_settings({"a": 2, "b": 2, "c": 2})
+        for name, thing in self.things.items():
+            self.assertEqual(thing.reads, reads[name] + 1)
+
+    def test_external_change_is_written(self):
+        self.device.update_settings({"a": 2})
+        # Changed by other means, e.g., on the hardware front panel.
+        self.things["a"].val = 5
+        results = self.device.update_settings({"a": 2})
+        self.assertEqual(results, {"a": 2})
+        self.assertEqual(self.things["a"].val, 2)
+        self.assertEqual(self.written, ["a", "a"])
+
+    def test_dependencies_first(self):
+        self.device.update_settings({"b": 3, "a": 3})
+        self.assertEqual(self.written, ["a", "b"])
+
+    def test_dependent_set_again(self):
+        self.device.update_settings({"a": 2, "b": 2})
+        self.written.clear()
+        self.device.update_settings({"a": 3, "b": 2})
+        self.assertEqual(self.written, ["a", "b"])
+
+    def test_circular_dependency(self):
+        self.device.add_setting(
+            "x", "int", lambda: 0, lambda v: None, (0, 10), depends=["y"]
+        )
+        self.device.add_setting(
+            "y", "int", lambda: 0, lambda v: None, (0, 10), depends=["x"]
+        )
+        with self.assertRaises(ValueError):
+            self.device.update_settings({"x": 1, "y": 1})
+
+    def test_invalidate_reads_again(self):
+        self.device.update_settings({"a": 2})
+        self.things["a"].val = 5
+        self.device.invalidate_settings_cache(["a"])
+        self.device.update_settings({"a": 2})
+        self.assertEqual(self.written, ["a", "a"])
+
+
+class TestSavedSettings(unittest.TestCase):
+    def setUp(self):
+        self.camera = microscope.simulators.SimulatedCamera()
+        self.addCleanup(self.camera.shutdown)
+        # Settings of a SimulatedCamera saved before the processing
+        # settings were added.
+        self.saved = {
+            "roi": microscope.ROI(left=0, top=0, width=512, height=512),
+            "image pattern": 0,
+            "image data type": 0,
+            "display image number": True,
+            "a_setting": 0,
+            "_error_percent": 0,
+            "gain": 0,
+        }
+
+    def test_replay_with_init(self):
+        self.camera.update_settings(self.saved, init=True)
+        self.assertEqual(self.camera.get_setting("software binning"), 1)
+
+    def test_missing_required_setting(self):
+        del self.saved["gain"]
+        with self.assertRaisesRegex(Exception, "missing keys: gain"):
+            self.camera.update_settings(self.saved, init=True)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -57,6 +57,9 @@ class RPiValueLogger(microscope.abc.ValueLogger):
     """ValueLogger device for a Raspberry Pi with support for
     MCP9808 and TSYS01 I2C thermometer chips."""
 
+    # New readings are notified from the updateTemps thread.
+    _fetch_backoff_max = None
+
     def __init__(self, sensors=[], **kwargs):
         super().__init__(**kwargs)
         # setup Q for fetching data.
@@ -175,6 +178,7 @@ class RPiValueLogger(microscope.abc.ValueLogger):
                     "Temperature-%s =  %s" % (i, self.temperature[i])
                 )
             self.inputQ.put(self.temperature)
+            self._notify_data_ready()
 
     def getValues(self):
         """Reads all sensor values for running the value logger in remote